@@ -7,12 +7,12 @@ import argparse
 from pathlib import Path
 from threading import Thread
 from dotenv import load_dotenv
-from colorlog import ColoredFormatter 
 
 
 from api.http import *
 from api.mqtt import *
 from api import database
+from tools import log_pipeline, metrics
 
 
 
@@ -36,17 +36,13 @@ MQTT_TOPIC_OUTPUT = None
 
 parser = argparse.ArgumentParser(description="Start e-scooter client.")
 parser.add_argument("--host", type=str, default="cm5.local", help="Server host (default: cm5.local)")
+parser.add_argument("--workers", type=int, default=int(os.getenv("HTTP_WORKERS", 1)), help="Number of worker processes (default: HTTP_WORKERS or 1)")
+parser.add_argument("--rebuild-balances", action="store_true", help="Recompute the funds of every user from the transactions ledger and exit")
 
 
 # Database configuration
 # The configuration is set in the environment variables.
-DB_CONFIG = {
-    'host':     os.getenv('DB_HOST', 'localhost'),
-    'user':     os.getenv('DB_USER', 'user'),
-    'password': os.getenv('DB_PASSWORD', 'password'),
-    'database': os.getenv('DB_NAME', 'database'),
-    'port':     3306,
-}
+DB_CONFIG = database.credentials_from_env()
 
 
 # Checks wether to use the production or test environment
@@ -75,21 +71,6 @@ else:
 
 
 
-# Sets the logging format and colors
-formatter = ColoredFormatter(
-    "%(log_color)s[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d in %(funcName)s()] %(message)s",
-    datefmt="%H:%M:%S",
-    log_colors={
-        'DEBUG':    'green',
-        'INFO':     'cyan',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'bold_red',
-    }
-)
-
-
-
 def start_http_server():
     """
     Starts the HTTP server using uvicorn.
@@ -100,6 +81,19 @@ def start_http_server():
 
 
 
+def start_http_workers(workers: int):
+    """
+    Starts the HTTP server with several worker processes, to use more than one core.
+    Every worker initializes its own database pool and MQTT client on start-up
+    (see api.http.init_worker), so nothing is started in this process, apart from
+    emptying the directory in which the workers share their metrics.
+    """
+    os.environ["HTTP_WORKERS"] = str(workers)
+    metrics.reset_shared()
+    uvicorn.run("api.http:app", host='0.0.0.0', port=HTTP_PORT, reload=False, loop="asyncio", workers=workers)
+
+
+
 def start_mqtt_client():
     """
     Starts the MQTT client.
@@ -111,7 +105,7 @@ def start_mqtt_client():
             "input":  MQTT_TOPIC_INPUT,
             "output": MQTT_TOPIC_OUTPUT
         }
-        client = mqtt_client(id=1000, host=MQTT_HOST, port=MQTT_PORT, topics=topics)
+        client = mqtt_client(id=MQTT_SERVER_ID, host=MQTT_HOST, port=MQTT_PORT, topics=topics)
         set_mqtt_client(client)
 
 
@@ -162,21 +156,11 @@ def start_db_client():
 def setup_logging():
     """
     Sets up the logging configuration.
-    The logging configuration is set to use the ColoredFormatter
-    and the logging level is set to DEBUG for development mode
-    and INFO for production mode.
-    """
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    logger = logging.getLogger()
-
-    if DEPLOYMENT_MODE == 'PROD':
-        logger.setLevel(logging.INFO)
-    else:
-        logger.setLevel(logging.DEBUG)
-    logger.addHandler(handler)
-    
-    return logger
+    Records are written by a background thread (see tools.log_pipeline), as coloured
+    text on a terminal and as JSON lines otherwise, and the logging level is set to
+    DEBUG for development mode and INFO for production mode.
+    """
+    return log_pipeline.setup(logging.INFO if DEPLOYMENT_MODE == 'PROD' else logging.DEBUG)
 
 
 def get_host_ip():
@@ -184,6 +168,24 @@ def get_host_ip():
     return args.host
 
 
+def get_workers():
+    args = parser.parse_args()
+    return max(1, args.workers)
+
+
+def rebuild_balances():
+    """
+    Maintenance command recomputing the funds of every user from the transactions
+    ledger (see database.db.rebuild_balances), e.g. after editing the ledger by hand.
+    Run it while no back-end is serving requests, as it rewrites every user.
+    """
+    db = database.db(DB_CONFIG)
+    try:
+        return db.rebuild_balances()
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     """
     Main function and entry point to start the application.
@@ -195,14 +197,24 @@ if __name__ == "__main__":
     global db_thread
 
     ip_address = get_host_ip()
+    workers = get_workers()
     logger = setup_logging()
 
+    if parser.parse_args().rebuild_balances:
+        logger.info(f"Rebuilding user balances from the ledger in {DB_CONFIG['host']}:{DB_CONFIG['port']}")
+        raise SystemExit(0 if rebuild_balances() else 1)
+
     logger.info(f"Starting {APP_NAME}")
     logger.info(55*"-")
     logger.info(f"{APP_AUTHORS}\n")
     logger.warning(f"App version: \t{APP_VERSION}")
     logger.warning(f"Deployment mode: \t{DEPLOYMENT_MODE}\n")
 
+    if workers > 1:
+        logger.info(f"Launching HTTP Server: \t{ip_address}:{HTTP_PORT} ({workers} worker processes)")
+        start_http_workers(workers)
+        raise SystemExit(0)
+
     logger.info(f"Launching HTTP Server: \t{ip_address}:{HTTP_PORT}")
     http_thread = Thread(target=start_http_server)
     http_thread.start()
@@ -1,20 +1,223 @@
+import os
+import time
+import uuid
+import queue
+import asyncio
 import logging
+import threading
+import functools
 import mysql.connector
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
+from tools import metrics
 from tools.singleton import singleton
 
 
+DB_POOL_SIZE       = int(os.getenv("DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT    = float(os.getenv("DB_POOL_TIMEOUT", 10.0))
+DB_POOL_IDLE_CHECK = float(os.getenv("DB_POOL_IDLE_CHECK", 30.0))
+DB_BATCH_SIZE      = int(os.getenv("DB_BATCH_SIZE", 500))
+
+
+
+def credentials_from_env() -> dict:
+    """
+    The database credentials configured through the DB_* environment variables.
+    """
+    return {
+        'host':     os.getenv('DB_HOST', 'localhost'),
+        'user':     os.getenv('DB_USER', 'user'),
+        'password': os.getenv('DB_PASSWORD', 'password'),
+        'database': os.getenv('DB_NAME', 'database'),
+        'port':     int(os.getenv('DB_PORT', 3306)),
+    }
+
+
+
+QUERY_SECONDS = metrics.histogram("escooter_db_query_seconds", "Time spent in a database method, including the wait for a pooled connection.", ("method",))
+QUERY_ERRORS  = metrics.counter("escooter_db_query_errors_total", "Database methods which raised an exception.", ("method",))
+
+RENTAL_ARCHIVE_COLUMNS = "id, user_id, scooter_id, is_active, start_time, end_time, total_price"
+
+LEDGER_INSERT = "INSERT INTO transactions (user_id, rental_id, amount, kind, idempotency_key) VALUES (%s, %s, %s, %s, %s)"
+ER_DUP_ENTRY  = 1062
+
+
+
+class _connection_pool:
+    """
+    Internal, thread-safe pool of MySQL connections used by the db class.
+    Connections are opened lazily up to the configured size, checked out for the
+    duration of a single query and returned afterwards. Instead of pinging the server
+    before every query, a connection is only health-checked on checkout if it has been
+    idle for longer than the configured idle-check interval.
+
+    Args:
+        credentials (dict): The database connection details.
+        size (int): The maximum number of open connections.
+        timeout (float): Seconds to wait for a free connection before giving up.
+        idle_check (float): Seconds of idleness after which a connection is pinged.
+    """
+
+    def __init__(self, credentials: dict, size: int, timeout: float, idle_check: float) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._credentials = credentials
+        self._size = max(1, size)
+        self._timeout = timeout
+        self._idle_check = idle_check
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+    def _open(self) -> object:
+        conn = mysql.connector.connect(**self._credentials)
+        conn.autocommit = True
+        self._logger.debug(f"Opened pooled database connection ({self._opened}/{self._size})")
+        return conn
+
+
+    def _revive(self, conn: object) -> object:
+        """
+        Ping a connection which has been idle for a while, replacing it if it is dead.
+        """
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return conn
+        except mysql.connector.Error as e:
+            self._logger.warning(f"Idle database connection is dead, reconnecting: {e}")
+            self._discard(conn)
+            return self._open()
+
+
+    def _discard(self, conn: object) -> None:
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+
+    def checkout(self) -> object:
+        """
+        Check out a connection from the pool. Opens a new connection if the pool has
+        not reached its size yet, otherwise waits for a connection to be returned.
+
+        ## Errors
+            Raises mysql.connector.errors.PoolError if no connection is returned within the timeout.
+        """
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self._size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return self._open()
+                except mysql.connector.Error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            try:
+                conn, last_used = self._idle.get(timeout=self._timeout)
+            except queue.Empty:
+                raise mysql.connector.errors.PoolError(
+                    f"No database connection available within {self._timeout} seconds"
+                )
+
+        if time.monotonic() - last_used > self._idle_check:
+            try:
+                conn = self._revive(conn)
+            except mysql.connector.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return conn
+
+
+    def checkin(self, conn: object, broken: bool=False) -> None:
+        """
+        Return a connection to the pool. Broken connections are closed and their slot
+        is freed so that the next checkout opens a fresh connection.
+        """
+        if broken:
+            self._discard(conn)
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put((conn, time.monotonic()))
+
+
+    def close(self) -> None:
+        """
+        Close all idle connections in the pool.
+        """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+            with self._lock:
+                self._opened -= 1
+
+
+
+
+def _timed(name: str, method: callable) -> callable:
+    """
+    Internal decorator observing the duration of a db method in QUERY_SECONDS.
+    """
+    seconds = QUERY_SECONDS.labels(name)
+    errors  = QUERY_ERRORS.labels(name)
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    return timed
+
+
+
+def _instrumented(cls: type) -> type:
+    """
+    Internal class decorator timing every public query method of the db class.
+    """
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not callable(attr) or name in ("close", "add_scooter_observer"):
+            continue
+        setattr(cls, name, _timed(name, attr))
+    return cls
+
 
 
 @singleton
+@_instrumented
 class db:
     """
     Database class for managing database connections and queries.
     This class is a singleton, meaning only one instance of it can exist at a time.
     It provides methods for connecting to the database, executing queries,
     and managing transactions.
-    The database connection is established using the credentials provided
-    during initialization.
+    Queries are executed on connections checked out from a pool of size DB_POOL_SIZE,
+    each with its own cursor, so that concurrent callers (HTTP handlers, the MQTT
+    network thread, etc.) hit the database in parallel instead of sharing one cursor.
+    The duration of every public method is recorded in the escooter_db_query_seconds
+    histogram, labelled with the method name.
 
     On first initialization, credentials must be provided.
     After that, the same instance will be used throughout the application meaning
@@ -67,23 +270,21 @@ class db:
             db = database.db(credentials=credentials)
             ```
         """
-        self._conn = None
-        self._cursor = None
+        self._pool = None
         self._logger = logging.getLogger(__name__)
+        self._scooter_observers = []
         if credentials is not None:
             db.credentials = credentials 
             self._connect(credentials)
         else:
             self._connect(db.credentials)
 
-        self.delete_inactive_rentals()
-
 
 
     def _connect(self: object, credentials) -> None:
         """
-        Connect to the database using the provided credentials.
-        If credentials are not provided, it will use the existing connection.
+        Set up the connection pool using the provided credentials and open
+        the first connection to verify them.
 
         Args:
             credentials (dict): A dictionary containing the database connection details.
@@ -97,35 +298,105 @@ class db:
             Raises an exception if the connection fails.
         """
         try:
-            self._conn = mysql.connector.connect(**credentials)
-            self._conn.autocommit = True
-            self._cursor = self._conn.cursor()
-            self._logger.debug("Connected to the database")
+            self._pool = _connection_pool(credentials, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_IDLE_CHECK)
+            self._pool.checkin(self._pool.checkout())
+            self._logger.debug(f"Connected to the database (pool size: {self._pool.size})")
         except mysql.connector.Error as e:
             self._logger.error(f"Error connecting to the database: {e}")
             raise
 
 
 
+    @contextmanager
+    def _session(self: object):
+        """
+        Internal context manager checking out a pooled connection and yielding a
+        fresh cursor for a single request. The connection is returned to the pool
+        when the block exits, or discarded if it turned out to be broken.
+
+        #### Example:
+        ```python
+        with self._session() as cursor:
+            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+            return cursor.fetchone()
+        ```
+        """
+        conn = self._pool.checkout()
+        broken = False
+        cursor = None
+        try:
+            cursor = conn.cursor(buffered=True)
+            yield cursor
+        except (mysql.connector.OperationalError, mysql.connector.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except mysql.connector.Error:
+                    broken = True
+            self._pool.checkin(conn, broken)
+
+
+
+    @contextmanager
+    def _transaction(self: object):
+        """
+        Internal context manager like _session(), but running the block as a single
+        transaction: it is committed when the block exits, or rolled back if it raises.
+
+        #### Example:
+        ```python
+        with self._transaction() as cursor:
+            cursor.execute("INSERT INTO rentals_archive SELECT * FROM rentals WHERE id = %s", (rental_id,))
+            cursor.execute("DELETE FROM rentals WHERE id = %s", (rental_id,))
+        ```
+        """
+        conn = self._pool.checkout()
+        broken = False
+        cursor = None
+        try:
+            conn.start_transaction()
+            cursor = conn.cursor(buffered=True)
+            yield cursor
+            conn.commit()
+        except BaseException as e:
+            broken = isinstance(e, (mysql.connector.OperationalError, mysql.connector.InterfaceError))
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                broken = True
+            raise
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except mysql.connector.Error:
+                    broken = True
+            self._pool.checkin(conn, broken)
+
+
+
     def close(self: object) -> None:
         """
-        Close the database connection and cursor.
+        Close all pooled database connections.
         This method should be called when the database operations are complete.
         """
-        if self._cursor:
-            self._cursor.close()
-        if self._conn:
-            self._conn.close()
+        if self._pool:
+            self._pool.close()
 
 
     def is_connection_alive(self):
         """
-        Check if the database connection is alive.
+        Check if the database is reachable through the pool.
         Returns:
             bool: True if the connection is alive, False otherwise.
         """
         try:
-            self._conn.ping(reconnect=True)
+            with self._session() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
             return True
         except mysql.connector.Error as e:
             return False
@@ -133,14 +404,39 @@ class db:
 
     def ensure_connection(self):
         """
-        Ensure that the database connection is alive.
-        If the connection is not alive, it will attempt to reconnect.
+        Ensure that the connection pool is set up.
+        Health checks of the individual connections are done by the pool on checkout,
+        so this is cheap to call and does not ping the database.
         """
-        if self._conn is None or self._cursor is None or not self.is_connection_alive():
+        if self._pool is None:
             self._connect(self.credentials)
 
 
 
+    def add_scooter_observer(self: object, callback) -> None:
+        """
+        Register a callback which is notified after every successful write to a scooter,
+        e.g. to keep an in-memory copy of the scooters table up to date.
+        Args:
+            callback (callable): Called as callback(scooter_id, lat, lon, status), where
+                lat and lon are None if the location was not changed.
+        """
+        self._scooter_observers.append(callback)
+
+
+
+    def _notify_scooter_observers(self: object, scooter_id: int, lat: float, lon: float, status: int) -> None:
+        """
+        Internal function notifying the scooter observers of a write to a scooter.
+        """
+        for callback in self._scooter_observers:
+            try:
+                callback(scooter_id, lat, lon, status)
+            except Exception as e:
+                self._logger.error(f"Error notifying scooter observer: {e}")
+
+
+
     def get_user(self: object, user_id: int) -> tuple[int, str, float]:
         """
         Get single user instance from the database by user ID.
@@ -154,10 +450,10 @@ class db:
             db.get_user(1) -> (1, "Kari Normann", 125.0)
             ```
         """
-        self.ensure_connection()
         query = "SELECT * FROM users WHERE id = %s"
-        self._cursor.execute(query, (user_id,))
-        return self._cursor.fetchone()
+        with self._session() as cursor:
+            cursor.execute(query, (user_id,))
+            return cursor.fetchone()
     
 
 
@@ -173,10 +469,10 @@ class db:
             db.get_scooter(1) -> (1, 63.41947, 10.40174, 0)
             ```
         """
-        self.ensure_connection()
         query = "SELECT * FROM scooters WHERE uuid = %s"
-        self._cursor.execute(query, (scooter_id,))
-        return self._cursor.fetchone()
+        with self._session() as cursor:
+            cursor.execute(query, (scooter_id,))
+            return cursor.fetchone()
     
 
 
@@ -192,10 +488,16 @@ class db:
             db.get_rental_by_id(1) -> (1, 2, 3, False, "2023-10-01 12:00:00", "2023-10-01 12:30:00", 15.0)
             ```
         """
-        self.ensure_connection()
         query = "SELECT * FROM rentals WHERE id = %s"
-        self._cursor.execute(query, (rental_id,))
-        return self._cursor.fetchone()
+        archive_query = f"SELECT {RENTAL_ARCHIVE_COLUMNS} FROM rentals_archive WHERE id = %s LIMIT 1"
+        with self._session() as cursor:
+            cursor.execute(query, (rental_id,))
+            rental = cursor.fetchone()
+            if rental is None:
+                # Completed rentals are moved to the archive after a while
+                cursor.execute(archive_query, (rental_id,))
+                rental = cursor.fetchone()
+            return rental
     
 
 
@@ -211,10 +513,10 @@ class db:
             db.get_active_rental_by_user(1) -> (5, 1, 3, True, "2023-10-01 12:00:00", None, 0.0)
             ```
         """
-        self.ensure_connection()
-        query = "SELECT * FROM rentals WHERE user_id = %s AND is_active = 1"
-        self._cursor.execute(query, (user_id,))
-        return self._cursor.fetchone()
+        query = "SELECT * FROM rentals WHERE user_id = %s AND is_active = 1 ORDER BY id DESC LIMIT 1"
+        with self._session() as cursor:
+            cursor.execute(query, (user_id,))
+            return cursor.fetchone()
     
 
 
@@ -230,13 +532,54 @@ class db:
             db.get_active_rental_by_scooter(1) -> (5, 1, 3, True, "2023-10-01 12:00:00", None, 0.0)
             ```
         """
-        self.ensure_connection()
-        query = "SELECT * FROM rentals WHERE scooter_id = %s AND is_active = 1"
-        self._cursor.execute(query, (scooter_id,))
-        return self._cursor.fetchone()
+        query = "SELECT * FROM rentals WHERE scooter_id = %s AND is_active = 1 ORDER BY id DESC LIMIT 1"
+        with self._session() as cursor:
+            cursor.execute(query, (scooter_id,))
+            return cursor.fetchone()
     
     
 
+    def rental_precheck(self: object, scooter_id: int, user_id: int) -> tuple[tuple, tuple, tuple, bool]:
+        """
+        Fetch everything needed to validate an unlock or lock request in a single round-trip:
+        the scooter, the user, the user's active rental and whether the scooter is rented.
+        Args:
+            scooter_id (int): The ID of the scooter.
+            user_id (int): The ID of the user.
+        Returns:
+            tuple:
+                * [0]: (tuple) The scooter, as returned by get_scooter, or None if not found.
+                * [1]: (tuple) The user, as returned by get_user, or None if not found.
+                * [2]: (tuple) The user's active rental, as returned by get_active_rental_by_user, or None.
+                * [3]: (bool) True if the scooter has an active rental, False otherwise.
+        Example:
+            ```python
+            db.rental_precheck(1, 1) -> ((1, 63.41947, 10.40174, 0), (1, "Kari Normann", 125.0), None, False)
+            ```
+        """
+        query = (
+            "SELECT s.uuid, s.latitude, s.longtitude, s.status, "
+            "u.id, u.name, u.funds, "
+            "r.id, r.user_id, r.scooter_id, r.is_active, r.start_time, r.end_time, r.total_price, "
+            "EXISTS(SELECT 1 FROM rentals sr WHERE sr.scooter_id = %s AND sr.is_active = 1) "
+            "FROM (SELECT 1) AS params "
+            "LEFT JOIN scooters s ON s.uuid = %s "
+            "LEFT JOIN users u ON u.id = %s "
+            "LEFT JOIN rentals r ON r.id = ("
+            "SELECT ur.id FROM rentals ur WHERE ur.user_id = %s AND ur.is_active = 1 ORDER BY ur.id DESC LIMIT 1"
+            ")"
+        )
+        with self._session() as cursor:
+            cursor.execute(query, (scooter_id, scooter_id, user_id, user_id))
+            row = cursor.fetchone()
+
+        scooter = row[0:4]  if row[0] is not None else None
+        user    = row[4:7]  if row[4] is not None else None
+        rental  = row[7:14] if row[7] is not None else None
+        return scooter, user, rental, row[14] > 0
+
+
+
     def rental_started(self:object, user_id: int, scooter_id: int) -> bool:
         """
         Start a rental for a user and scooter. Creates a new instance in db.rentals.
@@ -250,11 +593,10 @@ class db:
             db.rental_started(5, 6) -> True
             ```
         """
-        self.ensure_connection()
         query = "INSERT INTO rentals (user_id, scooter_id, is_active, start_time, end_time, total_price) VALUES (%s, %s, 1, UTC_TIMESTAMP(), NULL, 0.0)"
         try:
-            self._cursor.execute(query, (user_id, scooter_id))
-            self._conn.commit()
+            with self._session() as cursor:
+                cursor.execute(query, (user_id, scooter_id))
             return True
         except mysql.connector.Error as e:
             self._logger.error(f"Error starting rental: {e}")
@@ -262,6 +604,142 @@ class db:
         
 
 
+    def coride_precheck(self: object, scooter_ids: list[int], user_ids: list[int]) -> tuple[list, list, list]:
+        """
+        Fetch everything needed to validate a co-ride unlock in a single round-trip per
+        table, however many scooters the group has.
+        Args:
+            scooter_ids (list): The IDs of the scooters of the group.
+            user_ids (list): The IDs of the riders of the group.
+        Returns:
+            tuple:
+                * [0]: (list) The IDs of the given scooters which have an active rental.
+                * [1]: (list) The given users which exist, as returned by get_user.
+                * [2]: (list) The IDs of the given users which have an active rental.
+        Example:
+            ```python
+            db.coride_precheck([1, 2], [1, 2]) -> ([], [(1, "Kari Normann", 125.0), (2, "Ola Normann", 80.0)], [])
+            ```
+        """
+        scooter_ids = list(scooter_ids)
+        user_ids = list(dict.fromkeys(user_ids))
+        scooter_marks = ", ".join(["%s"] * len(scooter_ids))
+        user_marks = ", ".join(["%s"] * len(user_ids))
+        rental_query = (
+            f"SELECT scooter_id, user_id FROM rentals WHERE is_active = 1 "
+            f"AND (scooter_id IN ({scooter_marks}) OR user_id IN ({user_marks}))"
+        )
+        user_query = f"SELECT * FROM users WHERE id IN ({user_marks})"
+        with self._session() as cursor:
+            cursor.execute(rental_query, (*scooter_ids, *user_ids))
+            active = cursor.fetchall()
+            cursor.execute(user_query, tuple(user_ids))
+            users = cursor.fetchall()
+
+        scooters = set(scooter_ids)
+        riders = set(user_ids)
+        busy_scooters = sorted({row[0] for row in active if row[0] in scooters})
+        busy_users    = sorted({row[1] for row in active if row[1] in riders})
+        return busy_scooters, users, busy_users
+
+
+
+    def coride_started(self: object, leader_id: int, riders: list[tuple[int, int]], lat: float, lon: float) -> tuple[int, list]:
+        """
+        Start a co-ride: a session of the leader with one rental per scooter. The session,
+        the rentals and the corider rows are written in one transaction. The rentals are
+        inserted one by one, so each rental ID is taken from its own insert, and the
+        coriders with one batched insert.
+        Args:
+            leader_id (int): The ID of the user leading the group.
+            riders (list): Tuples of (user_id, scooter_id), one per scooter of the group.
+            lat (float): The latitude the group starts at.
+            lon (float): The longitude the group starts at.
+        Returns:
+            tuple: (session_id, rentals) where rentals are (rental_id, user_id, scooter_id)
+                in the order of riders; None if nothing was written.
+        Example:
+            ```python
+            db.coride_started(1, [(1, 5), (2, 6)], 63.41947, 10.40174) -> (3, [(41, 1, 5), (42, 2, 6)])
+            ```
+        """
+        session_query = "INSERT INTO multisession (user_id, start_time, end_time, isActive, longtitude, latitude) VALUES (%s, UTC_TIMESTAMP(), NULL, 1, %s, %s)"
+        rental_query  = "INSERT INTO rentals (user_id, scooter_id, is_active, start_time, end_time, total_price) VALUES (%s, %s, 1, UTC_TIMESTAMP(), NULL, 0.0)"
+        corider_query = "INSERT INTO corider (user_id, scooter_id, session_id, rental_id) VALUES (%s, %s, %s, %s)"
+        riders = [(int(user_id), int(scooter_id)) for user_id, scooter_id in riders]
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(session_query, (leader_id, lon, lat))
+                session_id = cursor.lastrowid
+                rentals = []
+                for user_id, scooter_id in riders:
+                    cursor.execute(rental_query, (user_id, scooter_id))
+                    rentals.append((cursor.lastrowid, user_id, scooter_id))
+                cursor.executemany(corider_query, [
+                    (user_id, scooter_id, session_id, rental_id) for rental_id, user_id, scooter_id in rentals
+                ])
+            self._logger.debug(f"Co-ride {session_id} started with {len(rentals)} scooters")
+            return session_id, rentals
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error starting co-ride: {e}")
+            return None
+
+
+
+    def get_active_coride(self: object, leader_id: int) -> tuple[tuple, list, int]:
+        """
+        Get the active co-ride led by a user.
+        Args:
+            leader_id (int): The ID of the user leading the group.
+        Returns:
+            tuple: (session, rentals, size) where session is the multisession row, rentals
+                are the active rentals of the group, as returned by get_rental_by_id, and
+                size is the number of scooters the group started with, ended rentals included;
+                None if the user leads no active co-ride.
+        Example:
+            ```python
+            db.get_active_coride(1) -> ((3, 1, datetime(...), None, 1, 10.40174, 63.41947), [(42, 2, 6, 1, ...)], 2)
+            ```
+        """
+        session_query = "SELECT * FROM multisession WHERE user_id = %s AND isActive = 1 ORDER BY id DESC LIMIT 1"
+        rental_query = (
+            "SELECT r.id, r.user_id, r.scooter_id, r.is_active, r.start_time, r.end_time, r.total_price "
+            "FROM corider c JOIN rentals r ON r.id = c.rental_id "
+            "WHERE c.session_id = %s AND r.is_active = 1 ORDER BY c.id"
+        )
+        size_query = "SELECT COUNT(*) FROM corider WHERE session_id = %s"
+        with self._session() as cursor:
+            cursor.execute(session_query, (leader_id,))
+            session = cursor.fetchone()
+            if session is None:
+                return None
+            cursor.execute(rental_query, (session[0],))
+            rentals = cursor.fetchall()
+            cursor.execute(size_query, (session[0],))
+            return session, rentals, cursor.fetchone()[0]
+
+
+
+    def coride_ended(self: object, session_id: int) -> bool:
+        """
+        Mark a co-ride session as ended. Its rentals are completed through complete_rentals.
+        Args:
+            session_id (int): The ID of the multisession.
+        Returns:
+            bool: True if the session was ended, False otherwise.
+        """
+        # start_time is set explicitly, as the column is updated to the current time by default
+        query = "UPDATE multisession SET isActive = 0, end_time = UTC_TIMESTAMP(), start_time = start_time WHERE id = %s"
+        try:
+            with self._session() as cursor:
+                cursor.execute(query, (session_id,))
+            return True
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error ending co-ride {session_id}: {e}")
+            return False
+
+
+
     def rental_completed(self:object, user_id: int, price: float, lat: float, lon: float, status: int) -> bool:
         """
         Complete a rental for a user and scooter. Updates the rental instance in db.rentals and the
@@ -278,7 +756,6 @@ class db:
             db.rental_completed(5, 15.0, {"latitude": 63.41947, "longitude": 10.40174}, 0) -> True
             ```
         """
-        self.ensure_connection()
         rental = self.get_active_rental_by_user(user_id)
         if rental is None:
             self._logger.error("Rental not found")
@@ -288,8 +765,8 @@ class db:
         query = "UPDATE rentals SET is_active = 0, end_time = NOW(), total_price = %s WHERE user_id = %s AND scooter_id = %s AND id = %s"
         self._logger.debug(f"Params: {price}, {user_id}, {scooter_id}, {rental_id}, {lat}, {lon}, {status}")
         try:
-            self._cursor.execute(query, (price, user_id, scooter_id, rental_id))
-            self._conn.commit()
+            with self._session() as cursor:
+                cursor.execute(query, (price, user_id, scooter_id, rental_id))
             self._logger.debug(f"Rental completed: {rental_id}")
         except mysql.connector.Error as e:
             self._logger.error(f"Error completing rental: {e}")
@@ -310,13 +787,13 @@ class db:
         Returns:
             bool: True if the scooter status was successfully updated, False otherwise.
         """
-        self.ensure_connection()
         query = "UPDATE scooters SET status = %s WHERE uuid = %s"
         self._logger.debug(f"update_scooter_status: params: {status}, {scooter_id}")
         try:
-            self._cursor.execute(query, (status, scooter_id))
-            self._conn.commit()
+            with self._session() as cursor:
+                cursor.execute(query, (status, scooter_id))
             self._logger.debug(f"Scooter info updated: {scooter_id}")
+            self._notify_scooter_observers(scooter_id, None, None, status)
             return True
         except mysql.connector.Error as e:
             self._logger.error(f"Error updating scooter info: {e}")
@@ -334,13 +811,13 @@ class db:
         Returns:
             bool: True if the scooter information was successfully updated, False otherwise.
         """
-        self.ensure_connection()
         query = "UPDATE scooters SET latitude = %s, longtitude = %s, status = %s WHERE uuid = %s"
         self._logger.debug(f"_update_scooter_info: params: {lat}, {lon}, {status}, {scooter_id}")
         try:
-            self._cursor.execute(query, (lat, lon, status, scooter_id))
-            self._conn.commit()
+            with self._session() as cursor:
+                cursor.execute(query, (lat, lon, status, scooter_id))
             self._logger.debug(f"Scooter info updated: {scooter_id}")
+            self._notify_scooter_observers(scooter_id, lat, lon, status)
             return True
         except mysql.connector.Error as e:
             self._logger.error(f"Error updating scooter info: {e}")
@@ -348,16 +825,48 @@ class db:
         
 
 
+    def update_scooters(self: object, scooters: list[tuple[int, float, float, int]]) -> bool:
+        """
+        Write the location and status of many scooters, in batches of DB_BATCH_SIZE rows
+        per round-trip. The rows are written as a multi-row upsert, which the connector
+        sends as a single statement per batch. Unlike the other scooter writes, this does
+        not notify the scooter observers, as it is used to persist their in-memory state.
+        Args:
+            scooters (list): Tuples of (scooter_id, lat, lon, status).
+        Returns:
+            bool: True if all scooters were successfully updated, False otherwise.
+        Example:
+            ```python
+            db.update_scooters([(1, 63.41947, 10.40174, 0), (2, 63.42947, 10.39174, 1)]) -> True
+            ```
+        """
+        query = (
+            "INSERT INTO scooters (uuid, latitude, longtitude, status) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE latitude = VALUES(latitude), longtitude = VALUES(longtitude), status = VALUES(status)"
+        )
+        params = list(scooters)
+        try:
+            with self._session() as cursor:
+                for i in range(0, len(params), max(1, DB_BATCH_SIZE)):
+                    cursor.executemany(query, params[i:i + DB_BATCH_SIZE])
+            self._logger.debug(f"Scooters updated: {len(params)}")
+            return True
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error updating scooters: {e}")
+            return False
+        
+
+
     def get_all_scooters(self: object) -> list[tuple[int, float, float, int]]:
         """
         Get all scooters from the database.
         Returns:
             list: A list of dictionaries containing scooter information.
         """
-        self.ensure_connection()
         query = "SELECT * FROM scooters"
-        self._cursor.execute(query)
-        return self._cursor.fetchall()
+        with self._session() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
     
 
 
@@ -367,10 +876,10 @@ class db:
         Returns:
             list: A list of dictionaries containing user information.
         """
-        self.ensure_connection()
         query = "SELECT * FROM users"
-        self._cursor.execute(query)
-        return self._cursor.fetchall()
+        with self._session() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
     
 
 
@@ -380,10 +889,10 @@ class db:
         Returns:
             list: A list of dictionaries containing rental information.
         """
-        self.ensure_connection()
         query = "SELECT * FROM rentals"
-        self._cursor.execute(query)
-        return self._cursor.fetchall()
+        with self._session() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
     
 
 
@@ -393,27 +902,99 @@ class db:
         Returns:
             list: A list of dictionaries containing active rental information.
         """
-        self.ensure_connection()
         query = "SELECT * FROM rentals WHERE is_active = 1"
-        self._cursor.execute(query)
-        return self._cursor.fetchall()
+        with self._session() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
 
 
 
-    def delete_inactive_rentals(self: object) -> bool:
+    def archive_rentals(self: object, batch_size: int, min_age: float) -> int:
         """
-        Delete all inactive rentals from the database.
+        Move one batch of completed rentals from db.rentals to db.rentals_archive.
+        Only rentals which ended more than min_age seconds ago are moved, so recently
+        completed rentals can still be looked up in the hot table. The batch is selected
+        with a plain read and then copied and deleted by primary key in a single short
+        transaction, so only the rows being moved are locked.
+        Args:
+            batch_size (int): The maximum number of rentals to move.
+            min_age (float): Seconds since the end of a rental before it is archived.
         Returns:
-            bool: True if the deletion was successful, False otherwise.
+            int: The number of rentals moved, or -1 if the batch failed.
+        Example:
+            ```python
+            while db.archive_rentals(1000, 86400) == 1000:
+                time.sleep(0.5)
+            ```
         """
-        self.ensure_connection()
-        query = "DELETE FROM rentals WHERE is_active = 0"
+        select_query = (
+            "SELECT id FROM rentals WHERE is_active = 0 "
+            "AND (end_time IS NULL OR end_time < NOW() - INTERVAL %s SECOND) "
+            "ORDER BY id LIMIT %s"
+        )
         try:
-            self._cursor.execute(query)
-            self._conn.commit()
+            with self._transaction() as cursor:
+                cursor.execute(select_query, (int(min_age), int(batch_size)))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return 0
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(
+                    f"INSERT IGNORE INTO rentals_archive ({RENTAL_ARCHIVE_COLUMNS}) "
+                    f"SELECT id, user_id, scooter_id, is_active, start_time, COALESCE(end_time, start_time, NOW()), total_price "
+                    f"FROM rentals WHERE id IN ({placeholders}) AND is_active = 0",
+                    ids
+                )
+                cursor.execute(f"DELETE FROM rentals WHERE id IN ({placeholders}) AND is_active = 0", ids)
+            self._logger.debug(f"Archived {len(ids)} rentals")
+            return len(ids)
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error archiving rentals: {e}")
+            return -1
+
+
+
+    def ensure_archive_partitions(self: object, months_ahead: int) -> bool:
+        """
+        Make sure db.rentals_archive has a monthly partition for the current month and the
+        given number of months ahead, by splitting them off the catch-all partition pmax.
+        Args:
+            months_ahead (int): The number of future months to create partitions for.
+        Returns:
+            bool: True if the partitions exist, False otherwise.
+        """
+        query = (
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'rentals_archive'"
+        )
+        try:
+            with self._session() as cursor:
+                cursor.execute(query)
+                existing = {row[0] for row in cursor.fetchall()}
+                if "pmax" not in existing:
+                    self._logger.error("Table rentals_archive is missing its pmax partition")
+                    return False
+
+                now = time.gmtime()
+                missing = []
+                for offset in range(months_ahead + 1):
+                    year, month = divmod(now.tm_year * 12 + now.tm_mon - 1 + offset, 12)
+                    name = f"p{year:04d}{month + 1:02d}"
+                    if name not in existing:
+                        upper_year, upper_month = divmod(year * 12 + month + 1, 12)
+                        missing.append(
+                            f"PARTITION {name} VALUES LESS THAN "
+                            f"(UNIX_TIMESTAMP('{upper_year:04d}-{upper_month + 1:02d}-01 00:00:00'))"
+                        )
+                if missing:
+                    cursor.execute(
+                        f"ALTER TABLE rentals_archive REORGANIZE PARTITION pmax INTO "
+                        f"({', '.join(missing)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+                    )
+                    self._logger.info(f"Added {len(missing)} partitions to rentals_archive")
             return True
         except mysql.connector.Error as e:
-            self._logger.error(f"Error deleting inactive rentals: {e}")
+            self._logger.error(f"Error adding partitions to rentals_archive: {e}")
             return False
         
 
@@ -422,7 +1003,7 @@ class db:
         """
         Get all scooters near a given location.
         Args:
-            location (dict): A dictionary containing the latitude+-0.1 and longitude+-0.1 of the location.
+            location (dict): A dictionary containing the latitude and longitude of the location (matched +-0.01).
         Returns:
             tuple: A list containing tuples containing scooter information.
         Example:
@@ -431,12 +1012,12 @@ class db:
             [(1, 63.40947, 10.41174, 0), (2, 63.42947, 10.39174, 0)]
             ```
         """
-        self.ensure_connection()
-        query = "SELECT * FROM scooters WHERE latitude BETWEEN %s AND %s AND longtiude BETWEEN %s AND %s"
+        query = "SELECT * FROM scooters WHERE latitude BETWEEN %s AND %s AND longtitude BETWEEN %s AND %s"
         latitude = location["latitude"]
         longitude = location["longitude"]
-        self._cursor.execute(query, (latitude - 0.01, latitude + 0.01, longitude - 0.01, longitude + 0.01))
-        return self._cursor.fetchall()
+        with self._session() as cursor:
+            cursor.execute(query, (latitude - 0.01, latitude + 0.01, longitude - 0.01, longitude + 0.01))
+            return cursor.fetchall()
     
 
 
@@ -453,14 +1034,15 @@ class db:
             db.add_user("John Doe", 350.0) -> True
             ```
         """
-        self.ensure_connection()
         if funds < 0:
             self._logger.error("Funds cannot be negative")
             return False
         query = "INSERT INTO users (name, funds) VALUES (%s, %s)"
         try:
-            self._cursor.execute(query, (name, funds))
-            self._conn.commit()
+            with self._transaction() as cursor:
+                cursor.execute(query, (name, funds))
+                user_id = cursor.lastrowid
+                cursor.execute(LEDGER_INSERT, (user_id, None, funds, "opening", f"opening-{user_id}"))
             return True
         except mysql.connector.Error as e:
             self._logger.error(f"Error adding user: {e}")
@@ -482,11 +1064,10 @@ class db:
             db.add_scooter(63.41947, 10.40174, 0) -> True
             ```
         """
-        self.ensure_connection()
         query = "INSERT INTO scooters (latitude, longtitude, status) VALUES (%s, %s, %s)"
         try:
-            self._cursor.execute(query, (latitude, longitude, status))
-            self._conn.commit()
+            with self._session() as cursor:
+                cursor.execute(query, (latitude, longitude, status))
             return True
         except mysql.connector.Error as e:
             self._logger.error(f"Error adding scooter: {e}")
@@ -494,14 +1075,18 @@ class db:
         
 
 
-    def charge_user(self: object, user_id: int, amount: float) -> bool:
+    def charge_user(self: object, user_id: int, amount: float, idempotency_key: str=None) -> bool:
         """
         Charge a user by reducing funds to their account.
+        The charge is recorded in the transactions ledger together with the new balance,
+        in one database transaction. A charge with an idempotency key which has already
+        been recorded is not applied again.
         Args:
             user_id (int): The ID of the user to charge.
             amount (float): The amount to charge the user.
+            idempotency_key (str): Unique key of the charge, or None to generate one.
         Returns:
-            bool: True if the user was successfully charged, False otherwise.
+            bool: True if the user was successfully charged (now or before), False otherwise.
         Example:
             ```python
             db.get_user(1) -> (1, "Kari Normann", 125.0)
@@ -511,29 +1096,22 @@ class db:
             db.get_user(1) -> (1, "Kari Normann", 75.0)
             ```
         """
-        self.ensure_connection()
         if amount <= 0:
             self._logger.error("Charge amount cannot be negative")
             return False
-        query = "UPDATE users SET funds = funds - %s WHERE id = %s"
-        try:
-            self._cursor.execute(query, (amount, user_id))
-            self._conn.commit()
-            return True
-        except mysql.connector.Error as e:
-            self._logger.error(f"Error charging user: {e}")
-            return False
+        return self._post_transaction(user_id, -amount, "charge", idempotency_key or f"charge-{uuid.uuid4().hex}")
         
 
 
-    def user_deposit(self: object, user_id: int, amount: float) -> bool:
+    def user_deposit(self: object, user_id: int, amount: float, idempotency_key: str=None) -> bool:
         """
-        Deposit funds to a user's account.
+        Deposit funds to a user's account, recorded in the transactions ledger.
         Args:
             user_id (int): The ID of the user to deposit funds to.
             amount (float): The amount to deposit.
+            idempotency_key (str): Unique key of the deposit, or None to generate one.
         Returns:
-            bool: True if the deposit was successful, False otherwise.
+            bool: True if the deposit was successful (now or before), False otherwise.
         Example:
             ```python
             db.get_user(1) -> (1, "Kari Normann", 125.0)
@@ -543,23 +1121,135 @@ class db:
             db.get_user(1) -> (1, "Kari Normann", 175.0)
             ```
         """
-        self.ensure_connection()
         if amount <= 0:
             self._logger.error("Deposit amount cannot be negative")
             return False
-        query = "UPDATE users SET funds = funds + %s WHERE id = %s"
+        return self._post_transaction(user_id, amount, "deposit", idempotency_key or f"deposit-{uuid.uuid4().hex}")
+
+
+
+    def _post_transaction(self: object, user_id: int, amount: float, kind: str, idempotency_key: str) -> bool:
+        """
+        Internal function appending an entry to the transactions ledger and applying it to
+        the user's balance in one database transaction. An entry whose idempotency key
+        is already in the ledger is skipped.
+        """
+        try:
+            with self._transaction() as cursor:
+                if not self._append_ledger(cursor, user_id, None, amount, kind, idempotency_key):
+                    self._logger.warning(f"Transaction {idempotency_key} already recorded")
+                    return True
+                cursor.execute("UPDATE users SET funds = funds + %s WHERE id = %s", (amount, user_id))
+            return True
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error recording {kind} for user {user_id}: {e}")
+            return False
+
+
+
+    def _append_ledger(self: object, cursor: object, user_id: int, rental_id: int, amount: float, kind: str, idempotency_key: str) -> bool:
+        """
+        Internal function appending an entry to the transactions ledger.
+        Returns:
+            bool: True if the entry was appended, False if its idempotency key was already recorded.
+        """
+        try:
+            cursor.execute(LEDGER_INSERT, (user_id, rental_id, amount, kind, idempotency_key))
+            return True
+        except mysql.connector.IntegrityError as e:
+            if e.errno == ER_DUP_ENTRY:
+                return False
+            raise
+
+
+
+    def complete_rentals(self: object, rentals: list[tuple]) -> list[bool]:
+        """
+        Complete and charge many rentals in a single database transaction, i.e. with a
+        single commit for the whole batch. For every rental, the charge is appended to the
+        transactions ledger with the idempotency key "rental-<rental_id>", and the rental,
+        the user's balance and the scooter are updated. A rental whose charge is already
+        in the ledger was completed before and is skipped, so retries never charge twice.
+        A rental which is not active (or does not exist) is rolled back to a savepoint,
+        so its user is not charged, without failing the rest of the batch.
+        Args:
+            rentals (list): Tuples of (rental_id, user_id, price, lat, lon, status).
+        Returns:
+            list: For every rental, in the order given, True if it is completed and charged
+                (now or before), False if it was not active; None if the batch failed and
+                nothing was written.
+        Example:
+            ```python
+            db.complete_rentals([(5, 1, 25.0, 63.41947, 10.40174, 0)]) -> [True]
+            db.complete_rentals([(5, 1, 25.0, 63.41947, 10.40174, 0)]) -> [True]  # not charged again
+            db.complete_rentals([(9, 1, 25.0, 63.41947, 10.40174, 0)]) -> [False] # not an active rental
+            ```
+        """
+        rental_query  = "UPDATE rentals SET is_active = 0, end_time = NOW(), total_price = %s WHERE id = %s AND is_active = 1"
+        scooter_query = "UPDATE scooters SET latitude = %s, longtitude = %s, status = %s WHERE uuid = %s"
+        results = [False] * len(rentals)
+        completed = []
+        try:
+            with self._transaction() as cursor:
+                # Lock the users in a fixed order, so concurrent batches cannot deadlock
+                for index in sorted(range(len(rentals)), key=lambda index: rentals[index][1]):
+                    rental_id, user_id, price, lat, lon, status = rentals[index]
+                    price = max(price, 0.0)
+                    cursor.execute("SAVEPOINT complete_rental")
+                    if not self._append_ledger(cursor, user_id, rental_id, -price, "charge", f"rental-{rental_id}"):
+                        self._logger.warning(f"Rental {rental_id} already charged, skipping")
+                        results[index] = True
+                        continue
+                    cursor.execute(rental_query, (price, rental_id))
+                    if cursor.rowcount == 0:
+                        cursor.execute("ROLLBACK TO SAVEPOINT complete_rental")
+                        self._logger.warning(f"Rental {rental_id} is not active, not charging user {user_id}")
+                        continue
+                    cursor.execute("UPDATE users SET funds = funds - %s WHERE id = %s", (price, user_id))
+                    cursor.execute("SELECT scooter_id FROM rentals WHERE id = %s", (rental_id,))
+                    scooter_id = cursor.fetchone()[0]
+                    cursor.execute(scooter_query, (lat, lon, status, scooter_id))
+                    completed.append((scooter_id, lat, lon, status))
+                    results[index] = True
+        except mysql.connector.Error as e:
+            self._logger.error(f"Error completing rentals: {e}")
+            return None
+
+        for scooter_id, lat, lon, status in completed:
+            self._notify_scooter_observers(scooter_id, lat, lon, status)
+        self._logger.debug(f"Completed {len(completed)} of {len(rentals)} rentals in one transaction")
+        return results
+
+
+
+    def rebuild_balances(self: object) -> bool:
+        """
+        Recompute the balance of every user from the transactions ledger.
+        The funds column of db.users is a cache of the sum of a user's ledger entries;
+        this repairs it after manual changes or partial failures. It rewrites every user,
+        so it is only run as a maintenance command (python . --rebuild-balances).
+        Returns:
+            bool: True if the balances were rebuilt, False otherwise.
+        """
+        query = (
+            "UPDATE users u LEFT JOIN ("
+            "SELECT user_id, SUM(amount) AS balance FROM transactions GROUP BY user_id"
+            ") t ON t.user_id = u.id SET u.funds = COALESCE(t.balance, 0)"
+        )
         try:
-            self._cursor.execute(query, (amount, user_id))
-            self._conn.commit()
+            with self._transaction() as cursor:
+                cursor.execute(query)
+            self._logger.debug("Rebuilt user balances from the ledger")
             return True
         except mysql.connector.Error as e:
-            self._logger.error(f"Error depositing to user: {e}")
+            self._logger.error(f"Error rebuilding balances: {e}")
             return False
         
 
     def user_has_active_rental(self: object, user_id: int) -> bool:
         """
         Check if a user has an active rental.
+        Answered from the (user_id, is_active) index without reading the rental row.
         Args:
             user_id (int): The ID of the user to check.
         Returns:
@@ -569,15 +1259,16 @@ class db:
             db.user_has_active_rental(1) -> True
             ```
         """
-        self.ensure_connection()
-        query = "SELECT COUNT(*) FROM rentals WHERE user_id = %s AND is_active = 1"
-        self._cursor.execute(query, (user_id,))
-        return self._cursor.fetchone()[0] > 0
+        query = "SELECT EXISTS(SELECT 1 FROM rentals WHERE user_id = %s AND is_active = 1)"
+        with self._session() as cursor:
+            cursor.execute(query, (user_id,))
+            return cursor.fetchone()[0] > 0
     
 
     def scooter_has_active_rental(self: object, scooter_id: int) -> bool:
         """
         Check if a scooter has an active rental.
+        Answered from the (scooter_id, is_active) index without reading the rental row.
         Args:
             scooter_id (int): The ID of the scooter to check.
         Returns:
@@ -587,7 +1278,44 @@ class db:
             db.scooter_has_active_rental(1) -> True
             ```
         """
-        self.ensure_connection()
-        query = "SELECT COUNT(*) FROM rentals WHERE scooter_id = %s AND is_active = 1"
-        self._cursor.execute(query, (scooter_id,))
-        return self._cursor.fetchone()[0] > 0
+        query = "SELECT EXISTS(SELECT 1 FROM rentals WHERE scooter_id = %s AND is_active = 1)"
+        with self._session() as cursor:
+            cursor.execute(query, (scooter_id,))
+            return cursor.fetchone()[0] > 0
+
+
+
+@singleton
+class async_db:
+    """
+    Awaitable facade for the db class, used by the asyncio request pipeline.
+    Every public method of db is available as a coroutine which runs the query on a
+    dedicated executor sized to the connection pool, so the event loop keeps serving
+    other requests while the query is in flight.
+
+    #### Example:
+    ```python
+    from api.database import async_db
+
+    scooter, user = await asyncio.gather(
+        async_db().get_scooter(1),
+        async_db().get_user(1),
+    )
+    ```
+    """
+
+    def __init__(self, db_client: db=None) -> None:
+        self._db = db_client if db_client is not None else db()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, DB_POOL_SIZE), thread_name_prefix="db")
+
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._db, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+
+        return call
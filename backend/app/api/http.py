@@ -1,37 +1,108 @@
 import os
+import json
+import asyncio
 import logging
+import functools
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi.staticfiles import StaticFiles
 from fastapi.encoders import jsonable_encoder
 from fastapi import FastAPI, Response, Request, Query, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 from logic import weather
+from logic.weather_client import weather_client
+from api import mqtt, database
+from api.ledger import ledger
+from api.scooter_state import scooter_state
 from service import single_ride_service, multi_ride_service
+from service.rental_events import rental_events
+from service.archive_service import archive_service
+from service.weather_prefetch_service import weather_prefetch_service
+from tools import metrics, log_pipeline
+from tools.primary_worker import primary_worker
+from tools.route_limiter import route_limiter, overloaded
 
 
 DEPLOYMENT_MODE = os.getenv('DEPLOYMENT_MODE', 'TEST')
 DISABLE_MQTT    = os.getenv("DISABLE_MQTT", "False").lower() == "true"
+RENTAL_STREAM_KEEPALIVE = float(os.getenv("RENTAL_STREAM_KEEPALIVE", "15"))
+NEARBY_MAX_RADIUS = float(os.getenv("NEARBY_MAX_RADIUS", "10000"))
+NEARBY_MAX_LIMIT  = int(os.getenv("NEARBY_MAX_LIMIT", "100"))
+HTTP_EXECUTOR_WORKERS = int(os.getenv("HTTP_EXECUTOR_WORKERS", "16"))
+HTTP_READ_CONCURRENCY = int(os.getenv("HTTP_READ_CONCURRENCY", str(HTTP_EXECUTOR_WORKERS)))
+HTTP_RIDE_CONCURRENCY = int(os.getenv("HTTP_RIDE_CONCURRENCY", "4096"))
+HTTP_QUEUE_WAIT       = float(os.getenv("HTTP_QUEUE_WAIT", "0.1"))
+HTTP_RETRY_AFTER      = int(os.getenv("HTTP_RETRY_AFTER", "1"))
+HTTP_WORKERS          = int(os.getenv("HTTP_WORKERS", "1"))
 
 TEST_COORDINATES = (63.41947, 10.40174)
 
 logger = logging.getLogger(__name__)
 
+# Blocking service calls run on their own pool, never on the event loop. Unlocks and
+# locks (slow, waiting for scooters) and reads are limited separately, so a burst of
+# unlocks cannot starve the reads; a request finding no free slot gets a 503.
+# Reads hold an executor thread, so their limit matches the executor. Unlocks and locks
+# are coroutines which hold no thread while they wait up to MQTT_LOCK_TIMEOUT for a
+# scooter (their database calls are bounded by the database pool instead), so their
+# limit is sized for thousands of pending rides and only guards against unbounded memory.
+executor = ThreadPoolExecutor(max_workers=max(1, HTTP_EXECUTOR_WORKERS), thread_name_prefix="http")
+ride_limiter = route_limiter("rides", HTTP_RIDE_CONCURRENCY, HTTP_QUEUE_WAIT, HTTP_RETRY_AFTER)
+read_limiter = route_limiter("reads", HTTP_READ_CONCURRENCY, HTTP_QUEUE_WAIT, HTTP_RETRY_AFTER)
+
+metrics.gauge(
+    "escooter_http_requests_in_flight", "Requests being handled, by route group.", ("limiter",),
+    callback=lambda: {(limiter.name,): limiter.in_flight for limiter in (ride_limiter, read_limiter)}
+)
+metrics.counter(
+    "escooter_http_requests_rejected_total", "Requests answered with 503 because all slots were busy.", ("limiter",),
+    callback=lambda: {(limiter.name,): limiter.rejected for limiter in (ride_limiter, read_limiter)}
+)
+metrics.gauge("escooter_http_executor_backlog", "Blocking calls waiting for an HTTP executor thread.", callback=lambda: executor._work_queue.qsize())
+
+def start_background_jobs() -> None:
+    """
+    Start the background jobs which run in one process only: archiving rentals (which
+    creates partitions) and prefetching forecasts (whose verdicts are relayed to the
+    other workers, see mqtt_client._relay_forecast).
+    """
+    logger.debug("Starting rental archive service")
+    archive_service().start()
+    if not weather.DISABLE_WEATHER:
+        logger.debug("Starting weather prefetch service")
+        weather_prefetch_service().start()
+
+# With several worker processes, only the elected primary worker runs the background jobs
+primary = primary_worker(start_background_jobs)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if HTTP_WORKERS > 1:
+        init_worker()
     set_single_ride_service()
     set_multi_ride_service()
+    if HTTP_WORKERS > 1:
+        primary.start()
+    else:
+        start_background_jobs()
 
     logger.debug("Initializing single ride service")
     logger.debug("Initializing multi ride service")
     
     yield
 
-    app.state.db_client.delete_inactive_rentals()
+    archive_service().stop()
+    weather_prefetch_service().stop()
+    primary.stop()
     # app.state.db_client.close()
     app.state.mqtt_client.stop()
+    ledger().stop()
+    scooter_state().stop()
+    executor.shutdown(wait=False, cancel_futures=True)
+    await weather_client().aclose()
 
     logger.error("Stopping DB client")
     logger.error("Stopping MQTT client")
@@ -44,6 +115,27 @@ api_router = APIRouter()
 
 
 
+@app.exception_handler(overloaded)
+async def overloaded_handler(request: Request, exc: overloaded):
+    """
+    Answer requests rejected by a route_limiter with 503 and a Retry-After header.
+    """
+    return JSONResponse(
+        content={"message": "server busy, try again later", "redirect": "server-busy"},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+
+async def run_blocking(func, *args):
+    """
+    Run a blocking service call on the HTTP executor, keeping the event loop free.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -61,10 +153,11 @@ frontend_path = "/frontend/app/dist"
 index_file = os.path.join(frontend_path, "index.html")
 
 # 1. Serve alle filer i dist (inkl. scooter.gif, favicon, etc.)
-app.mount("/static", StaticFiles(directory=frontend_path), name="static")
+# check_dir=False lets the API start without a built front-end (e.g. for benchmarks)
+app.mount("/static", StaticFiles(directory=frontend_path, check_dir=False), name="static")
 
 # 2. Serve assets fra /assets
-app.mount("/assets", StaticFiles(directory=os.path.join(frontend_path, "assets")), name="assets")
+app.mount("/assets", StaticFiles(directory=os.path.join(frontend_path, "assets"), check_dir=False), name="assets")
 
 
 
@@ -90,6 +183,23 @@ def set_mqtt_client(mqtt_client : object) -> None:
 
 
 
+def init_worker() -> None:
+    """
+    Initialize the clients of a worker process.
+    With HTTP_WORKERS > 1, uvicorn runs the app in separate processes, each of which
+    opens its own database pool, MQTT client (with its own reply topic) and logging
+    pipeline instead of sharing those of the launching process, and shares its metrics
+    with the other workers (see tools.metrics.share).
+    """
+    log_pipeline.setup(logging.INFO if DEPLOYMENT_MODE == 'PROD' else logging.DEBUG)
+    logger.info(f"Initializing worker process {os.getpid()}")
+    metrics.share()
+    set_db_client(database.db(database.credentials_from_env()))
+    if not DISABLE_MQTT:
+        set_mqtt_client(mqtt.mqtt_client())
+
+
+
 def set_db_client(db_client : object) -> None:
     """
     Set the db client for the app.
@@ -177,6 +287,28 @@ if DEPLOYMENT_MODE == "TEST":
 
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Metrics endpoint for Prometheus, in the text exposition format.
+    Exposes latency histograms and counters for each stage of unlock/lock (database
+    methods, weather fetches and cache lookups, MQTT round-trips and timeouts, abort
+    handling) and gauges of the requests in flight. Served outside /api/v1 and not
+    proxied by Nginx, so it is only reachable from inside the deployment.
+    Returns:
+        Response:
+        ```
+        curl -X GET http://localhost:8080/metrics ->
+        # HELP escooter_db_query_seconds Time spent in a database method, ...
+        # TYPE escooter_db_query_seconds histogram
+        escooter_db_query_seconds_bucket{method="get_user",le="0.001"} 12
+        ...
+        ```
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+
 @api_router.post("/scooter/{uuid}/single-unlock")
 async def scooter_unlock_single(
     uuid: str, 
@@ -200,7 +332,8 @@ async def scooter_unlock_single(
         ```
     """
     logger.debug("Request: HTTP POST /scooter/{uuid}/single-unlock?user_id={user_id}")
-    resp = request.app.state.single_ride_service.unlock_scooter(uuid, user_id)
+    async with ride_limiter:
+        resp = await request.app.state.single_ride_service.unlock_scooter(uuid, user_id)
     status_code = 200 if resp[0] else 400
 
     return JSONResponse(
@@ -235,7 +368,8 @@ async def scooter_lock_single(
         ```
     """
     logger.debug("Request: HTTP POST /scooter/{uuid}/single-lock?user_id={user_id}")
-    resp = request.app.state.single_ride_service.lock_scooter(uuid, user_id)
+    async with ride_limiter:
+        resp = await request.app.state.single_ride_service.lock_scooter(uuid, user_id)
     status_code = 200 if resp[0] else 400
 
     rental = resp[2]
@@ -247,6 +381,78 @@ async def scooter_lock_single(
 
 
 
+@api_router.post("/scooters/multi-unlock")
+async def scooter_unlock_multi(
+    request: Request,
+    user_id: int = Query(..., description="ID of the user leading the co-ride"),
+    scooter_ids: list[int] = Query(..., description="IDs of the scooters to unlock"),
+    rider_ids: list[int] = Query(None, description="ID of the rider of each scooter, in the order of scooter_ids")
+):
+    """
+    Unlock a group of scooters for a co-ride.
+    All scooters are unlocked concurrently, and either all of them or none are rented.
+    Args:
+        request (Request): FastAPI request object.
+        user_id (int): ID of the user leading the co-ride. (Query parameter)
+        scooter_ids (list): IDs of the scooters to unlock. (Repeated query parameter)
+        rider_ids (list): ID of the rider of each scooter; the leader rides all if omitted. (Repeated query parameter)
+    Returns:
+        dict: A message, a redirect and the session ID and rentals of the co-ride.
+
+    Example:
+        ```
+        curl -X POST "http://localhost:8000/scooters/multi-unlock?user_id=1&scooter_ids=1&scooter_ids=2&rider_ids=1&rider_ids=2" -> "unlock successful"
+        ```
+    """
+    logger.debug(f"Request: HTTP POST /scooters/multi-unlock?user_id={user_id}&scooter_ids={scooter_ids}")
+    async with ride_limiter:
+        resp = await request.app.state.multi_ride_service.unlock_scooters(user_id, scooter_ids, rider_ids)
+    status_code = 200 if resp[0] else 400
+
+    return JSONResponse(
+        content=jsonable_encoder({
+            "message": resp[1],
+            "redirect": resp[2],
+            "coride": resp[3]
+            }),
+        status_code=status_code
+    )
+
+
+
+@api_router.post("/scooters/multi-lock")
+async def scooter_lock_multi(
+    request: Request,
+    user_id: int = Query(..., description="ID of the user leading the co-ride")
+):
+    """
+    Lock every scooter of the active co-ride led by a user.
+    The rentals of the group are completed and charged in one transaction.
+    Args:
+        request (Request): FastAPI request object.
+        user_id (int): ID of the user leading the co-ride. (Query parameter)
+    Returns:
+        dict: The session ID, the price per ride and the rentals of the co-ride.
+    Example:
+        ```
+        curl -X POST "http://localhost:8000/scooters/multi-lock?user_id=1" -> {"session_id": 3, "price": 45.0, "rentals": [...], "active": []}
+        ```
+        If only some scooters lock, the response has status 207, and lists the scooters
+        still active, which locking again retries.
+    """
+    logger.debug(f"Request: HTTP POST /scooters/multi-lock?user_id={user_id}")
+    async with ride_limiter:
+        resp = await request.app.state.multi_ride_service.lock_scooters(user_id)
+
+    if resp[0]:
+        return JSONResponse(content=jsonable_encoder({"message": resp[2]}), status_code=200)
+    if resp[2] is not None:
+        # Some scooters locked: their rentals are completed, the others are still active
+        return JSONResponse(content=jsonable_encoder({"message": resp[1], "coride": resp[2]}), status_code=207)
+    return JSONResponse(content=jsonable_encoder({"message": resp[1]}), status_code=400)
+
+
+
 @api_router.get("/test-weather")
 async def test_weather():
     """
@@ -262,11 +468,46 @@ async def test_weather():
             "insufficient conditions <br/> temperature: -2.5 <br/> humidity: 38.1"
         ```
     """
-    resp = weather.is_weather_ok(TEST_COORDINATES[0], TEST_COORDINATES[1])
+    async with read_limiter:
+        resp = await run_blocking(weather.is_weather_ok, TEST_COORDINATES[0], TEST_COORDINATES[1])
     return {"message": resp[1]}
 
 
 
+@api_router.get("/scooters/nearby")
+async def get_scooters_nearby(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
+    radius: float = Query(1000, gt=0, le=NEARBY_MAX_RADIUS, description="Search radius in meters"),
+    limit: int = Query(10, gt=0, le=NEARBY_MAX_LIMIT, description="Maximum number of scooters"),
+    status: int = Query(None, description="Only return scooters with this status code"),
+):
+    """
+    Get the scooters nearest to a location.
+    This endpoint is used to find scooters around the user, nearest first.
+    Args:
+        request (Request): FastAPI request object.
+        lat (float): Latitude of the location.
+        lon (float): Longitude of the location.
+        radius (float): Search radius in meters.
+        limit (int): Maximum number of scooters to return.
+        status (int): Only return scooters with this status code (e.g. 0 for available).
+    Returns:
+        dict: A dictionary containing the list of nearby scooters, each with its distance in meters.
+    Example:
+        ```
+        curl -X GET "http://localhost:8000/scooters/nearby?lat=63.4195&lon=10.4017&radius=500&status=0" -> 
+            [{"uuid": 1, "latitude": 63.41947, "longtitude": 10.40174, "status": 0, "distance": 3.9}]
+        ```
+    """
+    logger.debug("Request: HTTP GET /scooters/nearby")
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.get_scooters_nearby, lat, lon, radius, limit, status)
+    return {"message": resp}
+
+
+
 @api_router.get("/scooter/{uuid}")
 async def get_scooter_info(
     uuid: str, 
@@ -288,7 +529,8 @@ async def get_scooter_info(
     """
     logger.debug("Request: HTTP GET /scooter/{uuid}")
     logger.debug(f"single_ride_service: {hasattr(request.app.state, 'single_ride_service')}")
-    resp = request.app.state.single_ride_service.get_scooter_info(uuid)
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.get_scooter_info, uuid)
     return {"message": resp}
 
 
@@ -312,7 +554,8 @@ async def get_user_info(
         ```
     """
     logger.debug("Request: HTTP GET /user/{id}")
-    resp = request.app.state.single_ride_service.get_user_info(id)
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.get_user_info, id)
     return {"message": resp}
 
 
@@ -336,7 +579,8 @@ async def get_rental_info(
         ```
     """
     logger.debug("Request: HTTP GET /rental/{rental_id}")
-    resp = request.app.state.single_ride_service.get_rental_info(rental_id)
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.get_rental_info, rental_id)
     return JSONResponse(
         content=jsonable_encoder({"message": resp}),
         status_code=200
@@ -363,13 +607,88 @@ async def is_rental_ok(
         ```
     """
     logger.debug("Request: HTTP GET /rental/ok/{rental_id}")
-    resp = request.app.state.single_ride_service.check_rental_status(rental_id)
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.check_rental_status, rental_id)
     return JSONResponse(
         content=jsonable_encoder({"message": resp}),
         status_code=200
     )
 
 
+@api_router.get("/rental/stream/{rental_id}")
+async def stream_rental_status(
+    rental_id: str,
+    request: Request,
+):
+    """
+    Stream the status of a rental as server-sent events.
+    The current status is sent once on connect; afterwards, changes are pushed as they
+    happen (e.g. when the scooter aborts the session or the rental is locked), so an
+    open stream costs no database reads. Every event carries the same message as
+    GET /rental/ok/{rental_id}, and the stream ends once the rental is no longer OK.
+    Args:
+        rental_id (str): ID of the rental to stream.
+        request (Request): FastAPI request object.
+    Returns:
+        StreamingResponse: A text/event-stream of "status" events.
+    Example:
+        ```
+        curl -N http://localhost:8000/rental/stream/1234 ->
+            event: status
+            data: {"message": [true, "ok"]}
+
+            event: status
+            data: {"message": [false, "battery low"]}
+        ```
+    """
+    logger.debug("Request: HTTP GET /rental/stream/{rental_id}")
+    events = rental_events()
+
+    # Subscribe before reading the current status, so no change can slip in between
+    queue = events.subscribe(rental_id)
+    try:
+        # Only the initial read takes a slot, not the lifetime of the stream
+        async with read_limiter:
+            ok, status = await run_blocking(request.app.state.single_ride_service.check_rental_status, rental_id)
+    except Exception:
+        events.unsubscribe(rental_id, queue)
+        raise
+
+    async def stream():
+        try:
+            yield _server_sent_event("status", {"message": [ok, status]})
+            if not ok:
+                return
+            while True:
+                try:
+                    event_ok, event_status, final = await asyncio.wait_for(queue.get(), RENTAL_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _server_sent_event("status", {"message": [event_ok, event_status]})
+                if final or not event_ok:
+                    return
+        finally:
+            events.unsubscribe(rental_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+
+def _server_sent_event(event: str, data: dict) -> str:
+    """
+    Format a server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+
 @api_router.get("/rental")
 async def get_active_rental(
     request: Request,
@@ -390,7 +709,8 @@ async def get_active_rental(
         ```
     """
     logger.debug("Request: HTTP GET /rental?user_id={user_id}")
-    resp = request.app.state.single_ride_service.get_active_rental_by_user(user_id)
+    async with read_limiter:
+        resp = await run_blocking(request.app.state.single_ride_service.get_active_rental_by_user, user_id)
     
     return JSONResponse(
         content=jsonable_encoder({"message": resp}),
@@ -0,0 +1,220 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+from threading import Thread
+from concurrent.futures import Future, TimeoutError, InvalidStateError
+
+from api import database
+from tools.singleton import singleton
+
+
+LEDGER_COMMIT_WINDOW     = float(os.getenv("LEDGER_COMMIT_WINDOW", 0.002))
+LEDGER_BATCH_SIZE        = int(os.getenv("LEDGER_BATCH_SIZE", 100))
+LEDGER_TIMEOUT           = float(os.getenv("LEDGER_TIMEOUT", 30))
+
+
+
+@singleton
+class ledger:
+    """
+    Group-committing writer of rental charges.
+    Completing a rental (charging the user, ending the rental and updating the scooter),
+    or the rentals of a co-ride as a group, is queued to a single committer thread. The committer collects every completion
+    that arrives within LEDGER_COMMIT_WINDOW seconds, up to LEDGER_BATCH_SIZE, and
+    writes them with db.complete_rentals in one database transaction, so a burst of
+    locks costs one commit (and fsync) per batch instead of one per ride.
+
+    Charges are keyed by rental ID in the transactions ledger, so completing a rental
+    twice (e.g. a retried lock racing an abort) never charges the user twice. If a
+    batch fails, its rentals are retried one by one so that one bad rental does not
+    fail the others. A rental which is no longer active is not charged, and reported
+    as not completed.
+
+    The balances of users are not rebuilt from the ledger here; that is a maintenance
+    command (python . --rebuild-balances), so starting a worker never rewrites them.
+
+    #### Example:
+    ```python
+    from api.ledger import ledger
+
+    ok = ledger().complete_rental(rental_id=5, user_id=1, price=25.0, lat=63.41947, lon=10.40174, status=0)
+    ok = await ledger().complete_rental_async(5, 1, 25.0, 63.41947, 10.40174, 0)
+    ```
+    """
+
+    def __init__(self, db_client: database.db=None) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._db = db_client if db_client is not None else database.db()
+        self._queue = queue.Queue()
+        self._committer = Thread(target=self._run, name="ledger-commit", daemon=True)
+        self._committer.start()
+
+
+
+    def submit(self, rental_id: int, user_id: int, price: float, lat: float, lon: float, status: int) -> Future:
+        """
+        Queue the completion of a rental.
+        Args:
+            rental_id (int): The ID of the rental.
+            user_id (int): The ID of the user to charge.
+            price (float): The total price of the rental.
+            lat (float): The latitude the scooter was locked at.
+            lon (float): The longitude the scooter was locked at.
+            status (int): The status of the scooter.
+        Returns:
+            Future: Resolves to [True] once the rental is completed and charged, [False] otherwise.
+        """
+        return self.submit_group([(rental_id, user_id, price, lat, lon, status)])
+
+
+
+    def submit_group(self, rentals: list[tuple]) -> Future:
+        """
+        Queue the completion of several rentals which must be completed together, e.g.
+        the rentals of a co-ride. They are always written in the same transaction.
+        Args:
+            rentals (list): Tuples of (rental_id, user_id, price, lat, lon, status).
+        Returns:
+            Future: Resolves to a list with, for every rental in the order given, True once
+                it is completed and charged, False otherwise.
+        """
+        future = Future()
+        self._queue.put((list(rentals), future))
+        return future
+
+
+
+    def complete_rental(self, rental_id: int, user_id: int, price: float, lat: float, lon: float, status: int) -> bool:
+        """
+        Complete and charge a rental, blocking until its batch is committed.
+        See submit() for the arguments.
+        """
+        try:
+            return self.submit(rental_id, user_id, price, lat, lon, status).result(timeout=LEDGER_TIMEOUT)[0]
+        except TimeoutError:
+            self._logger.error(f"Rental {rental_id} was not committed within {LEDGER_TIMEOUT} seconds")
+            return False
+
+
+
+    async def complete_rental_async(self, rental_id: int, user_id: int, price: float, lat: float, lon: float, status: int) -> bool:
+        """
+        Complete and charge a rental without blocking the event loop.
+        See submit() for the arguments.
+        """
+        future = self.submit(rental_id, user_id, price, lat, lon, status)
+        try:
+            # Shielded: a timed-out completion is still committed, so it must not be cancelled
+            return (await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), LEDGER_TIMEOUT))[0]
+        except asyncio.TimeoutError:
+            self._logger.error(f"Rental {rental_id} was not committed within {LEDGER_TIMEOUT} seconds")
+            return False
+
+
+
+    async def complete_group_async(self, rentals: list[tuple]) -> list[bool]:
+        """
+        Complete and charge the rentals of a group in one transaction without blocking the event loop.
+        See submit_group() for the arguments and result.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.submit_group(rentals))), LEDGER_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._logger.error(f"Rentals {[rental[0] for rental in rentals]} were not committed within {LEDGER_TIMEOUT} seconds")
+            return [False] * len(rentals)
+
+
+
+    def stop(self) -> None:
+        """
+        Commit the queued rentals and stop the committer thread.
+        """
+        self._queue.put(None)
+        self._committer.join(timeout=LEDGER_TIMEOUT)
+
+
+
+    def _run(self) -> None:
+        """
+        Internal loop of the committer thread.
+        """
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + LEDGER_COMMIT_WINDOW
+            while size < LEDGER_BATCH_SIZE:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # The committer must survive, or every later completion would hang
+                self._logger.exception(f"Error committing {len(batch)} completions: {e}")
+                for rentals, future in batch:
+                    if not future.done():
+                        self._resolve(future, [False] * len(rentals))
+
+
+
+    def _commit(self, batch: list) -> None:
+        """
+        Internal function writing a batch of completions and resolving their futures.
+        Each item of the batch is a group of rentals with one future, which resolves to
+        the results of its rentals.
+        """
+        completed = None
+        try:
+            completed = self._db.complete_rentals([rental for rentals, _ in batch for rental in rentals])
+        except Exception as e:
+            self._logger.error(f"Error committing {len(batch)} completions: {e}")
+
+        if completed is not None:
+            results = []
+            for rentals, _ in batch:
+                results.append(completed[:len(rentals)])
+                completed = completed[len(rentals):]
+        elif len(batch) > 1:
+            self._logger.warning(f"Batch of {len(batch)} completions failed, retrying them one by one")
+            results = [self._commit_group(rentals) for rentals, _ in batch]
+        else:
+            results = [[False] * len(batch[0][0])]
+
+        for (_, future), result in zip(batch, results):
+            self._resolve(future, result)
+
+
+
+    def _resolve(self, future: Future, result: list[bool]) -> None:
+        """
+        Internal function resolving the future of a group, unless it is already done.
+        """
+        try:
+            future.set_result(result)
+        except InvalidStateError:
+            self._logger.warning(f"Completion resolved or cancelled before its commit: {result}")
+
+
+
+    def _commit_group(self, rentals: list[tuple]) -> list[bool]:
+        """
+        Internal function writing a single group of completions, after its batch failed.
+        """
+        try:
+            completed = self._db.complete_rentals(rentals)
+        except Exception as e:
+            self._logger.error(f"Error committing rentals {[rental[0] for rental in rentals]}: {e}")
+            completed = None
+        return completed if completed is not None else [False] * len(rentals)
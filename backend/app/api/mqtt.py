@@ -2,18 +2,44 @@ import os
 import sys
 import json
 import time
+import uuid
+import asyncio
 import logging
-from threading import Event
+from threading import Lock
+from concurrent.futures import Future, TimeoutError, InvalidStateError
 import paho.mqtt.client as mqtt
 
+from tools import codec, metrics
 from tools.singleton import singleton
+from tools.worker_pool import worker_pool, PRIORITY_HIGH, PRIORITY_DEFAULT
+from logic import weather
+from api.scooter_state import scooter_state
 from service.internal_service import internal_service
+from service.rental_events import rental_events
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SCOOTER_STATUS_CODES_PATH = os.path.join(BASE_DIR, "resources/scooter-status-codes.json")
 DISABLE_MQTT    = os.getenv("DISABLE_MQTT", "False").lower() == "true"
 DEPLOYMENT_MODE = os.getenv('DEPLOYMENT_MODE', 'TEST')
+MQTT_UNLOCK_TIMEOUT = float(os.getenv("MQTT_UNLOCK_TIMEOUT", 15))
+MQTT_LOCK_TIMEOUT   = float(os.getenv("MQTT_LOCK_TIMEOUT", 30))
+MQTT_WORKERS        = int(os.getenv("MQTT_WORKERS", 4))
+MQTT_WORKER_QUEUE   = int(os.getenv("MQTT_WORKER_QUEUE", 1000))
+# Payload encoding, [binary|json]. Binary is only used with scooters which answer in binary.
+MQTT_CODEC          = codec.CODECS[os.getenv("MQTT_CODEC", "binary").lower()]
+MQTT_SERVER_ID      = int(os.getenv("MQTT_SERVER_ID", 1000))
+# Scooters answer commands on <MQTT_REPLY_TOPIC>/<worker>, so replies reach the worker process which sent the command
+MQTT_REPLY_TOPIC     = os.getenv("MQTT_REPLY_TOPIC", "escooter/reply")
+MQTT_BROADCAST_TOPIC = os.getenv("MQTT_BROADCAST_TOPIC", "backend/broadcast")
+MQTT_SHARED_GROUP    = os.getenv("MQTT_SHARED_GROUP", "backend")
+HTTP_WORKERS         = int(os.getenv("HTTP_WORKERS", 1))
+
+ROUNDTRIP_SECONDS   = metrics.histogram("escooter_mqtt_roundtrip_seconds", "Time from publishing a command to receiving the scooter's response.", ("command",))
+TIMEOUTS            = metrics.counter("escooter_mqtt_timeouts_total", "Commands which got no response within their timeout.", ("command",))
+COMMANDS_IN_FLIGHT  = metrics.gauge("escooter_mqtt_commands_in_flight", "Commands waiting for a response.")
+ABORT_QUEUE_SECONDS = metrics.histogram("escooter_abort_queue_seconds", "Time an abort waited for a free MQTT worker.")
+ABORT_SECONDS       = metrics.histogram("escooter_abort_handling_seconds", "Time spent handling an abort, by scooter status.", ("status",))
 
 
 if DEPLOYMENT_MODE == 'PROD':
@@ -37,6 +63,28 @@ class mqtt_client:
     and publishes messages to the broker.
     This class is a singleton, meaning only one instance of it can exist at a time.
 
+    Every command carries a unique request_id which the scooter echoes in its response.
+    Outstanding commands are kept in a table of pending futures keyed by that ID, so any
+    number of commands may be in flight at once, each with its own timeout.
+
+    Payloads are encoded with tools.codec, negotiated per scooter: commands are sent as
+    JSON advertising the binary codec until the scooter answers in binary, after which
+    its commands are sent in binary too. Both encodings are always decoded, and
+    MQTT_CODEC=json keeps every payload human-readable for debugging.
+
+    Every back-end process (HTTP_WORKERS) has its own client. Commands carry a
+    reply_to topic unique to the process, so responses are routed back to the process
+    awaiting them. Messages the scooters publish on their own, i.e. aborts, are received
+    through a shared subscription, so exactly one process handles each of them. The
+    processes relay scooter state and rental events to each other on
+    MQTT_BROADCAST_TOPIC, keeping their in-memory scooter tables and status streams
+    up to date.
+
+    The paho network thread only decodes incoming messages: the state each scooter
+    reports is applied to the in-memory scooter_state, responses complete their
+    pending future, while aborts are handed to a worker pool in which distress aborts
+    take priority over other aborts. No abort is ever dropped, however full the pool.
+
     On first initialization, parameters must be provided.
     After that, the same instance will be used throughout the application meaning
     that one do not need to provide parameters again.
@@ -81,16 +129,25 @@ class mqtt_client:
         if DISABLE_MQTT:
             return
         self._logger = logging.getLogger(__name__)
-        self._id = id
+        self._id = id if id is not None else MQTT_SERVER_ID
         self._status = 'disconnected'
-        self._response_event = Event()
+        self._pending = {}
+        self._pending_lock = Lock()
+        self._codecs = {}
+        self._worker = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
         self.input_topic  = MQTT_TOPIC_INPUT
         self.output_topic = MQTT_TOPIC_OUTPUT
-        self._client = self._init_client(MQTT_HOST, MQTT_PORT)
+        self.reply_topic  = f"{MQTT_REPLY_TOPIC}/{self._worker}"
         self._internal_service = internal_service()
-        self._message = None
+        self._scooters = scooter_state()
+        self._events = rental_events()
+        self._workers = worker_pool(name="mqtt-worker", workers=MQTT_WORKERS, capacity=MQTT_WORKER_QUEUE)
         with open(SCOOTER_STATUS_CODES_PATH, 'r') as f:
             self._status_codes = json.load(f)
+        if HTTP_WORKERS > 1:
+            self._events.add_forwarder(self._relay_event)
+            weather.add_forwarder(self._relay_forecast)
+        self._client = self._init_client(MQTT_HOST, MQTT_PORT)
 
 
 
@@ -107,7 +164,13 @@ class mqtt_client:
         try:
             self._client = mqtt.Client()
             self._client.connect(host, port)
-            self._client.subscribe(self.input_topic)
+            if HTTP_WORKERS > 1:
+                # Each abort is delivered to one process of the group only
+                self._client.subscribe(f"$share/{MQTT_SHARED_GROUP}/{self.input_topic}")
+                self._client.subscribe(f"{MQTT_BROADCAST_TOPIC}/#")
+            else:
+                self._client.subscribe(self.input_topic)
+            self._client.subscribe(self.reply_topic)
             self._client.on_connect = self.on_connect
             self._client.on_message = self.on_message
             self._client.loop_start()
@@ -128,7 +191,7 @@ class mqtt_client:
             client (mqtt.Client): The MQTT client instance.
         """
         self._status = 'connected'
-        self._logger.info(f"Connected to MQTT broker at {client._host}:{client._port}")
+        self._logger.info(f"Connected to MQTT broker at {client._host}:{client._port} as worker {self._worker}")
 
 
 
@@ -136,21 +199,132 @@ class mqtt_client:
         """
         Callback function for when a message is received from the broker.
         This function is called when a message is received from the broker.
-        It logs the message and sets the response event.
+        Responses are matched to the pending command through their request_id,
+        while aborts are queued for the worker pool, distress aborts first, so that
+        the network loop is never blocked by database work.
         Args:
             client (mqtt.Client): The MQTT client instance.
             userdata (object): User data passed to the callback.
             msg (dict): The message received from the broker.
         """
-        payload_str = msg.payload.decode()
-        message = json.loads(payload_str)
+        if msg.topic.startswith(f"{MQTT_BROADCAST_TOPIC}/"):
+            self._on_relayed(msg)
+            return
+        try:
+            message, used = codec.decode(msg.payload)
+        except codec.codec_error as e:
+            self._logger.error(f"At {msg.topic} - could not decode message: {e}")
+            return
+        if message.get("uuid") is not None:
+            self._codecs[str(message["uuid"])] = used
         self._logger.info(f"At {self.input_topic} - received message: {message}")
-
-        if message["abort"] == True:
-            self._internal_service.session_aborted(message["uuid"], message)
+        self._scooters.on_message(message)
+        if HTTP_WORKERS > 1:
+            self._relay("state", {key: message.get(key) for key in ("uuid", "battery", "status", "location")})
+
+        if message.get("abort") == True:
+            distress = self._status_codes.get(str(message.get("status"))) == "distress"
+            # Never wait here: blocking the network thread would stall keepalive and every reply.
+            # Nor drop an abort: its rental would never complete. Distress aborts are never
+            # rejected, and other aborts wait in the pool's overflow list while it is full.
+            self._workers.submit(
+                self._handle_abort, message["uuid"], message, time.perf_counter(),
+                priority=PRIORITY_HIGH if distress else PRIORITY_DEFAULT, defer=True
+            )
         else:
-            self._message = message
-            self._response_event.set()
+            self._resolve(message)
+
+
+
+    def _resolve(self : object, message : dict) -> None:
+        """
+        Internal function completing the pending command a response belongs to.
+        Responses without a request_id (older scooter software) are matched to the
+        oldest pending command for the same scooter.
+        Args:
+            message (dict): The response received from the scooter.
+        """
+        request_id = message.get("request_id")
+        with self._pending_lock:
+            if request_id is None:
+                request_id = next(
+                    (key for key, (scooter_uuid, *_) in self._pending.items() if str(scooter_uuid) == str(message.get("uuid"))),
+                    None
+                )
+            pending = self._pending.pop(request_id, None)
+
+        if pending is None:
+            self._logger.warning(f"Received response for unknown or expired request: {request_id}")
+            return
+        _, future, command, started = pending
+        COMMANDS_IN_FLIGHT.dec()
+        ROUNDTRIP_SECONDS.labels(command).observe(time.perf_counter() - started)
+        try:
+            future.set_result(message)
+        except InvalidStateError:
+            self._logger.warning(f"Received response for cancelled request: {request_id}")
+
+
+
+    def _handle_abort(self : object, scooter_uuid : int, message : dict, received : float) -> None:
+        """
+        Internal job of the worker pool handling an abort, timed in the abort metrics.
+        Args:
+            scooter_uuid (int): The scooter which aborted its session.
+            message (dict): The abort received from the scooter.
+            received (float): time.perf_counter() when the abort was received.
+        """
+        ABORT_QUEUE_SECONDS.observe(time.perf_counter() - received)
+        with ABORT_SECONDS.labels(message.get("status")).time():
+            self._internal_service.session_aborted(scooter_uuid, message)
+
+
+
+    def _relay(self : object, kind : str, data) -> None:
+        """
+        Internal function relaying state to the other back-end processes.
+        Args:
+            kind (str): The kind of state, [state|event|forecast].
+            data: The state, JSON-serializable.
+        """
+        self._client.publish(f"{MQTT_BROADCAST_TOPIC}/{self._worker}", json.dumps({"kind": kind, "data": data}))
+
+
+
+    def _relay_event(self : object, rental_id : int, ok : bool, status : str, final : bool) -> None:
+        """
+        Internal forwarder of rental_events, relaying events published in this process.
+        """
+        self._relay("event", [rental_id, ok, status, final])
+
+
+
+    def _relay_forecast(self : object, cell : tuple, entry : dict) -> None:
+        """
+        Internal forwarder of the weather module, relaying the verdict of every forecast
+        fetched in this process, so the other workers need not fetch it again.
+        """
+        self._relay("forecast", [list(cell), list(entry["verdict"]), entry["expires"], entry["last_modified"]])
+
+
+
+    def _on_relayed(self : object, msg) -> None:
+        """
+        Internal function applying state relayed by another back-end process.
+        """
+        if msg.topic == f"{MQTT_BROADCAST_TOPIC}/{self._worker}":
+            return
+        try:
+            relayed = json.loads(msg.payload.decode())
+            if relayed["kind"] == "state":
+                self._scooters.on_remote_message(relayed["data"])
+            elif relayed["kind"] == "event":
+                rental_id, ok, status, final = relayed["data"]
+                self._events.publish(rental_id, ok, status, final=final, forward=False)
+            elif relayed["kind"] == "forecast":
+                weather.store(*relayed["data"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._logger.error(f"At {msg.topic} - could not apply relayed state: {e}")
 
 
 
@@ -162,6 +336,7 @@ class mqtt_client:
         """
         self._client.loop_stop()
         self._client.disconnect()
+        self._workers.stop()
         self._logger.info("Disconnected from MQTT broker")
 
 
@@ -174,7 +349,11 @@ class mqtt_client:
             message (dict): The message to send.
         """
         topic = f"{self.output_topic}/{message['uuid']}"
-        self._client.publish(topic, json.dumps(message))
+        used = self._codecs.get(str(message['uuid']), codec.CODEC_JSON) if MQTT_CODEC == codec.CODEC_BINARY else codec.CODEC_JSON
+        if MQTT_CODEC == codec.CODEC_BINARY and used == codec.CODEC_JSON:
+            # Advertise the binary codec until the scooter answers in it
+            message = {**message, "codec": codec.VERSION}
+        self._client.publish(topic, codec.encode(message, used))
         self._logger.info(f"At {topic} - published message: {message}")
 
 
@@ -196,9 +375,142 @@ class mqtt_client:
         return True
 
 
+    def _send_command(self : object, scooter : dict, command : str, coriders : list=None) -> tuple[str, Future]:
+        """
+        Internal function publishing a command to a scooter and registering it as pending.
+        Args:
+            scooter (dict): The scooter to send the command to.
+            command (str): The command to send, [lock|unlock].
+            coriders (list): IDs of the other scooters of a co-ride, or None for a single ride.
+        Returns:
+            tuple:
+             * [0]: _str_. The request ID of the command.
+             * [1]: _Future_. Future completed with the scooter's response.
+        """
+        request_id = uuid.uuid4().hex
+        future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = (scooter['uuid'], future, command, time.perf_counter())
+        COMMANDS_IN_FLIGHT.inc()
+
+        message = {
+            "id": self._id,
+            "request_id": request_id,
+            "uuid": scooter['uuid'],
+            "command": command,
+            "reply_to": self.reply_topic,
+            "coride": bool(coriders),
+            "num_coriders": len(coriders or []),
+            "coriders": list(coriders or []),
+            "timestamp": time.time()
+        }
+
+        try:
+            self.send_message(message)
+        except Exception:
+            self._discard(request_id)
+            raise
+        return request_id, future
+
+
+
+    def _discard(self : object, request_id : str, timed_out : bool=False) -> None:
+        """
+        Internal function removing a command from the pending table, e.g. after a timeout.
+        """
+        with self._pending_lock:
+            pending = self._pending.pop(request_id, None)
+        if pending is not None:
+            COMMANDS_IN_FLIGHT.dec()
+            if timed_out:
+                TIMEOUTS.labels(pending[2]).inc()
+
+
+
+    def _await_response(self : object, request_id : str, future : Future, timeout : float) -> dict:
+        """
+        Internal function blocking until the response of a command arrives.
+        Returns:
+            dict: The response from the scooter, or None if it timed out.
+        """
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self._discard(request_id, timed_out=True)
+            return None
+        finally:
+            self._discard(request_id)
+
+
+
+    async def _await_response_async(self : object, request_id : str, future : Future, timeout : float) -> dict:
+        """
+        Internal coroutine awaiting the response of a command without blocking the event loop.
+        Returns:
+            dict: The response from the scooter, or None if it timed out.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._discard(request_id, timed_out=True)
+            return None
+        finally:
+            self._discard(request_id)
+
+
+
+    def _parse_unlock_response(self : object, message : dict, scooter : dict) -> tuple[bool, int, str]:
+        """
+        Internal function interpreting the scooter's response to an unlock command.
+        """
+        if message is None:
+            self._logger.error("Did not get response")
+            return False, 7, "scooter-inoperable"
+        try:
+            if int(message['id']) == int(self._id) and str(message['uuid']) == str(scooter['uuid']):
+                battery   = int(message['battery'])
+                status    = int(message['status'])
+
+                if battery > 15 and status == 0:
+                    return True, status, ""
+                elif battery <= 15:
+                    return False, status, "low-battery"
+                elif status > 0:
+                    return False, status, "scooter-inoperable"
+        except Exception as e:
+            self._logger.error(f"Exception while parsing unlock response: {e}")
+            self._logger.error(f"Message content: {message}")
+        return False, 7, "scooter-inoperable"
+
+
+
+    def _parse_lock_response(self : object, message : dict, scooter : dict) -> tuple[bool, str, int]:
+        """
+        Internal function interpreting the scooter's response to a lock command.
+        """
+        if message is None:
+            return False, "timeout waiting for lock confirmation", -1
+        try:
+            if int(message['id']) == int(self._id) and str(message['uuid']) == str(scooter["uuid"]):
+                status    = int(message['status'])
+                location  = str(message['location'])
+
+                if status == 0 and self.location_is_valid(location):
+                    return True, "lock successful", status
+                elif not self.location_is_valid(location):
+                    return False, "invalid parking location", status
+                elif status > 0:
+                    return False, self._status_codes[str(status)], status
+        except Exception as e:
+            return False, f"error parsing lock confirmation: {e}", -1
+        return False, "invalid lock confirmation", -1
+
+
+
     def scooter_unlock_single(self : object, scooter : dict) -> tuple[bool, int, str]:
         """
-        This function unlocks a scooter.
+        This function unlocks a scooter. Blocks for at most MQTT_UNLOCK_TIMEOUT seconds,
+        without blocking commands sent to other scooters.
         Args:
             scooter (dict): The scooter to unlock.
         Returns:
@@ -211,53 +523,20 @@ class mqtt_client:
                 mqtt.scooter_unlock_single("1235") -> (False, "battery too low")
             ```
         """
-        self._response_event.clear()
-
         if scooter['status'] == 11:
             return False, 11, "scooter-occupied"
 
-        message = {
-            "id": self._id,
-            "uuid": scooter['uuid'],
-            "command": "unlock",
-            "coride": False,
-            "num_coriders": 0,
-            "coriders": [],
-            "timestamp": time.time()
-        }
-
-        self.send_message(message)
-
-        response = self._response_event.wait(timeout=15)
-
-        if response:
-            try:
-                if int(self._message['id']) == int(self._id) and str(self._message['uuid']) == str(scooter['uuid']):
-                    battery   = int(self._message['battery'])
-                    status    = int(self._message['status'])
-                    # location  = str(self._message['location'])
-                    # timestamp = self._message['timestamp']
-
-                    if battery > 15 and status == 0:
-                        return True, status, ""
-                    elif battery <= 15:
-                        return False, status, "low-battery"
-                    elif status > 0:
-                        return False, status, "scooter-inoperable"
-            except Exception as e:
-                self._logger.error(f"Exception while parsing unlock response: {e}")
-                self._logger.error(f"Message content: {self._message}")
-                return False, 7, "scooter-inoperable"
-        else:
-            self._logger.error("Did not get response")
-            return False, 7, "scooter-inoperable"
+        request_id, future = self._send_command(scooter, "unlock")
+        response = self._await_response(request_id, future, MQTT_UNLOCK_TIMEOUT)
+        return self._parse_unlock_response(response, scooter)
 
 
 
 
     def scooter_lock_single(self : object, scooter : dict) -> tuple[bool, str, int]:
         """
-        This function locks a scooter.
+        This function locks a scooter. Blocks for at most MQTT_LOCK_TIMEOUT seconds,
+        without blocking commands sent to other scooters.
         Args:
             scooter (dict): The scooter to lock.
         Returns:
@@ -271,38 +550,65 @@ class mqtt_client:
                 mqtt.scooter_lock_single("1235") -> (False, "invalid parking location")
             ```
         """
-        self._response_event.clear()  
+        request_id, future = self._send_command(scooter, "lock")
+        response = self._await_response(request_id, future, MQTT_LOCK_TIMEOUT)
+        return self._parse_lock_response(response, scooter)
 
-        message = {
-            "id": self._id,
-            "uuid": scooter["uuid"],
-            "command": "lock",
-            "coride": False,
-            "num_coriders": 0,
-            "coriders": [],
-            "timestamp": time.time()
-        }
 
-        self.send_message(message)
-
-        response = self._response_event.wait(timeout=30)
-
-        if response:
-            try:
-                if int(self._message['id']) == int(self._id) and str(self._message['uuid']) == str(scooter["uuid"]):
-                    battery   = int(self._message['battery'])
-                    status    = int(self._message['status'])
-                    location  = str(self._message['location'])
-                    timestamp = self._message['timestamp']
-
-                    if status == 0 and self.location_is_valid(location):
-                        return True, "lock successful", status
-                    elif not self.location_is_valid(location):
-                        return False, "invalid parking location", status
-                    elif status > 0:
-                        return False, self._status_codes[str(status)]
-            except Exception as e:
-                return False, f"error parsing lock confirmation: {e}", -1
-        else:
-            return False, "timeout waiting for lock confirmation", -1
 
+    async def scooter_unlock_single_async(self : object, scooter : dict, coriders : list=None) -> tuple[bool, int, str]:
+        """
+        Awaitable version of scooter_unlock_single, suspending the calling coroutine
+        instead of blocking the thread while waiting for the scooter's response.
+        """
+        if scooter['status'] == 11:
+            return False, 11, "scooter-occupied"
+
+        request_id, future = self._send_command(scooter, "unlock", coriders)
+        response = await self._await_response_async(request_id, future, MQTT_UNLOCK_TIMEOUT)
+        return self._parse_unlock_response(response, scooter)
+
+
+
+    async def scooter_lock_single_async(self : object, scooter : dict, coriders : list=None) -> tuple[bool, str, int]:
+        """
+        Awaitable version of scooter_lock_single, suspending the calling coroutine
+        instead of blocking the thread while waiting for the scooter's response.
+        """
+        request_id, future = self._send_command(scooter, "lock", coriders)
+        response = await self._await_response_async(request_id, future, MQTT_LOCK_TIMEOUT)
+        return self._parse_lock_response(response, scooter)
+
+
+
+    async def scooter_unlock_multi_async(self : object, scooters : list) -> list[tuple[bool, int, str]]:
+        """
+        Unlock the scooters of a co-ride. The commands to all scooters are published at
+        once and their responses awaited together, so a group takes about as long as
+        its slowest scooter rather than the sum of all of them.
+        Args:
+            scooters (list): The scooters to unlock.
+        Returns:
+            list: The result of scooter_unlock_single_async for every scooter, in the order given.
+        """
+        uuids = [scooter['uuid'] for scooter in scooters]
+        return list(await asyncio.gather(*(
+            self.scooter_unlock_single_async(scooter, [u for u in uuids if u != scooter['uuid']])
+            for scooter in scooters
+        )))
+
+
+
+    async def scooter_lock_multi_async(self : object, scooters : list) -> list[tuple[bool, str, int]]:
+        """
+        Lock the scooters of a co-ride concurrently, see scooter_unlock_multi_async.
+        Args:
+            scooters (list): The scooters to lock.
+        Returns:
+            list: The result of scooter_lock_single_async for every scooter, in the order given.
+        """
+        uuids = [scooter['uuid'] for scooter in scooters]
+        return list(await asyncio.gather(*(
+            self.scooter_lock_single_async(scooter, [u for u in uuids if u != scooter['uuid']])
+            for scooter in scooters
+        )))
@@ -0,0 +1,310 @@
+import os
+import logging
+from threading import Lock, Thread, Event
+
+from api import database
+from tools.singleton import singleton
+from tools.grid_index import grid_index
+
+
+SCOOTER_STATE_FLUSH_INTERVAL = float(os.getenv("SCOOTER_STATE_FLUSH_INTERVAL", 2.0))
+SCOOTER_INDEX_CELL_SIZE      = float(os.getenv("SCOOTER_INDEX_CELL_SIZE", 0.002))
+
+
+
+@singleton
+class scooter_state:
+    """
+    In-memory copy of the scooters table, keyed by scooter ID.
+    Scooter reads are served from memory instead of querying MySQL. The table is kept
+    up to date from two sources:
+
+    * MQTT: every response and abort from a scooter reports its status, battery and
+      location. These updates are applied in memory and marked dirty, and a background
+      thread flushes the dirty scooters to MySQL in batches every
+      SCOOTER_STATE_FLUSH_INTERVAL seconds.
+    * Database writes: the db class notifies this table after every scooter it writes
+      (e.g. when a rental is completed), so those rows are already persisted. A write
+      arriving while the scooter is being flushed marks it dirty again, as the flush
+      may overwrite it with the older row.
+
+    Scooters are loaded in bulk on start-up; a scooter missing from the table (e.g.
+    one added later) is read from the database once and kept from then on.
+
+    Rows have the same shape as returned by db.get_scooter: (uuid, lat, lon, status).
+    The locations are additionally kept in a grid_index, which answers nearby-scooter
+    queries without scanning the fleet.
+
+    #### Example:
+    ```python
+    from api.scooter_state import scooter_state
+
+    scooters = scooter_state()
+    scooters.get(1) -> (1, 63.41947, 10.40174, 0)
+    scooters.report(1, status=1, battery=12.0)
+    scooters.get(1) -> (1, 63.41947, 10.40174, 1)
+    scooters.nearest(63.4195, 10.4017, k=5, radius=500) -> [(3.9, (1, 63.41947, 10.40174, 1))]
+    ```
+    """
+
+    def __init__(self, db_client: database.db=None) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._db = db_client if db_client is not None else database.db()
+        self._rows = {}
+        self._battery = {}
+        self._dirty = set()
+        self._flushing = set()
+        self._index = grid_index(SCOOTER_INDEX_CELL_SIZE)
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._stopped = Event()
+
+        self._load()
+        self._db.add_scooter_observer(self._on_db_write)
+        self._flusher = Thread(target=self._run, name="scooter-state-flush", daemon=True)
+        self._flusher.start()
+
+
+
+    def _load(self) -> None:
+        """
+        Internal function loading every scooter from the database.
+        """
+        try:
+            rows = self._db.get_all_scooters()
+        except Exception as e:
+            self._logger.error(f"Error loading scooters, falling back to reading them on demand: {e}")
+            return
+        with self._lock:
+            for row in rows:
+                self._put(int(row[0]), tuple(row[0:4]))
+        self._logger.debug(f"Loaded {len(rows)} scooters into memory")
+
+
+
+    def get(self, scooter_id: int, row: tuple=None) -> tuple[int, float, float, int]:
+        """
+        Get a scooter, reading it from the database only if it is not in memory.
+        Args:
+            scooter_id (int): The ID of the scooter.
+            row (tuple): A row of the scooter that was already fetched from the database
+                (e.g. by rental_precheck), cached on a miss instead of querying again.
+        Returns:
+            tuple: (uuid, lat, lon, status), or None if the scooter does not exist.
+        """
+        scooter_id = int(scooter_id)
+        cached = self._rows.get(scooter_id)
+        if cached is not None:
+            return cached
+
+        if row is None:
+            row = self._db.get_scooter(scooter_id)
+            if row is None:
+                return None
+        with self._lock:
+            cached = self._rows.get(scooter_id)
+            if cached is None:
+                cached = self._put(scooter_id, tuple(row[0:4]))
+            return cached
+
+
+
+    def get_all(self) -> list[tuple[int, float, float, int]]:
+        """
+        Get every scooter held in memory.
+        """
+        with self._lock:
+            return list(self._rows.values())
+
+
+
+    def nearest(self, lat: float, lon: float, k: int, radius: float, status: int=None) -> list[tuple[float, tuple]]:
+        """
+        Find the scooters nearest to a location.
+        Args:
+            lat (float): Latitude of the location.
+            lon (float): Longitude of the location.
+            k (int): Maximum number of scooters to return.
+            radius (float): Maximum distance from the location in meters.
+            status (int): Only return scooters with this status code, or any status if None.
+        Returns:
+            list: (distance in meters, scooter row) tuples, nearest first.
+        """
+        accept = None if status is None else (lambda scooter_id: self._rows[scooter_id][3] == status)
+        with self._lock:
+            found = self._index.nearest(lat, lon, k, radius, accept)
+            return [(distance, self._rows[scooter_id]) for distance, scooter_id in found]
+
+
+
+    def battery(self, scooter_id: int) -> float:
+        """
+        Get the last battery level reported by a scooter, or None if it has not reported one.
+        """
+        return self._battery.get(int(scooter_id))
+
+
+
+    def report(self, scooter_id: int, lat: float=None, lon: float=None, status: int=None, battery: float=None) -> None:
+        """
+        Apply state reported by a scooter. The change is served from memory immediately
+        and written to the database with the next batch.
+        Args:
+            scooter_id (int): The ID of the scooter.
+            lat (float): The reported latitude, or None if unchanged.
+            lon (float): The reported longitude, or None if unchanged.
+            status (int): The reported status code, or None if unchanged.
+            battery (float): The reported battery level, or None if unchanged.
+        """
+        scooter_id = int(scooter_id)
+        if battery is not None:
+            self._battery[scooter_id] = battery
+
+        with self._lock:
+            current = self._rows.get(scooter_id)
+            if current is None:
+                # Unknown scooter: only persist state for scooters that exist in the database
+                return
+            updated = self._merge(current, lat, lon, status)
+            if updated != current:
+                self._put(scooter_id, updated)
+                self._dirty.add(scooter_id)
+
+
+
+    def on_message(self, message: dict) -> None:
+        """
+        Apply the state carried by an MQTT response or abort from a scooter.
+        Args:
+            message (dict): The decoded MQTT message.
+        """
+        if message.get("uuid") is None:
+            return
+        location = message.get("location") or {}
+        try:
+            self.report(
+                message["uuid"],
+                lat=location.get("latitude"),
+                lon=location.get("longitude"),
+                status=message.get("status"),
+                battery=message.get("battery")
+            )
+        except (TypeError, ValueError) as e:
+            self._logger.error(f"Invalid scooter state in message: {e}")
+
+
+
+    def on_remote_message(self, message: dict) -> None:
+        """
+        Apply scooter state received by another worker process. The receiving worker
+        persists it, so it is applied in memory only, without marking it dirty.
+        Args:
+            message (dict): The decoded MQTT message, as passed to on_message.
+        """
+        if message.get("uuid") is None:
+            return
+        location = message.get("location") or {}
+        try:
+            scooter_id = int(message["uuid"])
+            if message.get("battery") is not None:
+                self._battery[scooter_id] = message["battery"]
+            with self._lock:
+                current = self._rows.get(scooter_id)
+                if current is not None:
+                    self._put(scooter_id, self._merge(current, location.get("latitude"), location.get("longitude"), message.get("status")))
+        except (TypeError, ValueError) as e:
+            self._logger.error(f"Invalid scooter state in relayed message: {e}")
+
+
+
+    def flush(self) -> bool:
+        """
+        Write every dirty scooter to the database in one batch.
+        Scooters which fail to be written stay dirty and are retried with the next batch.
+        Scooters written by the database while the batch is in flight are marked dirty
+        again (see _on_db_write), so the batch cannot leave their older row behind.
+        Returns:
+            bool: True if the flush succeeded (or there was nothing to flush), False otherwise.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return True
+                dirty, self._dirty = self._dirty, set()
+                rows = [self._rows[scooter_id] for scooter_id in dirty]
+                self._flushing |= dirty
+
+            ok = False
+            try:
+                ok = self._db.update_scooters(rows)
+            finally:
+                with self._lock:
+                    self._flushing -= dirty
+                    if not ok:
+                        self._dirty |= dirty
+            return ok
+
+
+
+    def stop(self) -> None:
+        """
+        Stop the background flushing and write the remaining dirty scooters.
+        """
+        self._stopped.set()
+        self._flusher.join(timeout=SCOOTER_STATE_FLUSH_INTERVAL + 5)
+        self.flush()
+
+
+
+    def _run(self) -> None:
+        """
+        Internal loop of the flushing thread.
+        """
+        while not self._stopped.wait(SCOOTER_STATE_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                self._logger.error(f"Error flushing scooter state: {e}")
+
+
+
+    def _on_db_write(self, scooter_id: int, lat: float, lon: float, status: int) -> None:
+        """
+        Internal observer of the db class applying a scooter write which is already persisted.
+        """
+        scooter_id = int(scooter_id)
+        with self._lock:
+            current = self._rows.get(scooter_id)
+            if current is None:
+                return
+            self._put(scooter_id, self._merge(current, lat, lon, status))
+            if scooter_id in self._flushing:
+                # The batch in flight holds the older row and may overwrite this write
+                self._dirty.add(scooter_id)
+            else:
+                self._dirty.discard(scooter_id)
+
+
+
+    def _put(self, scooter_id: int, row: tuple) -> tuple:
+        """
+        Internal function storing a row and indexing its location. Must hold the lock.
+        """
+        self._rows[scooter_id] = row
+        self._index.update(scooter_id, row[1], row[2])
+        return row
+
+
+
+    @staticmethod
+    def _merge(row: tuple, lat: float, lon: float, status: int) -> tuple:
+        """
+        Internal function returning a row with the given fields replaced, keeping the
+        current value of every field that is None.
+        """
+        return (
+            row[0],
+            row[1] if lat is None else float(lat),
+            row[2] if lon is None else float(lon),
+            row[3] if status is None else int(status),
+        )
@@ -0,0 +1,172 @@
+import os
+import time
+import numpy as np
+
+
+TRANSACTION_COST_UNLOCK = int(os.getenv('TRANSACTION_COST_UNLOCK', '10'))
+TRANSACTION_COST_PER_MINUTE = int(os.getenv('TRANSACTION_COST_PER_MINUTE', '10'))
+TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON = int(os.getenv('TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON', '10'))
+
+# Comma-separated lists, e.g. "1,1,1,1,1,1,1,1.5,1.5,1,..." (24 values, one per hour of the day)
+PRICING_HOURLY_MULTIPLIERS = os.getenv('PRICING_HOURLY_MULTIPLIERS', '')
+PRICING_ZONE_MULTIPLIERS   = os.getenv('PRICING_ZONE_MULTIPLIERS', '')
+PRICING_UTC_OFFSET         = float(os.getenv('PRICING_UTC_OFFSET', '0'))
+
+SECONDS_PER_HOUR = 3600.0
+SECONDS_PER_DAY  = 86400.0
+
+
+
+class tariff:
+    """
+    A set of rates rides are priced with.
+
+    The price of a ride is
+
+        (unlock + per_minute * rated minutes) * zone multiplier - coriders * coride_discount
+
+    where every minute of the ride is weighted by the multiplier of the hour of the
+    day it falls in, so a ride crossing into peak hours is charged the peak rate only
+    for the minutes within them. Prices are never negative and are rounded to one decimal.
+
+    Args:
+        unlock (float): Fixed price per ride.
+        per_minute (float): Price per minute.
+        coride_discount (float): Discount per corider.
+        hourly (list): 24 multipliers of the per-minute price, one per hour of the day.
+        zones (list): Multipliers of the ride price, indexed by zone number.
+        utc_offset (float): Hours added to UTC to get the local time of day.
+
+    #### Example:
+    ```python
+    peak = tariff(hourly=[1.0] * 7 + [1.5] * 2 + [1.0] * 7 + [1.5] * 2 + [1.0] * 6, zones=[1.0, 1.2])
+    ```
+    """
+
+    def __init__(self, unlock: float=TRANSACTION_COST_UNLOCK, per_minute: float=TRANSACTION_COST_PER_MINUTE,
+                 coride_discount: float=TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON,
+                 hourly: list=None, zones: list=None, utc_offset: float=PRICING_UTC_OFFSET) -> None:
+        self.unlock = float(unlock)
+        self.per_minute = float(per_minute)
+        self.coride_discount = float(coride_discount)
+        self.hourly = np.ones(24) if hourly is None else np.asarray(hourly, dtype=np.float64)
+        self.zones = np.ones(1) if zones is None else np.asarray(zones, dtype=np.float64)
+        self.utc_offset = float(utc_offset) * SECONDS_PER_HOUR
+
+        if self.hourly.shape != (24,):
+            raise ValueError(f"tariff needs 24 hourly multipliers, got {self.hourly.size}")
+        if self.zones.ndim != 1 or self.zones.size == 0:
+            raise ValueError("tariff needs at least one zone multiplier")
+
+        # Rated minutes from midnight to the start of every hour, and for a whole day
+        self._cumulative = np.concatenate(([0.0], np.cumsum(self.hourly * 60.0)))
+
+
+    @classmethod
+    def from_env(cls) -> "tariff":
+        """
+        The tariff configured through the TRANSACTION_* and PRICING_* environment variables.
+        """
+        hourly = [float(x) for x in PRICING_HOURLY_MULTIPLIERS.split(",")] if PRICING_HOURLY_MULTIPLIERS else None
+        zones  = [float(x) for x in PRICING_ZONE_MULTIPLIERS.split(",")] if PRICING_ZONE_MULTIPLIERS else None
+        return cls(hourly=hourly, zones=zones)
+
+
+    def rated_minutes(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """
+        Minutes between start and end (epoch seconds), each weighted by its hourly multiplier.
+        """
+        return self._rated_since_epoch(end) - self._rated_since_epoch(start)
+
+
+    def _rated_since_epoch(self, t: np.ndarray) -> np.ndarray:
+        """
+        Rated minutes from the epoch to t, computed from whole days plus the part of the day.
+        """
+        local = t + self.utc_offset
+        days, seconds = np.divmod(local, SECONDS_PER_DAY)
+        hours, into_hour = np.divmod(seconds, SECONDS_PER_HOUR)
+        hours = np.minimum(hours, 23).astype(np.int64)
+        return days * self._cumulative[24] + self._cumulative[hours] + self.hourly[hours] * (into_hour / 60.0)
+
+
+
+DEFAULT_TARIFF = tariff.from_env()
+
+
+
+def _epoch_seconds(times) -> np.ndarray:
+    """
+    Convert an array of epoch seconds or of datetime64 values to float epoch seconds.
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype("datetime64[us]").astype(np.int64) / 1e6
+    return times.astype(np.float64)
+
+
+
+def price_rides(start, end, coriders=0, zones=0, rates: tariff=None) -> np.ndarray:
+    """
+    Price any number of rides in one call.
+    All arguments are columns of equal length (or scalars, which apply to every ride).
+
+    Args:
+        start (array): Start of every ride, as epoch seconds or datetime64.
+        end (array): End of every ride, as epoch seconds or datetime64.
+        coriders (array): Number of coriders of every ride (0 for single rides).
+        zones (array): Zone number of every ride, indexing the zone multipliers of the tariff.
+        rates (tariff): The tariff to price with, DEFAULT_TARIFF if None.
+
+    Returns:
+        np.ndarray: The price of every ride.
+
+    __Example__
+    ```python
+        price_rides(
+            start=np.array(["2025-04-01T07:50", "2025-04-01T12:00"], dtype="datetime64"),
+            end=np.array(["2025-04-01T08:10", "2025-04-01T12:05"], dtype="datetime64"),
+            coriders=np.array([0, 2]),
+        ) -> array([210., 40.])
+    ```
+    """
+    rates = DEFAULT_TARIFF if rates is None else rates
+    start = _epoch_seconds(start)
+    end   = _epoch_seconds(end)
+    start, end = np.broadcast_arrays(start, np.maximum(end, start))
+
+    minutes = rates.rated_minutes(start, end)
+    zone = rates.zones[np.asarray(zones, dtype=np.int64)]
+    discount = np.asarray(coriders, dtype=np.float64) * rates.coride_discount
+
+    price = (rates.unlock + rates.per_minute * minutes) * zone - discount
+    return np.round(np.maximum(price, 0.0), 1)
+
+
+
+def price_ride(minutes: float, coriders: int=0, zone: int=0, end: float=None, rates: tariff=None) -> float:
+    """
+    Price a single ride of the given length ending at end (epoch seconds, now if None).
+    """
+    end = time.time() if end is None else end
+    return float(price_rides([end - minutes * 60.0], [end], coriders, zone, rates)[0])
+
+
+
+def reprice_rentals(rentals: list, coriders=0, zones=0, rates: tariff=None) -> np.ndarray:
+    """
+    Price rentals as returned by the database (e.g. db.get_all_rentals), for re-billing
+    historic rentals or simulating a candidate tariff on them. Rentals without an end
+    time are priced as rides of zero minutes.
+    Args:
+        rentals (list): Rental rows: (id, user_id, scooter_id, is_active, start_time, end_time, total_price).
+        coriders (array): Number of coriders of every rental.
+        zones (array): Zone number of every rental.
+        rates (tariff): The tariff to price with, DEFAULT_TARIFF if None.
+    Returns:
+        np.ndarray: The price of every rental, in the order given.
+    """
+    start = np.array([rental[4] for rental in rentals], dtype="datetime64[us]")
+    end   = np.array([rental[5] for rental in rentals], dtype="datetime64[us]")
+    end   = np.where(np.isnat(end), start, end)
+    return price_rides(start, end, coriders, zones, rates)
@@ -1,10 +1,8 @@
 import os
 from api import database
+from logic import pricing
 
 DISABLE_TRANSACTIONS = os.getenv("DISABLE_TRANSACTIONS", "False").lower() == "true"
-TRANSACTION_COST_UNLOCK = int(os.getenv('TRANSACTION_COST_UNLOCK', '10'))
-TRANSACTION_COST_PER_MINUTE = int(os.getenv('TRANSACTION_COST_PER_MINUTE', '10'))
-TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON = int(os.getenv('TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON', '10'))
 
 db = None
 
@@ -87,24 +85,28 @@ def _process_transaction(user: dict, price: float) -> tuple[bool, str, float]:
 def pay_for_single_ride(user: dict, minutes: float) -> tuple[bool, str, float]:
     """
     Process a transaction for a single ride. Deducts the price from the user's balance.
+    The price is computed by the pricing module, for a ride ending now.
     Args:
         user (dict): Object representing the user.
         minutes (float): Time of the ride in minutes.
     """
-    price = round(TRANSACTION_COST_UNLOCK + (minutes * TRANSACTION_COST_PER_MINUTE),1)
+    price = pricing.price_ride(minutes)
     return _process_transaction(user, price)
 
 
-def pay_for_coride_ride(users: list, minutes: float, num_coriders: int) -> tuple[bool, str]:
+def pay_for_coride_ride(users: list, minutes: float, num_coriders: int) -> tuple[bool, str, float]:
     """
     Process a transaction for a coride ride. Deducts the price from the users' balance.
+    Every user pays the price of one ride, discounted for the coriders.
     Args:
         users (list): List of user objects.
         minutes (float): Time of the ride in minutes.
         num_coriders (int): Number of coriders.
+    Returns:
+        Tuple: As pay_for_single_ride, with the price each user pays.
     """
+    price = pricing.price_ride(minutes, coriders=num_coriders)
     for user in users:
-        price = TRANSACTION_COST_UNLOCK + (minutes * TRANSACTION_COST_PER_MINUTE) - (num_coriders * TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON)
         if _process_transaction(user, price)[0] == False:
-            return False, f"insufficient funds - user: {user['name']}"
-    return True, "transaction successful"
+            return False, f"insufficient funds - user: {user['name']}", price
+    return True, "transaction successful", price
@@ -1,71 +1,311 @@
 import os
+import time
+import asyncio
 import logging
-import requests
+from threading import Lock, Thread
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from tools import metrics
+from logic.weather_client import weather_client
 
-APP_VERSION                   = os.getenv("APP_VERSION", "0.1-SNAPSHOT")
-WEATHER_API_URL               = os.getenv("WEATHER_API_URL", None)
-WEATHER_API_CONTENT_TYPE      = os.getenv("WEATHER_API_CONTENT_TYPE", "application/json")
-WEATHER_API_USER_AGENT        = os.getenv("WEATHER_API_USER_AGENT", "application/json")
-WEATHER_API_CONTACT_INFO      = os.getenv("WEATHER_API_CONTACT_INFO", "jorgen.finsveen@ntnu.no")
 WEATHER_TEMPERATURE_THRESHOLD = int(os.getenv("WEATHER_TEMPERATURE_THRESHOLD", 0))
+WEATHER_CACHE_SIZE            = int(os.getenv("WEATHER_CACHE_SIZE", 1024))
+WEATHER_CACHE_PRECISION       = int(os.getenv("WEATHER_CACHE_PRECISION", 2))
+WEATHER_CACHE_DEFAULT_TTL     = float(os.getenv("WEATHER_CACHE_DEFAULT_TTL", 1800))
+WEATHER_CACHE_MAX_STALE       = float(os.getenv("WEATHER_CACHE_MAX_STALE", 10800))
+# Decision when no forecast can be had (API down, slow or circuit open): allow rides or not
+WEATHER_FAIL_OPEN             = os.getenv("WEATHER_FAIL_OPEN", "False").lower() == "true"
 DISABLE_WEATHER = os.getenv("DISABLE_WEATHER", "False").lower() == "true"
 
 logger = logging.getLogger(__name__)
 
+CACHE_LOOKUPS = metrics.counter("escooter_weather_cache_lookups_total", "Forecast cache lookups, by result [hit|stale|miss].", ("result",))
+
+
+
+class _forecast_cache:
+    """
+    Internal LRU cache of MET forecasts keyed by geo-cell.
+    A geo-cell is the location rounded to WEATHER_CACHE_PRECISION decimals (2 decimals
+    is roughly a 1 x 0.5 km cell in Trondheim), so scooters close to each other share
+    one forecast. Each entry remembers when it expires and its Last-Modified header,
+    which is used to revalidate it with a conditional request.
+
+    An entry is a dict, holding the verdict of is_weather_ok for the forecast so that
+    it is computed once per fetch instead of once per unlock:
+    ```python
+    {
+        "data": {...},                                  # Forecast JSON, None if fetched by another worker
+        "verdict": (True, "acceptable conditions", ""), # See is_weather_ok
+        "expires": 1746390000.0,                        # Epoch seconds
+        "last_modified": "Sun, 04 May 2025 20:00:00 GMT"
+    }
+    ```
+    """
+
+    def __init__(self, size: int) -> None:
+        self._size = max(1, size)
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = Lock()
+
+
+    def get(self, cell: tuple[float, float]) -> dict:
+        with self._lock:
+            entry = self._entries.get(cell)
+            if entry is not None:
+                self._entries.move_to_end(cell)
+            return entry
+
+
+    def put(self, cell: tuple[float, float], entry: dict) -> None:
+        with self._lock:
+            self._entries[cell] = entry
+            self._entries.move_to_end(cell)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+
+    def start_refresh(self, cell: tuple[float, float]) -> bool:
+        """
+        Mark a cell as being revalidated. Returns False if it already is.
+        """
+        with self._lock:
+            if cell in self._refreshing:
+                return False
+            self._refreshing.add(cell)
+            return True
+
+
+    def end_refresh(self, cell: tuple[float, float]) -> None:
+        with self._lock:
+            self._refreshing.discard(cell)
+
+
+
+_cache = _forecast_cache(WEATHER_CACHE_SIZE)
+_forwarders = []
+
+
+
+def _cell(latitude: float, longitude: float) -> tuple[float, float]:
+    """
+    Internal function mapping a location to the geo-cell used as cache key.
+    """
+    return round(float(latitude), WEATHER_CACHE_PRECISION), round(float(longitude), WEATHER_CACHE_PRECISION)
+
+
+
+def _expires_at(headers: dict) -> float:
+    """
+    Internal function reading the Expires header of a MET response as epoch seconds.
+    Falls back to WEATHER_CACHE_DEFAULT_TTL if the header is missing or invalid.
+    """
+    try:
+        return parsedate_to_datetime(headers["Expires"]).timestamp()
+    except Exception:
+        return time.time() + WEATHER_CACHE_DEFAULT_TTL
+
+
+
+def _to_entry(cell: tuple[float, float], status_code: int, data: dict, headers: dict) -> dict:
+    """
+    Internal function turning a MET response into a cache entry and storing it.
+    A 304 Not Modified response extends the lifetime of the already cached entry.
+    Returns:
+        dict: The new cache entry, or None if the response was not usable.
+    """
+    if status_code == 304:
+        entry = _cache.get(cell)
+        if entry is None:
+            return None
+        entry = {**entry, "expires": _expires_at(headers)}
+    elif status_code == 200:
+        entry = {
+            "data": data,
+            "verdict": _evaluate(data),
+            "expires": _expires_at(headers),
+            "last_modified": headers.get("Last-Modified"),
+        }
+    else:
+        logger.error(f"Invalid response code: {status_code}")
+        return None
+
+    _cache.put(cell, entry)
+    for forward in _forwarders:
+        forward(cell, entry)
+    return entry
+
+
+
+def _request_forecast(cell: tuple[float, float], last_modified: str=None) -> dict:
+    """
+    Internal function fetching the forecast of a geo-cell through the weather client.
+    Args:
+        cell (tuple): The geo-cell (latitude, longitude) to fetch the forecast for.
+        last_modified (str): Last-Modified of a cached forecast, for conditional requests.
+    Returns:
+        dict: The resulting cache entry, or None if the forecast could not be fetched.
+    """
+    response = weather_client().get(cell[0], cell[1], last_modified)
+    return _to_entry(cell, *response) if response is not None else None
+
+
+
+async def _request_forecast_async(cell: tuple[float, float], last_modified: str=None) -> dict:
+    """
+    Internal coroutine fetching the forecast of a geo-cell without blocking the event loop.
+    Args:
+        cell (tuple): The geo-cell (latitude, longitude) to fetch the forecast for.
+        last_modified (str): Last-Modified of a cached forecast, for conditional requests.
+    Returns:
+        dict: The resulting cache entry, or None if the forecast could not be fetched.
+    """
+    response = await weather_client().get_async(cell[0], cell[1], last_modified)
+    return _to_entry(cell, *response) if response is not None else None
+
+
+
+def _revalidate(cell: tuple[float, float], last_modified: str) -> None:
+    """
+    Internal function revalidating a stale cache entry in the background.
+    """
+    try:
+        _request_forecast(cell, last_modified)
+    finally:
+        _cache.end_refresh(cell)
+
+
+
+async def _revalidate_async(cell: tuple[float, float], last_modified: str) -> None:
+    """
+    Internal coroutine revalidating a stale cache entry in the background.
+    """
+    try:
+        await _request_forecast_async(cell, last_modified)
+    finally:
+        _cache.end_refresh(cell)
+
+
+
+def _lookup(cell: tuple[float, float]) -> tuple[dict, bool]:
+    """
+    Internal function looking up a cell in the cache.
+    Returns:
+        tuple:
+         * [0]: _dict_. The cache entry if it may be served (fresh or stale within
+                WEATHER_CACHE_MAX_STALE), None otherwise.
+         * [1]: _bool_. True if the entry is stale and should be revalidated.
+    """
+    entry = _cache.get(cell)
+    now = time.time()
+    if entry is not None and now < entry["expires"]:
+        CACHE_LOOKUPS.labels("hit").inc()
+        return entry, False
+    if entry is not None and now < entry["expires"] + WEATHER_CACHE_MAX_STALE:
+        CACHE_LOOKUPS.labels("stale").inc()
+        return entry, True
+    CACHE_LOOKUPS.labels("miss").inc()
+    return None, False
+
 
 
 def _get_weather(latitude: float, longtiude: float) -> dict:
     """
-    Internal function fecthing weather data from the specified weather forecast API.
-    The API URL is set in the environment variable WEATHER_API_URL.
-    API used for this project is the MET API from Norway. Using other APIs may require
-    different parameters and headers and result in different JSON format.
+    Internal function returning the cache entry of the forecast for the geo-cell of a location.
+    Fresh forecasts are served from the cache. Stale forecasts are served from the
+    cache while being revalidated in the background, and a cache miss is fetched
+    from the API with a conditional request when an old entry exists.
+    Args:
+        latitude (float): Latitude of the location.
+        longtiude (float): Longitude of the location.
+    Returns:
+        dict: The cache entry, or None if no forecast could be had.
+    """
+    cell = _cell(latitude, longtiude)
+    entry, stale = _lookup(cell)
+
+    if entry is not None:
+        if stale and _cache.start_refresh(cell):
+            Thread(target=_revalidate, args=(cell, entry["last_modified"]), daemon=True).start()
+        return entry
+
+    expired = _cache.get(cell)
+    return _request_forecast(cell, expired["last_modified"] if expired else None)
+
+
 
-    See:
-        * <a href="https://api.met.no/weatherapi/documentation">api.met.no</a>
+_background_tasks = set()
+
+async def _get_weather_async(latitude: float, longtiude: float) -> dict:
+    """
+    Internal coroutine returning the cache entry of the forecast for the geo-cell of a location.
+    Same as _get_weather, but revalidates and fetches without blocking the event loop.
     Args:
         latitude (float): Latitude of the location.
         longtiude (float): Longitude of the location.
     Returns:
-        dict: Weather data in JSON format.
+        dict: The cache entry, or None if no forecast could be had.
     """
-    if WEATHER_API_URL is None:
-        logger.error("API_URL is not set.")
-        return None
-    
-    url = f"{WEATHER_API_URL}?lat={latitude}&lon={longtiude}"
-    headers = {
-        "Content-Type": WEATHER_API_CONTENT_TYPE,
-        "User-Agent": f"{WEATHER_API_USER_AGENT}/{APP_VERSION} {WEATHER_API_CONTACT_INFO}"
-    }
+    cell = _cell(latitude, longtiude)
+    entry, stale = _lookup(cell)
+
+    if entry is not None:
+        if stale and _cache.start_refresh(cell):
+            task = asyncio.create_task(_revalidate_async(cell, entry["last_modified"]))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        return entry
+
+    expired = _cache.get(cell)
+    return await _request_forecast_async(cell, expired["last_modified"] if expired else None)
+
+
+
+def _evaluate(weather: dict) -> tuple[bool, str, str]:
+    """
+    Internal function deciding whether the fetched weather data is acceptable for scooter usage.
+    Args:
+        weather (dict): Weather data in JSON format, or None if it could not be fetched.
+    Returns:
+        Tuple: See is_weather_ok.
+    """
+    if weather is None:
+        if WEATHER_FAIL_OPEN:
+            return True, "weather data unavailable, check skipped", ""
+        return False, "error fetching weather data", "bad-weather"
+
+    stats       = weather["properties"]["timeseries"][0]["data"]["instant"]["details"]
+    temperature = float(stats["air_temperature"])
+    humidity    = float(stats["relative_humidity"])
+
+    if temperature >= WEATHER_TEMPERATURE_THRESHOLD:
+        return True, f"acceptable conditions <br/> temperature: {temperature} <br/> humidity: {humidity}", ""
+    else:
+        return False, f"insufficient conditions <br/> Temperature: {temperature} <br/> humidity: {humidity}", "bad-weather"
+
 
-    try: 
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            logger.error(f"Invalid response code: {response.status_code}")
-            return None
-        else:
-            return response.json()
-    except Exception as e:
-        logger.error(f"Error fetching weather data: {e}")
-        return None
-        
-            
 
 def is_weather_ok(latitude: float, longtitude: float) -> tuple[bool, str, str]:
     """
     Check if the weather conditions are acceptable for scooter usage.
     Wether conditions are considered acceptable if the temperature is above the
     threshold set in the environment variable WEATHER_TEMPERATURE_THRESHOLD.
-    The temperature is fetched from the MET API.
+    The temperature is fetched from the MET API, through a forecast cache keyed
+    by geo-cell which honours the Expires and Last-Modified headers of the API.
+    The verdict is computed when a forecast is fetched, and forecasts of the cells
+    holding scooters are refreshed ahead of expiry by the weather_prefetch_service,
+    so an unlock usually costs one cache lookup.
+    If no forecast can be had, rides are refused, or allowed if WEATHER_FAIL_OPEN is set.
     Args:
         latitude (float): Latitude of the location.
         longtitude (float): Longtitude of the location.
     Returns:
-        Tuple: 
+        Tuple:
          * [0]: _bool_. True if the weather conditions are acceptable, False otherwise.
          * [1]: _str_. A message indicating the result of the weather check.
-        
+
         __Example__
     ```python
         is_weather_ok(63.41947, 10.40174) ->
@@ -74,17 +314,87 @@ def is_weather_ok(latitude: float, longtitude: float) -> tuple[bool, str, str]:
     """
     if DISABLE_WEATHER:
         return True, "weather check disabled", ""
-    
-    weather = _get_weather(latitude, longtitude)
 
-    if weather is None:
-        return False, "error fetching weather data", "bad-weather"
+    entry = _get_weather(latitude, longtitude)
+    return entry["verdict"] if entry is not None else _evaluate(None)
 
-    stats       = weather["properties"]["timeseries"][0]["data"]["instant"]["details"]
-    temperature = float(stats["air_temperature"])
-    humidity    = float(stats["relative_humidity"])
 
-    if temperature >= WEATHER_TEMPERATURE_THRESHOLD:
-        return True, f"acceptable conditions <br/> temperature: {temperature} <br/> humidity: {humidity}", ""
-    else:
-        return False, f"insufficient conditions <br/> Temperature: {temperature} <br/> humidity: {humidity}", "bad-weather"
+
+async def is_weather_ok_async(latitude: float, longtitude: float) -> tuple[bool, str, str]:
+    """
+    Awaitable version of is_weather_ok, used by the asynchronous unlock pipeline.
+    Args:
+        latitude (float): Latitude of the location.
+        longtitude (float): Longtitude of the location.
+    Returns:
+        Tuple: See is_weather_ok.
+    """
+    if DISABLE_WEATHER:
+        return True, "weather check disabled", ""
+
+    entry = await _get_weather_async(latitude, longtitude)
+    return entry["verdict"] if entry is not None else _evaluate(None)
+
+
+
+def cells_to_refresh(locations: list[tuple[float, float]], ahead: float) -> list[tuple[float, float]]:
+    """
+    The geo-cells of the given locations whose forecast is not cached, or expires
+    within the given number of seconds. Used to prefetch forecasts before they are needed.
+    Args:
+        locations (list): (latitude, longitude) of e.g. every scooter.
+        ahead (float): Seconds before expiry from which a forecast is refreshed.
+    Returns:
+        list: The geo-cells, each once.
+    """
+    deadline = time.time() + ahead
+    cells = {_cell(latitude, longitude) for latitude, longitude in locations}
+    return [cell for cell in cells if (_cache.get(cell) or {"expires": 0.0})["expires"] <= deadline]
+
+
+
+def refresh(cell: tuple[float, float]) -> bool:
+    """
+    Fetch the forecast of a geo-cell and store it with its verdict in the cache,
+    with a conditional request if it is cached already. Does nothing if the cell is
+    already being revalidated.
+    Args:
+        cell (tuple): The geo-cell, as returned by cells_to_refresh.
+    Returns:
+        bool: True if a forecast was fetched or revalidated.
+    """
+    if not _cache.start_refresh(cell):
+        return False
+    try:
+        cached = _cache.get(cell)
+        return _request_forecast(cell, cached["last_modified"] if cached else None) is not None
+    finally:
+        _cache.end_refresh(cell)
+
+
+
+def add_forwarder(callback) -> None:
+    """
+    Register a callback receiving every forecast fetched in this process, called as
+    callback(cell, entry), e.g. to relay it to the other workers (see store).
+    """
+    _forwarders.append(callback)
+
+
+
+def store(cell: tuple[float, float], verdict: tuple[bool, str, str], expires: float, last_modified: str=None) -> None:
+    """
+    Store the verdict of a forecast fetched by another worker process, so that only one
+    process fetches each forecast from the API. The forecast itself is not stored, only
+    its verdict, expiry and Last-Modified, which is all that unlocks and revalidation use.
+    Args:
+        cell (tuple): The geo-cell of the forecast.
+        verdict (tuple): The verdict of the forecast, see is_weather_ok.
+        expires (float): When the forecast expires, in epoch seconds.
+        last_modified (str): Last-Modified of the forecast.
+    """
+    cell = (float(cell[0]), float(cell[1]))
+    cached = _cache.get(cell)
+    if cached is not None and cached["expires"] >= expires:
+        return
+    _cache.put(cell, {"data": None, "verdict": tuple(verdict), "expires": float(expires), "last_modified": last_modified})
@@ -0,0 +1,179 @@
+import os
+import time
+import httpx
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+from tools import metrics
+from tools.singleton import singleton
+from tools.circuit_breaker import circuit_breaker, CLOSED, OPEN, HALF_OPEN
+
+APP_VERSION              = os.getenv("APP_VERSION", "0.1-SNAPSHOT")
+WEATHER_API_URL          = os.getenv("WEATHER_API_URL", None)
+WEATHER_API_CONTENT_TYPE = os.getenv("WEATHER_API_CONTENT_TYPE", "application/json")
+WEATHER_API_USER_AGENT   = os.getenv("WEATHER_API_USER_AGENT", "application/json")
+WEATHER_API_CONTACT_INFO = os.getenv("WEATHER_API_CONTACT_INFO", "jorgen.finsveen@ntnu.no")
+WEATHER_POOL_SIZE        = int(os.getenv("WEATHER_POOL_SIZE", 10))
+WEATHER_CONNECT_TIMEOUT  = float(os.getenv("WEATHER_CONNECT_TIMEOUT", 2.0))
+WEATHER_READ_TIMEOUT     = float(os.getenv("WEATHER_READ_TIMEOUT", 3.0))
+WEATHER_BREAKER_FAILURES = int(os.getenv("WEATHER_BREAKER_FAILURES", 5))
+WEATHER_BREAKER_RESET    = float(os.getenv("WEATHER_BREAKER_RESET", 30.0))
+WEATHER_BREAKER_SLOW     = float(os.getenv("WEATHER_BREAKER_SLOW", 2.0))
+
+FETCH_SECONDS = metrics.histogram("escooter_weather_fetch_seconds", "Time spent fetching a forecast from the weather API.", ("result",))
+BREAKER_STATE = metrics.gauge(
+    "escooter_weather_breaker_state", "State of the weather API circuit breaker, by state (1 for the current one).", ("state",),
+    callback=lambda: {(state,): int(weather_client().breaker.state == state) for state in (CLOSED, OPEN, HALF_OPEN)}
+)
+BREAKER_REJECTED = metrics.counter(
+    "escooter_weather_breaker_rejected_total", "Forecast fetches skipped because the circuit breaker was open.",
+    callback=lambda: weather_client().breaker.rejected
+)
+
+
+
+@singleton
+class weather_client:
+    """
+    HTTP client of the weather forecast API (the MET API from Norway).
+    Keeps a pool of up to WEATHER_POOL_SIZE keep-alive connections per client, so
+    forecasts are fetched without a new DNS lookup and TCP/TLS handshake each time,
+    asks for gzip-compressed responses, and bounds every request by
+    WEATHER_CONNECT_TIMEOUT and WEATHER_READ_TIMEOUT. A circuit breaker skips the API
+    for WEATHER_BREAKER_RESET seconds after WEATHER_BREAKER_FAILURES failed or slow
+    (over WEATHER_BREAKER_SLOW seconds) requests in a row.
+
+    The API URL is set in the environment variable WEATHER_API_URL, which may point
+    to a local stub server (see benchmarks/stub_met_server.py).
+
+    See:
+        * <a href="https://api.met.no/weatherapi/documentation">api.met.no</a>
+
+    #### Example:
+    ```python
+    from logic.weather_client import weather_client
+
+    response = weather_client().get(63.42, 10.40)
+    if response is not None:
+        status_code, data, headers = response
+    ```
+    """
+
+    def __init__(self, url: str=WEATHER_API_URL) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._url = url
+        self._headers = {
+            "Content-Type": WEATHER_API_CONTENT_TYPE,
+            "User-Agent": f"{WEATHER_API_USER_AGENT}/{APP_VERSION} {WEATHER_API_CONTACT_INFO}",
+            "Accept-Encoding": "gzip",
+        }
+        self.breaker = circuit_breaker("weather", WEATHER_BREAKER_FAILURES, WEATHER_BREAKER_RESET, WEATHER_BREAKER_SLOW)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, WEATHER_POOL_SIZE), max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update(self._headers)
+        self._async_client = None
+
+
+
+    def _request(self, latitude: float, longitude: float, last_modified: str) -> tuple[str, dict]:
+        """
+        Internal function building the URL and headers of a forecast request.
+        """
+        headers = {"If-Modified-Since": last_modified} if last_modified is not None else {}
+        return f"{self._url}?lat={latitude}&lon={longitude}", headers
+
+
+
+    def _record(self, started: float, status_code: int=None, error: Exception=None) -> None:
+        """
+        Internal function recording the outcome of a request in the breaker and metrics.
+        """
+        seconds = time.perf_counter() - started
+        if error is not None:
+            result = "timeout" if isinstance(error, (requests.Timeout, httpx.TimeoutException)) else "error"
+        else:
+            result = {200: "ok", 304: "not_modified"}.get(status_code, "error")
+        self.breaker.record(seconds, ok=result in ("ok", "not_modified"))
+        FETCH_SECONDS.labels(result).observe(seconds)
+
+
+
+    def get(self, latitude: float, longitude: float, last_modified: str=None) -> tuple[int, dict, dict]:
+        """
+        Fetch the forecast for a location, blocking the calling thread.
+        Args:
+            latitude (float): Latitude of the location.
+            longitude (float): Longitude of the location.
+            last_modified (str): Last-Modified of a cached forecast, sent as If-Modified-Since.
+        Returns:
+            tuple: (status_code, data, headers), where data is the forecast JSON of a 200
+            response, or None if the API is not configured, failed, or the breaker is open.
+        """
+        if self._url is None:
+            self._logger.error("API_URL is not set.")
+            return None
+        if not self.breaker.allow():
+            return None
+
+        url, headers = self._request(latitude, longitude, last_modified)
+        started = time.perf_counter()
+        try:
+            response = self._session.get(url, headers=headers, timeout=(WEATHER_CONNECT_TIMEOUT, WEATHER_READ_TIMEOUT))
+            data = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            self._record(started, error=e)
+            self._logger.error(f"Error fetching weather data: {e}")
+            return None
+        self._record(started, response.status_code)
+        return response.status_code, data, response.headers
+
+
+
+    async def get_async(self, latitude: float, longitude: float, last_modified: str=None) -> tuple[int, dict, dict]:
+        """
+        Awaitable version of get, fetching with a pooled asynchronous client so that
+        the event loop is not blocked while waiting for the API.
+        """
+        if self._url is None:
+            self._logger.error("API_URL is not set.")
+            return None
+        if not self.breaker.allow():
+            return None
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=self._headers,
+                timeout=httpx.Timeout(WEATHER_READ_TIMEOUT, connect=WEATHER_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=max(1, WEATHER_POOL_SIZE), max_keepalive_connections=max(1, WEATHER_POOL_SIZE)),
+            )
+
+        url, headers = self._request(latitude, longitude, last_modified)
+        started = time.perf_counter()
+        try:
+            response = await self._async_client.get(url, headers=headers)
+            data = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            self._record(started, error=e)
+            self._logger.error(f"Error fetching weather data: {e}")
+            return None
+        except BaseException as e:
+            # Cancelled: still end a half-open trial, so the breaker cannot stay open
+            self._record(started, error=e)
+            raise
+        self._record(started, response.status_code)
+        return response.status_code, data, response.headers
+
+
+
+    async def aclose(self) -> None:
+        """
+        Close the pooled connections of both clients.
+        """
+        self._session.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
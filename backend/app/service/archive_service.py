@@ -0,0 +1,101 @@
+import os
+import logging
+from threading import Thread, Event
+
+from api import database
+from tools.singleton import singleton
+
+
+RENTAL_ARCHIVE_INTERVAL      = float(os.getenv("RENTAL_ARCHIVE_INTERVAL", 300))
+RENTAL_ARCHIVE_BATCH_SIZE    = int(os.getenv("RENTAL_ARCHIVE_BATCH_SIZE", 1000))
+RENTAL_ARCHIVE_BATCH_PAUSE   = float(os.getenv("RENTAL_ARCHIVE_BATCH_PAUSE", 0.5))
+RENTAL_ARCHIVE_MAX_BATCHES   = int(os.getenv("RENTAL_ARCHIVE_MAX_BATCHES", 100))
+RENTAL_ARCHIVE_MIN_AGE       = float(os.getenv("RENTAL_ARCHIVE_MIN_AGE", 86400))
+RENTAL_ARCHIVE_MONTHS_AHEAD  = int(os.getenv("RENTAL_ARCHIVE_MONTHS_AHEAD", 2))
+
+
+
+@singleton
+class archive_service:
+    """
+    Background service moving completed rentals to the rentals_archive table.
+    Every RENTAL_ARCHIVE_INTERVAL seconds, it makes sure the monthly partitions of the
+    archive exist and moves completed rentals older than RENTAL_ARCHIVE_MIN_AGE in
+    batches of RENTAL_ARCHIVE_BATCH_SIZE, pausing between batches so that no run holds
+    locks on db.rentals for long. This keeps the hot rentals table small while keeping
+    the billing history.
+
+    #### Example:
+    ```python
+    archiver = archive_service()
+    archiver.start()
+    ...
+    archiver.stop()
+    ```
+    """
+
+    def __init__(self, db_client: database.db=None) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._db = db_client if db_client is not None else database.db()
+        self._stopped = Event()
+        self._thread = None
+
+
+
+    def start(self) -> None:
+        """
+        Start archiving in a background thread.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name="rental-archive", daemon=True)
+        self._thread.start()
+
+
+
+    def stop(self) -> None:
+        """
+        Stop archiving, letting the batch in progress finish.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+
+
+    def archive(self) -> int:
+        """
+        Run one archival pass.
+        Returns:
+            int: The number of rentals moved to the archive.
+        """
+        if not self._db.ensure_archive_partitions(RENTAL_ARCHIVE_MONTHS_AHEAD):
+            return 0
+
+        moved = 0
+        for _ in range(max(1, RENTAL_ARCHIVE_MAX_BATCHES)):
+            batch = self._db.archive_rentals(RENTAL_ARCHIVE_BATCH_SIZE, RENTAL_ARCHIVE_MIN_AGE)
+            if batch <= 0:
+                break
+            moved += batch
+            if batch < RENTAL_ARCHIVE_BATCH_SIZE or self._stopped.wait(RENTAL_ARCHIVE_BATCH_PAUSE):
+                break
+
+        if moved:
+            self._logger.info(f"Archived {moved} completed rentals")
+        return moved
+
+
+
+    def _run(self) -> None:
+        """
+        Internal loop of the archiving thread.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.archive()
+            except Exception as e:
+                self._logger.error(f"Error archiving rentals: {e}")
+            self._stopped.wait(RENTAL_ARCHIVE_INTERVAL)
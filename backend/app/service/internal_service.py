@@ -5,8 +5,10 @@ import logging
 from datetime import datetime
 
 from api import database
+from api.ledger import ledger
 from logic import transaction
 from tools.singleton import singleton
+from service.rental_events import rental_events
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,18 +24,23 @@ class internal_service:
     def __init__(self):
         self._logger = logging.getLogger(__name__)
         self._db = database.db()
+        self._ledger = ledger(self._db)
+        self._events = rental_events()
         with open(SCOOTER_STATUS_CODES_PATH, 'r') as f:
             self._status_codes = json.load(f)
 
 
-    def session_aborted(self, scooter_id: int, payload: dict) -> tuple[bool, bool]:
+    def session_aborted(self, scooter_id: int, payload: dict) -> bool:
         """
         Handle the session aborted event.
         This function is called when the scooter session is aborted.
-        It updates the scooter status in the database and charges the user for the ride.
+        It updates the scooter status in the database and charges the user for the ride,
+        both in one transaction which is applied at most once per rental.
         Args:
             scooter_id (int): The ID of the scooter.
             payload (dict): The payload data from the scooter upon abort alert.
+        Returns:
+            bool: True if the rental was completed and charged (now or before), False otherwise.
         """
         self._logger.warning(f"Session aborted for scooter {scooter_id}: {self._status_codes[str(payload['status'])]}")
 
@@ -46,13 +53,14 @@ class internal_service:
         time_d = abs((time_e - time_s) / 60.0)
 
         _, _, price        = transaction.pay_for_single_ride(user, time_d)
-        db_req_payment     = self._db.charge_user(user['id'], price)
-        db_rental_complete = self._db.rental_completed(user['id'], price, 
+        db_rental_complete = self._ledger.complete_rental(rental['rental_id'], user['id'], price,
                                   payload['location']['latitude'], 
                                   payload['location']['longitude'], 
                                   payload['status'])
+
+        self._events.publish(rental['rental_id'], False, self._status_codes[str(payload['status'])], final=True)
         
-        return db_rental_complete, db_req_payment
+        return db_rental_complete
     
 
 
@@ -71,14 +79,12 @@ class internal_service:
             lon (float): The longitude of the scooter location.
         """
         if self._status_codes[str(status)] == "distress":
-            self._logger.critical("Session aborted due to distress alert:")
-            self._logger.critical(f"\tUser: {user['name']}")
-            self._logger.critical(f"\tScooter: {scooter}")
-            self._logger.critical(f"\tTime: {datetime.fromtimestamp(time.time())}")
-            self._logger.critical(f"\tLocation:")
-            self._logger.critical(f"\t\tLatitude:  {lat}")
-            self._logger.critical(f"\t\tLongitude: {lon}")
-            self._logger.critical(f"Contacting emergency services...")
+            self._logger.critical("Session aborted due to distress alert, contacting emergency services...", extra={"incident": {
+                "user":     user['name'],
+                "scooter":  scooter,
+                "time":     datetime.fromtimestamp(time.time()),
+                "location": {"latitude": lat, "longitude": lon},
+            }})
 
 
 
@@ -1,19 +1,374 @@
+import os
+import asyncio
 import logging
 
 from api import mqtt, database
+from api.ledger import ledger
+from api.scooter_state import scooter_state
 from tools.singleton import singleton
 from logic import transaction, weather
+from service.single_ride_service import single_ride_service
+from service.rental_events import rental_events
 
 
 
+DISABLE_MQTT        = os.getenv("DISABLE_MQTT", "False").lower() == "true"
+CORIDE_MAX_SCOOTERS = int(os.getenv("CORIDE_MAX_SCOOTERS", "5"))
+
+
 
 @singleton
 class multi_ride_service:
     """
     This class handles the multi-ride service for the scooter.
     It is responsible for handling the multi-ride requests and responses.
+
+    In a co-ride, one leader unlocks and locks a group of scooters with a single request.
+    The group is handled as one unit rather than as N single rides:
+
+    * the group is validated with one database round-trip and one weather lookup,
+    * the MQTT commands to all scooters are sent at once and their responses awaited
+      together, so the group takes about as long as a single unlock,
+    * the session, rentals and coriders of the group are written in one transaction, and
+    * the group is priced once and charged in one ledger transaction.
+
+    Every scooter of the group gets an ordinary rental, so rental status, streaming and
+    aborts work as for single rides. Like single_ride_service, the service holds no
+    per-request state and may be shared by concurrent requests.
     """
     def __init__(self):
         self._logger = logging.getLogger(__name__)
         self._db = database.db()
+        self._async_db = database.async_db(self._db)
+        self._scooters = scooter_state(self._db)
+        self._ledger = ledger(self._db)
         self._mqtt = mqtt.mqtt_client()
+        self._events = rental_events()
+        self._rides = single_ride_service()
+
+
+
+    async def unlock_scooters(self, leader_id: int, scooter_ids: list[int], rider_ids: list[int]=None) -> tuple[bool, str, str, dict]:
+        """
+        Unlock a group of scooters for a co-ride. This function checks that none of the
+        scooters and riders are occupied, that every scooter is available, that the riders
+        have sufficient funds and that the weather is ok, before unlocking all scooters
+        concurrently. If any scooter fails to unlock, the scooters which did unlock are
+        locked again and no rental is started.
+        Args:
+            leader_id (int): The ID of the user leading the group.
+            scooter_ids (list): The IDs of the scooters to unlock.
+            rider_ids (list): The ID of the user riding each scooter, in the order of
+                scooter_ids. If None, the leader is the rider of every scooter.
+        Returns:
+            tuple:
+                * [0]: (bool) True if the unlock was successful, False otherwise.
+                * [1]: (str) A message indicating the result of the operation.
+                * [2]: (str) The redirect of the result.
+                * [3]: (dict) The session ID and rentals of the group, or None.
+        """
+        leader_id = int(leader_id)
+        scooter_ids = [int(scooter_id) for scooter_id in scooter_ids]
+        rider_ids = [leader_id] * len(scooter_ids) if not rider_ids else [int(user_id) for user_id in rider_ids]
+
+        if not 2 <= len(scooter_ids) <= CORIDE_MAX_SCOOTERS or len(set(scooter_ids)) != len(scooter_ids):
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="request",
+                user_id=leader_id,
+                message=f"request error: a co-ride needs 2 to {CORIDE_MAX_SCOOTERS} distinct scooters, got {scooter_ids}",
+            )
+            return False, "invalid number of scooters", "invalid-request", None
+        if len(rider_ids) != len(scooter_ids):
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="request",
+                user_id=leader_id,
+                message=f"request error: {len(rider_ids)} riders given for {len(scooter_ids)} scooters",
+            )
+            return False, "every scooter needs one rider", "invalid-request", None
+
+        busy_scooters, _users, busy_users = await self._async_db.coride_precheck(scooter_ids, [leader_id, *rider_ids])
+        users = {user[0]: self._rides._parse_user(user) for user in _users}
+        scooters = [self._scooters.get(scooter_id) for scooter_id in scooter_ids]
+
+        missing = [scooter_id for scooter_id, scooter in zip(scooter_ids, scooters) if scooter is None]
+        if missing:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"scooter error: scooters not found: {missing}",
+                function=f"scooter_state.get({missing})"
+            )
+            return False, "database: scooter not found", "scooter-not-found", None
+        missing = [user_id for user_id in {leader_id, *rider_ids} if user_id not in users]
+        if missing:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"user error: users not found: {missing}",
+                function=f"coride_precheck({scooter_ids}, {rider_ids})"
+            )
+            return False, "database: user not found", "user-not-found", None
+        if busy_users:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"rental error: users have active rentals: {busy_users}",
+                function=f"coride_precheck({scooter_ids}, {rider_ids})"
+            )
+            return False, "user has active rental", "user-occupied", None
+        if busy_scooters:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"rental error: scooters have active rentals: {busy_scooters}",
+                function=f"coride_precheck({scooter_ids}, {rider_ids})"
+            )
+            return False, "scooter is already rented", "scooter-occupied", None
+
+        scooters = [self._rides._parse_scooter(scooter) for scooter in scooters]
+        for scooter in scooters:
+            if scooter["status"] != 0:
+                parse_code = self._rides.parse_status(scooter["status"])
+                self._rides._warn_logger(
+                    title="multi scooter unlock failed",
+                    culprit="scooter",
+                    user_id=leader_id,
+                    scooter_id=scooter["uuid"],
+                    message=f"scooter error: {parse_code[0]}",
+                    resp=f"status code: {scooter['status']}",
+                )
+                return False, parse_code[0], parse_code[1], None
+
+        for user_id in set(rider_ids):
+            # A rider of several scooters pays for every one of them
+            estimate = 100.0 * rider_ids.count(user_id)
+            balance_req = transaction.validate_funds(users[user_id], estimate)
+            if not balance_req[0]:
+                self._rides._warn_logger(
+                    title="multi scooter unlock failed",
+                    culprit="transactions",
+                    user_id=user_id,
+                    message="transaction error: insufficient funds",
+                    function=f"validate_funds({user_id}, {estimate})",
+                    resp=balance_req[1],
+                    transaction={"price": estimate, "funds": users[user_id]["funds"]}
+                )
+                return False, balance_req[1], balance_req[2], None
+
+        # The group rides together, so the weather at the leader's scooter applies to all
+        leader = scooters[0]
+        weather_req = await weather.is_weather_ok_async(leader["latitude"], leader["longtitude"])
+        if not weather_req[0]:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="weather",
+                user_id=leader_id,
+                scooter_id=leader["uuid"],
+                message="weather error: weather is not ok",
+                function=f"is_weather_ok({leader['latitude']}, {leader['longtitude']})",
+                resp=weather_req[1],
+                location={"lat": leader["latitude"], "lon": leader["longtitude"]}
+            )
+            return False, weather_req[1], weather_req[2], None
+
+        if DISABLE_MQTT:
+            unlocks = [(True, 0, "mqtt disabled")] * len(scooters)
+        else:
+            unlocks = await self._mqtt.scooter_unlock_multi_async(scooters)
+
+        failed = [(scooter, unlock) for scooter, unlock in zip(scooters, unlocks) if not unlock[0]]
+        if failed:
+            scooter, unlock = failed[0]
+            parsed_status = self._rides.parse_status(unlock[1])
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="mqtt",
+                user_id=leader_id,
+                scooter_id=scooter["uuid"],
+                message=f"mqtt error: {len(failed)} of {len(scooters)} scooters failed to unlock",
+                function=f"scooter_unlock_multi_async({scooter_ids})",
+                resp=f"satus code: {unlock[1]} - {parsed_status[0]}"
+            )
+            await self._release([s for s, u in zip(scooters, unlocks) if u[0]])
+            return False, parsed_status[0], parsed_status[1], None
+
+        started = await self._async_db.coride_started(
+            leader_id, list(zip(rider_ids, scooter_ids)), leader["latitude"], leader["longtitude"]
+        )
+        if started is None:
+            self._rides._warn_logger(
+                title="multi scooter unlock failed",
+                culprit="database",
+                user_id=leader_id,
+                message="rental error: co-ride not started",
+                function=f"coride_started({leader_id}, {list(zip(rider_ids, scooter_ids))})",
+            )
+            await self._release(scooters)
+            return False, "database error: rental not started", "rental-error", None
+
+        session_id, rentals = started
+        return True, "unlock successful", "", {
+            "session_id": session_id,
+            "rentals": [
+                {"rental_id": rental_id, "user_id": user_id, "scooter_id": scooter_id}
+                for rental_id, user_id, scooter_id in rentals
+            ]
+        }
+
+
+
+    async def lock_scooters(self, leader_id: int) -> tuple[bool, str, dict]:
+        """
+        Lock every scooter of the active co-ride led by a user. The group is priced once,
+        then all scooters are locked concurrently, and the rentals of the scooters which
+        locked are completed and charged in one ledger transaction.
+        If some scooters fail to lock, the rentals of the others are still completed, so no
+        scooter is left locked with an active rental. The failed ones keep their rentals
+        and the co-ride stays active, so locking again retries only those, priced with the
+        corider discount of the whole group. A co-ride whose rentals were all ended by
+        aborts is ended without locking anything.
+        Args:
+            leader_id (int): The ID of the user leading the group.
+        Returns:
+            tuple:
+                * [0]: (bool) True if every scooter was locked and its rental completed, False otherwise.
+                * [1]: (str) A message indicating the result of the operation.
+                * [2]: (dict) The session ID, price per ride, completed rentals and the IDs
+                  of the scooters still active, or None if no rental was completed.
+        """
+        leader_id = int(leader_id)
+        coride = await self._async_db.get_active_coride(leader_id)
+        if coride is None:
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="database",
+                user_id=leader_id,
+                message="rental error: user leads no active co-ride",
+                function=f"get_active_coride({leader_id})"
+            )
+            return False, "database: rental not found", None
+
+        session, _rentals, size = coride
+        if not _rentals:
+            # Every rental of the group was ended by an abort, so only the session is left
+            await self._async_db.coride_ended(session[0])
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"rental error: co-ride {session[0]} has no active rentals, ending it",
+                function=f"get_active_coride({leader_id})"
+            )
+            return False, "database: rental not found", None
+
+        rentals = [self._rides._parse_rental(rental) for rental in _rentals]
+        _scooters = [self._scooters.get(rental["scooter_id"]) for rental in rentals]
+
+        missing = [rental["scooter_id"] for rental, scooter in zip(rentals, _scooters) if scooter is None]
+        if missing:
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"scooter error: scooters not found: {missing}",
+                function=f"scooter_state.get({missing})"
+            )
+            return False, "database: scooter not found", None
+
+        scooters = [self._rides._parse_scooter(scooter) for scooter in _scooters]
+        _users = await asyncio.gather(*(self._async_db.get_user(user_id) for user_id in {rental["user_id"] for rental in rentals}))
+        users = {user[0]: self._rides._parse_user(user) for user in _users if user is not None}
+
+        # Priced before locking, so a failed transaction leaves no scooter locked with an active rental
+        time_start, time_end, time_diff = self._rides._parse_time(min(rental["start_time"] for rental in rentals))
+        riders = [users[rental["user_id"]] for rental in rentals if rental["user_id"] in users]
+        # The discount is for the whole group, also when locking again the scooters which failed to lock
+        price = transaction.pay_for_coride_ride(riders, time_diff, size - 1)
+        if not price[0]:
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="transactions",
+                user_id=leader_id,
+                message="transaction error: transaction failed",
+                function=f"pay_for_coride_ride({[user['id'] for user in riders]}, {time_diff}, {size - 1})",
+                time={"start": time_start, "end": time_end, "diff": time_diff},
+                resp=price[1]
+            )
+            return False, price[1], None
+
+        if DISABLE_MQTT:
+            locks = [(True, "mqtt disabled", 0)] * len(scooters)
+        else:
+            locks = await self._mqtt.scooter_lock_multi_async(scooters)
+
+        failed = [(scooter, lock) for scooter, lock in zip(scooters, locks) if not lock[0]]
+        if failed:
+            scooter, lock = failed[0]
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="mqtt",
+                user_id=leader_id,
+                scooter_id=scooter["uuid"],
+                message=f"mqtt error: {len(failed)} of {len(scooters)} scooters failed to lock",
+                function=f"scooter_lock_multi_async({[s['uuid'] for s in scooters]})",
+                resp=lock[1]
+            )
+            if len(failed) == len(scooters):
+                return False, lock[1], None
+
+        # Ends the rentals of the locked scooters and charges their riders atomically, at most once per rental
+        locked = [(rental, scooter, lock) for rental, scooter, lock in zip(rentals, scooters, locks) if lock[0]]
+        rentals_ended = await self._ledger.complete_group_async([
+            (rental["rental_id"], rental["user_id"], price[2], scooter["latitude"], scooter["longtitude"], lock[2])
+            for rental, scooter, lock in locked
+        ])
+        completed = [rental for (rental, _, _), ended in zip(locked, rentals_ended) if ended]
+        if len(completed) < len(locked):
+            self._rides._warn_logger(
+                title="multi scooter lock failed",
+                culprit="database",
+                user_id=leader_id,
+                message=f"rental error: {len(locked) - len(completed)} of {len(locked)} rentals not completed and charged",
+                function=f"complete_group_async({[rental['rental_id'] for rental, _, _ in locked]})",
+            )
+            if not completed:
+                return False, "database error: rental not completed", None
+
+        for rental in completed:
+            self._events.publish(rental["rental_id"], True, "completed", final=True)
+        result = {
+            "session_id": session[0],
+            "price": price[2],
+            "rentals": completed,
+            "active": [rental["scooter_id"] for rental in rentals if rental not in completed],
+        }
+        if len(completed) < len(rentals):
+            return False, f"{len(completed)} of {len(rentals)} scooters locked", result
+
+        await self._async_db.coride_ended(session[0])
+        return True, locks[0][1], result
+
+
+
+    async def _release(self, scooters: list[dict]) -> None:
+        """
+        Internal function locking scooters again after a co-ride failed to start.
+        """
+        if not scooters or DISABLE_MQTT:
+            return
+        locks = await self._mqtt.scooter_lock_multi_async(scooters)
+        for scooter, lock in zip(scooters, locks):
+            if not lock[0]:
+                self._rides._warn_logger(
+                    title="multi scooter release failed",
+                    culprit="mqtt",
+                    scooter_id=scooter["uuid"],
+                    message="mqtt error: scooter left unlocked after failed co-ride",
+                    resp=lock[1]
+                )
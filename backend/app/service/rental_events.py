@@ -0,0 +1,134 @@
+import os
+import asyncio
+import logging
+from threading import Lock
+
+from tools.singleton import singleton
+
+
+RENTAL_STREAM_QUEUE = int(os.getenv("RENTAL_STREAM_QUEUE", "8"))
+
+
+
+@singleton
+class rental_events:
+    """
+    Publish/subscribe hub for rental status changes.
+    Clients streaming the status of a rental subscribe to its rental ID and receive
+    every change pushed by the services, i.e. when the scooter aborts the session or
+    the rental is locked, instead of polling the database for it.
+
+    publish() may be called from any thread (e.g. the MQTT workers handling aborts);
+    events are handed over to the event loop of each subscriber. With several worker
+    processes, a subscriber may be connected to another process than the one publishing,
+    so every event is also handed to the registered forwarders (see add_forwarder).
+
+    #### Example:
+    ```python
+    events = rental_events()
+    queue = events.subscribe(rental_id)
+    try:
+        ok, status, final = await queue.get()
+    finally:
+        events.unsubscribe(rental_id, queue)
+
+    events.publish(rental_id, False, "battery low", final=True)
+    ```
+    """
+
+    def __init__(self) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._subscribers = {}
+        self._forwarders = []
+        self._lock = Lock()
+
+
+
+    def add_forwarder(self, callback) -> None:
+        """
+        Register a callback receiving every event published in this process, called as
+        callback(rental_id, ok, status, final), e.g. to relay it to the other workers.
+        """
+        self._forwarders.append(callback)
+
+
+
+    def subscribe(self, rental_id: int) -> asyncio.Queue:
+        """
+        Subscribe to the status changes of a rental. Must be called from within the event loop.
+        Args:
+            rental_id (int): The ID of the rental.
+        Returns:
+            asyncio.Queue: Queue receiving (ok, status, final) tuples.
+        """
+        queue = asyncio.Queue(maxsize=max(1, RENTAL_STREAM_QUEUE))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(str(rental_id), {})[queue] = loop
+        return queue
+
+
+
+    def unsubscribe(self, rental_id: int, queue: asyncio.Queue) -> None:
+        """
+        Remove a subscription made with subscribe().
+        """
+        with self._lock:
+            queues = self._subscribers.get(str(rental_id))
+            if queues is None:
+                return
+            queues.pop(queue, None)
+            if not queues:
+                del self._subscribers[str(rental_id)]
+
+
+
+    def publish(self, rental_id: int, ok: bool, status: str, final: bool=False, forward: bool=True) -> None:
+        """
+        Push a status change to every subscriber of a rental.
+        Args:
+            rental_id (int): The ID of the rental.
+            ok (bool): Whether the rental is still OK, as returned by check_rental_status().
+            status (str): The status of the rental, e.g. "ok" or the cause of an abort.
+            final (bool): Whether the rental has ended and no further events will follow.
+            forward (bool): Whether to hand the event to the forwarders. False for events
+                relayed from another worker.
+        """
+        if forward:
+            for callback in self._forwarders:
+                try:
+                    callback(rental_id, ok, status, final)
+                except Exception as e:
+                    self._logger.error(f"Error forwarding event of rental {rental_id}: {e}")
+
+        with self._lock:
+            queues = list(self._subscribers.get(str(rental_id), {}).items())
+
+        self._logger.debug(f"Rental {rental_id}: publishing {status} to {len(queues)} subscriber(s)")
+        for queue, loop in queues:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, (ok, status, final))
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(rental_id, queue)
+
+
+
+    def subscribers(self, rental_id: int) -> int:
+        """
+        Get the number of subscribers of a rental.
+        """
+        with self._lock:
+            return len(self._subscribers.get(str(rental_id), {}))
+
+
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: tuple) -> None:
+        """
+        Enqueue an event, dropping the oldest one if a slow subscriber's queue is full.
+        Only the latest status matters to a subscriber, so nothing of value is lost.
+        """
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
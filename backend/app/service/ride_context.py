@@ -0,0 +1,30 @@
+class ride_context:
+    """
+    Request-scoped state of a single unlock or lock request.
+    The ride services are process-wide singletons shared by every concurrent request,
+    so the scooter, user and rental a request operates on must never be stored on the
+    service itself. Instead, unlock_scooter and lock_scooter each create a ride_context
+    as a local variable and keep the request's state on it until they return, which
+    makes it safe to run any number of unlocks and locks concurrently, be it as
+    coroutines or in a thread pool.
+
+    #### Example:
+    ```python
+    ctx = ride_context(scooter_id=1, user_id=2)
+    ctx.scooter = self._parse_scooter(_scooter)
+    ctx.user    = self._parse_user(_user)
+    ```
+    """
+
+    __slots__ = ("scooter_id", "user_id", "scooter", "user", "rental")
+
+    def __init__(self, scooter_id: int, user_id: int) -> None:
+        self.scooter_id = scooter_id
+        self.user_id    = user_id
+        self.scooter    = None
+        self.user       = None
+        self.rental     = None
+
+
+    def __repr__(self) -> str:
+        return f"ride_context(scooter_id={self.scooter_id}, user_id={self.user_id})"
@@ -5,8 +5,12 @@ import logging
 from datetime import datetime
 
 from api import mqtt, database
+from api.ledger import ledger
+from api.scooter_state import scooter_state
 from tools.singleton import singleton
 from logic import weather, transaction
+from service.ride_context import ride_context
+from service.rental_events import rental_events
 
 
 
@@ -23,13 +27,20 @@ class single_ride_service:
     It checks if the user has sufficient funds, if the scooter is available, and if the
     weather is ok. It also performs the necessary database operations to start and end
     the rental as well as communicating with the MQTT broker to unlock and lock the scooter.
+
+    The service holds no per-request state: every unlock and lock works on its own
+    ride_context, so requests may safely run concurrently on the shared instance.
     """
 
 
     def __init__(self):
         self._logger = logging.getLogger(__name__)
         self._db = self.get_db_client()
+        self._async_db = database.async_db(self._db)
+        self._scooters = scooter_state(self._db)
+        self._ledger = ledger(self._db)
         self._mqtt = self.get_mqtt_client()
+        self._events = rental_events()
         with open(SCOOTER_STATUS_CODES_PATH, 'r') as f:
             self._status_codes = json.load(f)
         with open(STATUS_REDIRECT_PATH, 'r') as f:
@@ -176,7 +187,7 @@ class single_ride_service:
             return False, "scooter-inoperable"
         
         rental = self._parse_rental(_rental)
-        _scooter = self._db.get_scooter(rental['scooter_id'])
+        _scooter = self._scooters.get(rental['scooter_id'])
 
         if _scooter is None:
             self._warn_logger(
@@ -301,9 +312,7 @@ class single_ride_service:
             }
         ```
         """
-        self._db.ensure_connection()
-
-        _scooter = self._db.get_scooter(scooter_id)
+        _scooter = self._scooters.get(scooter_id)
 
         if _scooter is None:
             self._warn_logger(
@@ -319,13 +328,46 @@ class single_ride_service:
 
 
 
-    def unlock_scooter(self, scooter_id: int, user_id: int) -> tuple[bool, str, str]:
+    def get_scooters_nearby(self, lat: float, lon: float, radius: float, limit: int, status: int=None) -> list[dict]:
+        """
+        Get the scooters nearest to a location, served from the in-memory spatial index.
+        
+        Args:
+            lat (float): Latitude of the location.
+            lon (float): Longitude of the location.
+            radius (float): Maximum distance from the location in meters.
+            limit (int): Maximum number of scooters to return.
+            status (int): Only return scooters with this status code, or any status if None.
+        
+        Returns:
+            list: The scooters, nearest first, each with its distance in meters.
+
+        Example:
+        ```python
+            scooters = self.get_scooters_nearby(63.4195, 10.4017, 500, 5, status=0)
+            print(scooters) -> [{
+                "uuid": 1, 
+                "latitude": 63.41947, 
+                "longtitude": 10.40174, 
+                "status": 0,
+                "distance": 3.9
+            }]
+        ```
+        """
+        nearby = self._scooters.nearest(lat, lon, k=limit, radius=radius, status=status)
+        return [{**self._parse_scooter(_scooter), "distance": round(distance, 1)} for distance, _scooter in nearby]
+
+
+
+    async def unlock_scooter(self, scooter_id: int, user_id: int) -> tuple[bool, str, str]:
         """
         Unlock a scooter for a user. This function checks if the user has sufficient funds,
         if the scooter is available, and if the weather is ok. It will also perform the
         necessary database operations to start the rental as well as communicating with
         the MQTT broker to unlock the scooter. If all checks pass, the scooter
         is unlocked and the rental is started.
+        This is a coroutine: database queries, the weather lookup and the wait for the
+        scooter's response are awaited, so the event loop keeps serving other requests.
         Args:
             scooter_id (int): The ID of the scooter to unlock.
             user_id (int): The ID of the user unlocking the scooter.
@@ -334,10 +376,11 @@ class single_ride_service:
                 * [0]: (bool) True if the unlock was successful, False otherwise.
                 * [1]: (str) A message indicating the result of the operation.
         """
-        self._db.ensure_connection()
-
-        _scooter = self._db.get_scooter(scooter_id)
-        _user = self._db.get_user(user_id)
+        ctx = ride_context(scooter_id, user_id)
+        _scooter, _user, _rental, sctr_has_active_rental = await self._async_db.rental_precheck(scooter_id, user_id)
+        if _scooter is not None:
+            # Reported scooter state reaches the database in batches, so memory may be newer
+            _scooter = self._scooters.get(scooter_id, row=_scooter)
 
         if _scooter is None:
             self._warn_logger(
@@ -345,7 +388,7 @@ class single_ride_service:
                 culprit="database",
                 scooter_id=scooter_id,
                 message="scooter error: scooter not found",
-                function=f"get_scooter({scooter_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )   
             return False, "database: scooter not found", "scooter-not-found"
         if _user is None:
@@ -354,21 +397,18 @@ class single_ride_service:
                 culprit="database",
                 user_id=user_id,
                 message="user error: user not found",
-                function=f"get_user({user_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )
             return False, "database: user not found", "user-not-found"
 
-        user_has_active_rental = self._db.user_has_active_rental(user_id)
-        sctr_has_active_rental = self._db.scooter_has_active_rental(scooter_id)
-
-        if user_has_active_rental:
+        if _rental is not None:
             self._warn_logger(
                 title="single scooter unlock failed",
                 culprit="database",
                 user_id=user_id,
                 scooter_id=scooter_id,
                 message="rental error: user has active rental",
-                function=f"user_has_active_rental({user_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )
             return False, "user has active rental", "user-occupied"
         
@@ -379,42 +419,42 @@ class single_ride_service:
                 user_id=user_id,
                 scooter_id=scooter_id,
                 message="rental error: scooter has active rental",
-                function=f"scooter_has_active_rental({scooter_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )
             return False, "scooter is already rented", "scooter-occupied"
         
 
-        self.scooter = self._parse_scooter(_scooter)
-        self.user    = self._parse_user(_user)
+        ctx.scooter = self._parse_scooter(_scooter)
+        ctx.user    = self._parse_user(_user)
 
-        if self.scooter["status"] != 0:
-            parse_code = self.parse_status(self.scooter["status"])
+        if ctx.scooter["status"] != 0:
+            parse_code = self.parse_status(ctx.scooter["status"])
             self._warn_logger(
                 title="single scooter unlock failed",
                 culprit="scooter",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message=f"scooter error: {parse_code[0]}",
                 function=f"self._db.get_scooter({scooter_id})",
-                resp=f"status code: {self.scooter['status']}",
+                resp=f"status code: {ctx.scooter['status']}",
             )
             return False, parse_code[0], parse_code[1]
 
 
-        weather_req = weather.is_weather_ok(self.scooter["latitude"], self.scooter["longtitude"])
-        balance_req = transaction.validate_funds(self.user, 100.0)
+        balance_req = transaction.validate_funds(ctx.user, 100.0)
+        weather_req = await weather.is_weather_ok_async(ctx.scooter["latitude"], ctx.scooter["longtitude"])
 
 
         if not weather_req[0]:
             self._warn_logger(
                 title="single scooter unlock failed",
                 culprit="weather",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message="weather error: weather is not ok",
-                function=f"is_weather_ok({self.scooter['latitude']}, {self.scooter['longtitude']})",
+                function=f"is_weather_ok({ctx.scooter['latitude']}, {ctx.scooter['longtitude']})",
                 resp=weather_req[1],
-                location={"lat": self.scooter["latitude"], "lon": self.scooter["longtitude"]}
+                location={"lat": ctx.scooter["latitude"], "lon": ctx.scooter["longtitude"]}
             )
             return False, weather_req[1], weather_req[2]
         
@@ -422,19 +462,19 @@ class single_ride_service:
             self._warn_logger(
                 title="single scooter unlock failed",
                 culprit="transactions",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message="transaction error: insufficient funds",
-                function=f"validate_funds({self.user['id']}, 100.0)",
+                function=f"validate_funds({ctx.user['id']}, 100.0)",
                 resp=balance_req[1],
-                transaction={"price": 100.0, "funds": self.user["funds"]}
+                transaction={"price": 100.0, "funds": ctx.user["funds"]}
             )
             return False, balance_req[1], balance_req[2]
 
 
-        mqtt_unlock = (True, "mqtt disabled", None) if DISABLE_MQTT else self._mqtt.scooter_unlock_single(self.scooter)
+        mqtt_unlock = (True, "mqtt disabled", None) if DISABLE_MQTT else await self._mqtt.scooter_unlock_single_async(ctx.scooter)
         if (mqtt_unlock[0]):
-            rental_started = self._db.rental_started(self.user["id"], self.scooter["uuid"])
+            rental_started = await self._async_db.rental_started(ctx.user["id"], ctx.scooter["uuid"])
         else:
             rental_started = False
 
@@ -445,34 +485,36 @@ class single_ride_service:
             self._warn_logger(
                 title="single scooter unlock failed",
                 culprit="mqtt",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message="mqtt error: scooter unlock failed",
-                function=f"scooter_unlock_single({self.scooter['uuid']})",
+                function=f"scooter_unlock_single({ctx.scooter['uuid']})",
                 resp=f"satus code: {mqtt_unlock[1]} - {parsed_status[0]}"
             )
             return False, parsed_status[0], parsed_status[1]
         else:
             self._warn_logger(
                 title="single scooter unlock failed",
-                cuplrit="database",
-                scooter_id=self.scooter["uuid"],
-                user_id=self.user["id"],
+                culprit="database",
+                scooter_id=ctx.scooter["uuid"],
+                user_id=ctx.user["id"],
                 message="rental error: rental not started",
-                function=f"rental_started({self.user['id']}, {self.scooter['uuid']})",
+                function=f"rental_started({ctx.user['id']}, {ctx.scooter['uuid']})",
             )
             return False, "database error: rental not started", "rental-error"
         
 
 
 
-    def lock_scooter(self, scooter_id: int, user_id: int) -> tuple[bool, str, dict]:
+    async def lock_scooter(self, scooter_id: int, user_id: int) -> tuple[bool, str, dict]:
         """
         Lock a scooter for a user. This function checks if the user has an active rental,
         of the given scooter. It will calculate the price of the rental. It will also perform 
         the necessary database operations to end the rental and charge user as well as 
         communicating with the MQTT broker to lock the scooter. If all checks pass, the scooter
         is locked and the rental is ended.
+        This is a coroutine: database queries and the wait for the scooter's response are
+        awaited, so the event loop keeps serving other requests.
         Args:
             scooter_id (int): The ID of the scooter to lock.
             user_id (int): The ID of the user locking the scooter.
@@ -481,11 +523,11 @@ class single_ride_service:
                 * [0]: (bool) True if the lock was successful, False otherwise.
                 * [1]: (str) A message indicating the result of the operation.
         """
-        self._db.ensure_connection()
-
-        _scooter = self._db.get_scooter(scooter_id)
-        _user    = self._db.get_user(user_id)
-        _rental  = self._db.get_active_rental_by_user(user_id)
+        ctx = ride_context(scooter_id, user_id)
+        _scooter, _user, _rental, _ = await self._async_db.rental_precheck(scooter_id, user_id)
+        if _scooter is not None:
+            # Reported scooter state reaches the database in batches, so memory may be newer
+            _scooter = self._scooters.get(scooter_id, row=_scooter)
 
         if _scooter is None:
             self._warn_logger(
@@ -493,7 +535,7 @@ class single_ride_service:
                 culprit="database",
                 scooter_id=scooter_id,
                 message="scooter error: scooter not found",
-                function=f"get_scooter({scooter_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )   
             return False, "database: scooter not found", None
         if _user is None:
@@ -502,7 +544,7 @@ class single_ride_service:
                 culprit="database",
                 user_id=user_id,
                 message="user error: user not found",
-                function=f"get_user({user_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )
             return False, "database: user not found", None
         if _rental is None:
@@ -511,31 +553,30 @@ class single_ride_service:
                 culprit="database",
                 user_id=user_id,
                 message="rental error: user has no active rental",
-                function=f"get_active_rental_by_user({user_id})"
+                function=f"rental_precheck({scooter_id}, {user_id})"
             )
             return False, "database: rental not found", None
         
-        self.scooter = self._parse_scooter(_scooter)
-        self.user    = self._parse_user(_user)
-        self.rental  = self._parse_rental(_rental)
-        time_start = self.rental["start_time"].timestamp()
+        ctx.scooter = self._parse_scooter(_scooter)
+        ctx.user    = self._parse_user(_user)
+        ctx.rental  = self._parse_rental(_rental)
+        time_start = ctx.rental["start_time"].timestamp()
         time_end   = datetime.fromtimestamp(time.time()).timestamp()
         time_diff  = abs((time_end - time_start) / 60.0)
-        mqtt_lock = (True, "mqtt disabled", 0) if DISABLE_MQTT else self._mqtt.scooter_lock_single(self.scooter)
-        price = transaction.pay_for_single_ride(self.user, time_diff)
-        db_req_payment = self._db.charge_user(self.user["id"], price[2])
+        mqtt_lock = (True, "mqtt disabled", 0) if DISABLE_MQTT else await self._mqtt.scooter_lock_single_async(ctx.scooter)
+        price = transaction.pay_for_single_ride(ctx.user, time_diff)
 
 
         if not price[0]:
             self._warn_logger(
                 title="single scooter lock failed",
                 culprit="transactions",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message="transaction error: transaction failed",
-                function=f"pay_for_single_ride({self.user['id']}, {time_diff})",
+                function=f"pay_for_single_ride({ctx.user['id']}, {time_diff})",
                 time={"start": time_start, "end": time_end, "diff": time_diff},
-                transaction={"price": price[2], "funds": self.user["funds"]},
+                transaction={"price": price[2], "funds": ctx.user["funds"]},
                 resp=mqtt_lock[1]
             )
             return False, price[1], None
@@ -544,40 +585,35 @@ class single_ride_service:
             self._warn_logger(
                 title="single scooter lock failed",
                 culprit="mqtt",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
                 message="mqtt error: scooter lock failed",
-                function=f"scooter_lock_single({self.scooter['uuid']})",
+                function=f"scooter_lock_single({ctx.scooter['uuid']})",
                 resp=mqtt_lock[1]
             )
             return False, mqtt_lock[1], None
 
 
-        rental_ended = self._db.rental_completed(self.user["id"], price[2], self.scooter["latitude"], self.scooter["longtitude"], mqtt_lock[2])
+        # Ends the rental and charges the user atomically, at most once per rental
+        rental_ended = await self._ledger.complete_rental_async(
+            ctx.rental["rental_id"], ctx.user["id"], price[2],
+            ctx.scooter["latitude"], ctx.scooter["longtitude"], mqtt_lock[2]
+        )
 
 
-        if rental_ended and db_req_payment:
-            return True, mqtt_lock[1], self.rental
-        elif not rental_ended:
-            self._warn_logger(
-                title="single scooter lock failed",
-                culprit="database",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
-                message="rental error: rental not completed",
-                function=f"rental_completed({self.user['id']}, {price[2]}, {self.scooter['latitude']}, {self.scooter['longtitude']}, {mqtt_lock[2]})",
-            )
-            return False, "database error: rental not completed", None
+        if rental_ended:
+            self._events.publish(ctx.rental["rental_id"], True, "completed", final=True)
+            return True, mqtt_lock[1], ctx.rental
         else:
             self._warn_logger(
                 title="single scooter lock failed",
                 culprit="database",
-                user_id=self.user["id"],
-                scooter_id=self.scooter["uuid"],
-                message="transaction error: transaction failed",
-                function=f"charge_user({self.user['id']}, {price[2]})"
+                user_id=ctx.user["id"],
+                scooter_id=ctx.scooter["uuid"],
+                message="rental error: rental not completed and charged",
+                function=f"complete_rental({ctx.rental['rental_id']}, {ctx.user['id']}, {price[2]}, {ctx.scooter['latitude']}, {ctx.scooter['longtitude']}, {mqtt_lock[2]})",
             )
-            return False, "database error: transaction failed", None
+            return False, "database error: rental not completed", None
 
 
 
@@ -597,6 +633,7 @@ class single_ride_service:
         """
         Log a custom warning message of an incident. Just insert the parameters you want
         to include in the log, and this function will take care of the rest.
+        The incident is logged as a single record, with the parameters as its fields.
         
         Args:
             title (str): The title of the incident.
@@ -615,8 +652,8 @@ class single_ride_service:
             user_id = 1
             scooter_id = 1
 
-            time_start, time_end, time_diff = self._parse_time(self.rental["start_time"])
-            transaction_resp = transaction.pay_for_single_ride(self.user, time_diff)
+            time_start, time_end, time_diff = self._parse_time(ctx.rental["start_time"])
+            transaction_resp = transaction.pay_for_single_ride(ctx.user, time_diff)
 
             price = transaction_resp[2]
 
@@ -628,44 +665,30 @@ class single_ride_service:
                 message="transaction error: transaction failed",
                 resp=transaction_resp[1],
                 time={"start": time_start, "end": time_end, "diff": time_diff},
-                transaction={"price": price, "funds": self.user["funds"]},
-                function=f"pay_for_single_ride({self.user}, {time_diff})",
-                location={"lat": self.scooter["latitude"], "lon": self.scooter["longtitude"]}
+                transaction={"price": price, "funds": ctx.user["funds"]},
+                function=f"pay_for_single_ride({ctx.user}, {time_diff})",
+                location={"lat": ctx.scooter["latitude"], "lon": ctx.scooter["longtitude"]}
             )
         ```
         """
         if culprit is not None:
-            self._logger.warning(f"{title} - {culprit}")
-        elif title is not None:
-            self._logger.warning(title)
-        else:
-            self._logger.warning("unknown error")
-
-
-        if user_id is not None:
-            self._logger.warning(f"\tuser-id: \t{user_id}")
-        if scooter_id is not None:
-            self._logger.warning(f"\tscooter-id: \t{scooter_id}")
-        if resp is not None:
-            self._logger.warning(f"\tresponse: \t{resp}")
-        if time is not None:
-            start_time_tmp = datetime.fromtimestamp(time["start"])
-            end_time_tmp   = datetime.fromtimestamp(time["end"])
-            self._logger.warning(f"\ttime:")
-            self._logger.warning(f"\t\tstart: {time['start']} \t {start_time_tmp}")
-            self._logger.warning(f"\t\tend: {time['end']} \t {end_time_tmp}")
-            self._logger.warning(f"\t\tdiff: {time['diff']}")
-        if transaction is not None:
-            self._logger.warning(f"\tprice: \t{transaction['price']}")
-            self._logger.warning(f"\tuser-funds: \t{transaction['funds']}")
-        if message is not None:
-            self._logger.warning(f"\tmessage: \t{message}")
-        if function is not None:
-            self._logger.warning(f"\tfunction: \t{function}")
-        if location is not None:
-            self._logger.warning(f"\tlocation:")
-            self._logger.warning(f"\t\tlatitude: {location['lat']}")
-            self._logger.warning(f"\t\tlongtitude: {location['lon']}")
+            title = f"{title} - {culprit}"
+        elif title is None:
+            title = "unknown error"
+
+        # One record per incident, its fields rendered by the log formatter
+        incident = {
+            "user-id":    user_id,
+            "scooter-id": scooter_id,
+            "response":   resp,
+            "time":       time,
+            "price":      transaction["price"] if transaction is not None else None,
+            "user-funds": transaction["funds"] if transaction is not None else None,
+            "message":    message,
+            "function":   function,
+            "location":   {"latitude": location["lat"], "longtitude": location["lon"]} if location is not None else None,
+        }
+        self._logger.warning(title, extra={"incident": {key: value for key, value in incident.items() if value is not None}})
 
     
 
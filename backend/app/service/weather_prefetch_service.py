@@ -0,0 +1,105 @@
+import os
+import logging
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+
+from logic import weather
+from api.scooter_state import scooter_state
+from tools.singleton import singleton
+
+
+WEATHER_PREFETCH_INTERVAL    = float(os.getenv("WEATHER_PREFETCH_INTERVAL", 60))
+WEATHER_PREFETCH_AHEAD       = float(os.getenv("WEATHER_PREFETCH_AHEAD", 300))
+WEATHER_PREFETCH_CONCURRENCY = int(os.getenv("WEATHER_PREFETCH_CONCURRENCY", 4))
+WEATHER_CACHE_SIZE           = int(os.getenv("WEATHER_CACHE_SIZE", 1024))
+
+
+
+@singleton
+class weather_prefetch_service:
+    """
+    Background service keeping the forecasts of the fleet's geo-cells fresh.
+    Every WEATHER_PREFETCH_INTERVAL seconds, it collects the geo-cells currently
+    holding scooters from the in-memory scooter state, and refreshes those whose
+    forecast is missing or expires within WEATHER_PREFETCH_AHEAD seconds, with at most
+    WEATHER_PREFETCH_CONCURRENCY requests to the weather API at once. The verdict of
+    each forecast is computed as it is stored, so the first unlock in a cell after
+    expiry does not wait for the API. With several worker processes, it runs in the
+    primary worker only, and the verdicts are relayed to the others over MQTT.
+
+    #### Example:
+    ```python
+    prefetcher = weather_prefetch_service()
+    prefetcher.start()
+    ...
+    prefetcher.stop()
+    ```
+    """
+
+    def __init__(self, scooters: scooter_state=None) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._scooters = scooters if scooters is not None else scooter_state()
+        self._stopped = Event()
+        self._thread = None
+        self._executor = None
+
+
+
+    def start(self) -> None:
+        """
+        Start prefetching in a background thread.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, WEATHER_PREFETCH_CONCURRENCY), thread_name_prefix="weather-prefetch")
+        self._thread = Thread(target=self._run, name="weather-prefetch", daemon=True)
+        self._thread.start()
+
+
+
+    def stop(self) -> None:
+        """
+        Stop prefetching, letting the requests in flight finish.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+
+    def prefetch(self) -> int:
+        """
+        Run one prefetch pass.
+        Returns:
+            int: The number of forecasts fetched or revalidated.
+        """
+        locations = [(lat, lon) for _, lat, lon, _ in self._scooters.get_all() if lat is not None and lon is not None]
+        cells = weather.cells_to_refresh(locations, WEATHER_PREFETCH_AHEAD)
+        if len(cells) > WEATHER_CACHE_SIZE:
+            # More cells than the cache holds would evict each other before being used
+            self._logger.warning(f"Scooters span {len(cells)} weather cells, prefetching the first {WEATHER_CACHE_SIZE}")
+            cells = cells[:WEATHER_CACHE_SIZE]
+        if not cells:
+            return 0
+
+        refreshed = sum(self._executor.map(weather.refresh, cells))
+        self._logger.debug(f"Prefetched {refreshed}/{len(cells)} weather forecasts")
+        return refreshed
+
+
+
+    def _run(self) -> None:
+        """
+        Internal loop of the prefetching thread.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.prefetch()
+            except Exception as e:
+                self._logger.error(f"Error prefetching weather forecasts: {e}")
+            self._stopped.wait(WEATHER_PREFETCH_INTERVAL)
@@ -0,0 +1,103 @@
+import time
+import logging
+from threading import Lock
+
+
+CLOSED    = "closed"
+OPEN      = "open"
+HALF_OPEN = "half-open"
+
+
+
+class circuit_breaker:
+    """
+    Stops calling an upstream service which keeps failing or answering slowly.
+    After `failures` failed or slow calls in a row, the breaker opens and allow()
+    returns False for `reset_after` seconds, so callers fall back at once instead of
+    waiting for timeouts. Then it lets one trial call through (half-open): if that
+    call succeeds the breaker closes, otherwise it opens again.
+
+    Args:
+        name (str): Name of the breaker, used in logs and metrics.
+        failures (int): Failed or slow calls in a row which open the breaker.
+        reset_after (float): Seconds the breaker stays open before a trial call.
+        slow_after (float): Seconds after which a successful call counts as failed.
+
+    #### Example:
+    ```python
+    from tools.circuit_breaker import circuit_breaker
+
+    breaker = circuit_breaker("weather", failures=5, reset_after=30, slow_after=2)
+
+    if breaker.allow():
+        started = time.monotonic()
+        try:
+            response = session.get(url, timeout=3)
+            breaker.record(time.monotonic() - started, ok=True)
+        except requests.RequestException:
+            breaker.record(time.monotonic() - started, ok=False)
+    ```
+    """
+
+    def __init__(self, name: str, failures: int, reset_after: float, slow_after: float=None) -> None:
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self.failures = max(1, failures)
+        self.reset_after = max(0.0, reset_after)
+        self.slow_after = slow_after
+        self.rejected = 0
+        self._state = CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = Lock()
+
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_after:
+                return HALF_OPEN
+            return self._state
+
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call may be made now. Counts the calls it rejects.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_after:
+                self._state = HALF_OPEN
+                self._trial = False
+            if self._state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+
+    def record(self, seconds: float, ok: bool) -> None:
+        """
+        Record the outcome of a call which allow() let through.
+        Args:
+            seconds (float): Duration of the call.
+            ok (bool): False if the call failed or timed out.
+        """
+        if ok and self.slow_after is not None and seconds > self.slow_after:
+            ok = False
+        with self._lock:
+            if ok:
+                if self._state != CLOSED:
+                    self._logger.info(f"{self.name}: upstream recovered, closing circuit")
+                self._state = CLOSED
+                self._failed = 0
+                return
+            self._failed += 1
+            if self._state == HALF_OPEN or self._failed >= self.failures:
+                if self._state != OPEN:
+                    self._logger.warning(f"{self.name}: {self._failed} failed or slow calls, opening circuit for {self.reset_after} seconds")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
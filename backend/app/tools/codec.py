@@ -0,0 +1,280 @@
+import json
+import struct
+
+
+# This module is shared by the back-end and the scooter software, and must be kept
+# identical in backend/app/tools/codec.py and e-scooter/tools/codec.py.
+
+CODEC_JSON   = 0
+CODEC_BINARY = 1
+
+CODECS = {"json": CODEC_JSON, "binary": CODEC_BINARY}
+
+# First byte of every binary payload. JSON payloads always start with "{".
+MAGIC = 0xB5
+VERSION = 1
+
+KIND_COMMAND  = 1
+KIND_RESPONSE = 2
+
+COMMANDS = ("unlock", "lock")
+
+FLAG_REQUEST_ID = 0x01
+FLAG_CORIDE     = 0x02
+FLAG_ABORT      = 0x04
+FLAG_LOCATION   = 0x08
+FLAG_REPLY_TO   = 0x10
+
+# magic, version, kind, flags
+HEADER   = struct.Struct("!BBBB")
+# server id, scooter id, timestamp (ms), command, number of coriders
+COMMAND  = struct.Struct("!IIQBB")
+# server id, scooter id, timestamp (ms), battery, status
+RESPONSE = struct.Struct("!IIQBB")
+# latitude and longitude in microdegrees
+LOCATION = struct.Struct("!ii")
+CORIDER  = struct.Struct("!I")
+# length of the reply topic, followed by the topic in UTF-8
+REPLY_TO = struct.Struct("!B")
+
+UINT32_MAX = 0xFFFFFFFF
+
+
+
+class codec_error(ValueError):
+    """
+    Raised when a payload cannot be decoded.
+    """
+
+
+
+def encode(message: dict, codec: int=CODEC_BINARY) -> bytes:
+    """
+    Encode an MQTT message between the back-end and a scooter.
+
+    The binary codec packs the fields of commands and responses into a fixed layout
+    of a few dozen bytes: IDs as 32-bit integers, the request ID as 16 raw bytes, the
+    timestamp in milliseconds and the location in microdegrees (about 0.1 m). A message
+    it cannot represent (e.g. extra fields or a non-numeric ID) is sent as JSON instead,
+    which every receiver decodes as well.
+
+    Args:
+        message (dict): The message, as built by the back-end or the scooter.
+        codec (int): CODEC_BINARY, or CODEC_JSON for human-readable payloads.
+    Returns:
+        bytes: The encoded payload.
+
+    #### Example:
+    ```python
+    payload = encode({"id": 1000, "request_id": "9f1c...", "uuid": 7, "command": "unlock",
+                      "coride": False, "num_coriders": 0, "coriders": [], "timestamp": 1743420329.5})
+    len(payload) -> 38
+    decode(payload) -> ({"id": 1000, ..., "command": "unlock", ...}, CODEC_BINARY)
+    ```
+    """
+    if codec == CODEC_BINARY:
+        try:
+            if "command" in message:
+                return _encode_command(message)
+            return _encode_response(message)
+        except (KeyError, TypeError, ValueError, OverflowError, struct.error):
+            pass
+    return json.dumps(message).encode()
+
+
+
+def decode(payload: bytes) -> tuple[dict, int]:
+    """
+    Decode a payload in either codec.
+    Args:
+        payload (bytes): The payload as received from the broker.
+    Returns:
+        tuple: (message, codec) where codec is the codec the payload was encoded with.
+    Raises:
+        codec_error: If the payload is neither valid JSON nor a known binary message.
+    """
+    if payload[:1] != bytes([MAGIC]):
+        try:
+            return json.loads(payload.decode()), CODEC_JSON
+        except ValueError as e:
+            raise codec_error(f"invalid JSON payload: {e}") from e
+
+    try:
+        _, version, kind, flags = HEADER.unpack_from(payload, 0)
+        if version != VERSION:
+            raise codec_error(f"unsupported binary version {version}")
+        if kind == KIND_COMMAND:
+            return _decode_command(payload, flags), CODEC_BINARY
+        if kind == KIND_RESPONSE:
+            return _decode_response(payload, flags), CODEC_BINARY
+    except (struct.error, IndexError) as e:
+        raise codec_error(f"truncated binary payload: {e}") from e
+    raise codec_error(f"unknown binary message kind {kind}")
+
+
+
+def negotiate(preferred: int, message: dict, received: int) -> int:
+    """
+    The codec a scooter answers with, negotiated per scooter: the back-end sends JSON
+    commands with a "codec" field naming the binary version it decodes, until it has
+    received a binary message from the scooter, after which it sends binary commands.
+    The scooter answers in binary only if it prefers binary and the back-end has
+    shown that it understands it.
+    Args:
+        preferred (int): The codec the scooter is configured to prefer.
+        message (dict): The decoded command.
+        received (int): The codec the command was received in.
+    Returns:
+        int: The codec to publish the answer and later messages with.
+    """
+    if preferred == CODEC_BINARY and (received == CODEC_BINARY or message.get("codec", 0) >= VERSION):
+        return CODEC_BINARY
+    return CODEC_JSON
+
+
+
+def _encode_command(message: dict) -> bytes:
+    if set(message) - {"id", "request_id", "uuid", "command", "coride", "num_coriders", "coriders", "timestamp", "reply_to"}:
+        raise ValueError("command has fields without a binary encoding")
+    coriders = [_uint32(corider) for corider in message.get("coriders") or []]
+    flags = FLAG_CORIDE if message.get("coride") else 0
+    request_id = _pack_request_id(message.get("request_id"))
+    if request_id:
+        flags |= FLAG_REQUEST_ID
+    reply_to = b""
+    if message.get("reply_to") is not None:
+        flags |= FLAG_REPLY_TO
+        topic = message["reply_to"].encode()
+        reply_to = REPLY_TO.pack(len(topic)) + topic
+
+    return b"".join((
+        HEADER.pack(MAGIC, VERSION, KIND_COMMAND, flags),
+        COMMAND.pack(
+            _uint32(message["id"]), _uint32(message["uuid"]), _millis(message.get("timestamp")),
+            COMMANDS.index(message["command"]), len(coriders)
+        ),
+        request_id,
+        *(CORIDER.pack(corider) for corider in coriders),
+        # Optional fields go last, so that decoders not knowing them can ignore them
+        reply_to,
+    ))
+
+
+
+def _decode_command(payload: bytes, flags: int) -> dict:
+    offset = HEADER.size
+    server_id, uuid, millis, command, num_coriders = COMMAND.unpack_from(payload, offset)
+    offset += COMMAND.size
+    request_id, offset = _unpack_request_id(payload, offset, flags)
+    coriders = [CORIDER.unpack_from(payload, offset + i * CORIDER.size)[0] for i in range(num_coriders)]
+    offset += num_coriders * CORIDER.size
+    message = {
+        "id": server_id,
+        "request_id": request_id,
+        "uuid": uuid,
+        "command": COMMANDS[command],
+        "coride": bool(flags & FLAG_CORIDE),
+        "num_coriders": num_coriders,
+        "coriders": coriders,
+        "timestamp": millis / 1000.0,
+    }
+    if flags & FLAG_REPLY_TO:
+        length, = REPLY_TO.unpack_from(payload, offset)
+        topic = payload[offset + REPLY_TO.size:offset + REPLY_TO.size + length]
+        if len(topic) != length:
+            raise IndexError("reply topic")
+        message["reply_to"] = topic.decode()
+    return message
+
+
+
+def _encode_response(message: dict) -> bytes:
+    if set(message) - {"id", "request_id", "uuid", "battery", "status", "abort", "timestamp", "location"}:
+        raise ValueError("response has fields without a binary encoding")
+    flags = FLAG_ABORT if message.get("abort") else 0
+    request_id = _pack_request_id(message.get("request_id"))
+    if request_id:
+        flags |= FLAG_REQUEST_ID
+    location = message.get("location")
+    if location is not None:
+        flags |= FLAG_LOCATION
+        location = LOCATION.pack(_micro(location["latitude"]), _micro(location["longitude"]))
+
+    return b"".join((
+        HEADER.pack(MAGIC, VERSION, KIND_RESPONSE, flags),
+        RESPONSE.pack(
+            _uint32(message["id"]), _uint32(message["uuid"]), _millis(message.get("timestamp")),
+            min(max(int(round(message["battery"])), 0), 255), int(message["status"])
+        ),
+        request_id,
+        location or b"",
+    ))
+
+
+
+def _decode_response(payload: bytes, flags: int) -> dict:
+    offset = HEADER.size
+    server_id, uuid, millis, battery, status = RESPONSE.unpack_from(payload, offset)
+    offset += RESPONSE.size
+    request_id, offset = _unpack_request_id(payload, offset, flags)
+    message = {
+        "id": server_id,
+        "request_id": request_id,
+        "uuid": uuid,
+        "battery": battery,
+        "status": status,
+        "abort": bool(flags & FLAG_ABORT),
+        "timestamp": millis / 1000.0,
+    }
+    if flags & FLAG_LOCATION:
+        lat, lon = LOCATION.unpack_from(payload, offset)
+        message["location"] = {"latitude": lat / 1e6, "longitude": lon / 1e6}
+    return message
+
+
+
+def _pack_request_id(request_id: str) -> bytes:
+    """
+    Request IDs are 32 hexadecimal digits (uuid4().hex), sent as 16 raw bytes.
+    """
+    if request_id is None:
+        return b""
+    raw = bytes.fromhex(request_id)
+    if len(raw) != 16 or raw.hex() != request_id:
+        raise ValueError("request ID is not 16 bytes")
+    return raw
+
+
+
+def _unpack_request_id(payload: bytes, offset: int, flags: int) -> tuple[str, int]:
+    if not flags & FLAG_REQUEST_ID:
+        return None, offset
+    raw = payload[offset:offset + 16]
+    if len(raw) != 16:
+        raise IndexError("request ID")
+    return raw.hex(), offset + 16
+
+
+
+def _uint32(value) -> int:
+    """
+    IDs are sent as unsigned 32-bit integers. String IDs are only accepted in their
+    canonical form, as they are decoded as integers.
+    """
+    if isinstance(value, str) and value.isdigit() and str(int(value)) == value:
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f"{value!r} is not an integer ID")
+    if not 0 <= value <= UINT32_MAX:
+        raise ValueError(f"{value} is out of range")
+    return value
+
+
+
+def _millis(timestamp: float) -> int:
+    return 0 if timestamp is None else int(round(float(timestamp) * 1000.0))
+
+
+
+def _micro(degrees: float) -> int:
+    return int(round(float(degrees) * 1e6))
@@ -0,0 +1,157 @@
+import math
+import heapq
+
+
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180.0
+
+
+
+class grid_index:
+    """
+    In-memory spatial index of points on a uniform latitude/longitude grid.
+    Every point is kept in the grid cell containing it, so a nearest-neighbour query
+    only visits the cells around the query point: rings of cells are searched outwards
+    until the k nearest points are found or the radius is exceeded.
+    The index is not thread-safe; callers must serialize updates and queries.
+
+    Args:
+        cell_size (float): Size of a grid cell in degrees.
+
+    #### Example:
+    ```python
+    from tools.grid_index import grid_index
+
+    index = grid_index(cell_size=0.002)
+    index.update(1, 63.41947, 10.40174)
+    index.update(2, 63.42947, 10.39174)
+    index.nearest(63.4195, 10.4017, k=1, radius=500) -> [(3.9, 1)]
+    ```
+    """
+
+    def __init__(self, cell_size: float) -> None:
+        self._cell_size = cell_size
+        self._cells = {}
+        self._points = {}
+
+
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return int(math.floor(lat / self._cell_size)), int(math.floor(lon / self._cell_size))
+
+
+
+    def update(self, key: int, lat: float, lon: float) -> None:
+        """
+        Insert a point, or move it if it is already indexed.
+        """
+        lat, lon = float(lat), float(lon)
+        cell = self._cell(lat, lon)
+        previous = self._points.get(key)
+        if previous is not None and previous[2] != cell:
+            self._remove_from_cell(key, previous[2])
+        self._points[key] = (lat, lon, cell)
+        self._cells.setdefault(cell, {})[key] = (lat, lon)
+
+
+
+    def remove(self, key: int) -> None:
+        """
+        Remove a point from the index, if present.
+        """
+        previous = self._points.pop(key, None)
+        if previous is not None:
+            self._remove_from_cell(key, previous[2])
+
+
+
+    def _remove_from_cell(self, key: int, cell: tuple[int, int]) -> None:
+        points = self._cells.get(cell)
+        if points is not None:
+            points.pop(key, None)
+            if not points:
+                del self._cells[cell]
+
+
+
+    def nearest(self, lat: float, lon: float, k: int, radius: float, accept=None) -> list[tuple[float, int]]:
+        """
+        Find the k nearest points within a radius.
+        Args:
+            lat (float): Latitude of the query point.
+            lon (float): Longitude of the query point.
+            k (int): Maximum number of points to return.
+            radius (float): Maximum distance in meters.
+            accept (callable): Optional filter, called with the key of a candidate point.
+        Returns:
+            list: (distance in meters, key) tuples, nearest first.
+        """
+        if k <= 0 or radius < 0:
+            return []
+
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        # Smallest extent of a cell in meters, bounding the distance covered by each ring
+        cell_meters = self._cell_size * METERS_PER_DEGREE * cos_lat
+        max_ring = int(math.ceil(radius / cell_meters)) + 1
+        center_lat, center_lon = self._cell(lat, lon)
+
+        best = []  # max-heap of (-distance, key) holding the k nearest points so far
+        for ring in range(max_ring + 1):
+            # Every point in this ring is at least (ring - 1) cells away from the query point
+            if ring > 0 and (ring - 1) * cell_meters > radius:
+                break
+            if len(best) == k and (ring - 1) * cell_meters > -best[0][0]:
+                break
+
+            for cell in self._ring(center_lat, center_lon, ring):
+                points = self._cells.get(cell)
+                if not points:
+                    continue
+                for key, (p_lat, p_lon) in points.items():
+                    distance = self._distance(lat, lon, p_lat, p_lon, cos_lat)
+                    if distance > radius:
+                        continue
+                    if len(best) == k and distance >= -best[0][0]:
+                        continue
+                    if accept is not None and not accept(key):
+                        continue
+                    if len(best) == k:
+                        heapq.heapreplace(best, (-distance, key))
+                    else:
+                        heapq.heappush(best, (-distance, key))
+
+        return sorted((-distance, key) for distance, key in best)
+
+
+
+    @staticmethod
+    def _ring(center_lat: int, center_lon: int, ring: int):
+        """
+        Cells at Chebyshev distance ring from the center cell.
+        """
+        if ring == 0:
+            yield center_lat, center_lon
+            return
+        for d in range(-ring, ring + 1):
+            yield center_lat - ring, center_lon + d
+            yield center_lat + ring, center_lon + d
+        for d in range(-ring + 1, ring):
+            yield center_lat + d, center_lon - ring
+            yield center_lat + d, center_lon + ring
+
+
+
+    @staticmethod
+    def _distance(lat1: float, lon1: float, lat2: float, lon2: float, cos_lat: float) -> float:
+        """
+        Equirectangular approximation of the distance in meters, accurate to well below
+        a meter over the few kilometres a nearby-search covers.
+        """
+        dy = (lat2 - lat1) * METERS_PER_DEGREE
+        dx = (lon2 - lon1) * METERS_PER_DEGREE * cos_lat
+        return math.sqrt(dx * dx + dy * dy)
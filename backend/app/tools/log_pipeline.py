@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from colorlog import ColoredFormatter
+
+from tools import metrics
+
+
+# Output format of the log [auto|json|text]: auto writes coloured text to a terminal
+# and JSON lines otherwise (e.g. under Docker, where the lines are collected).
+LOG_FORMAT     = os.getenv("LOG_FORMAT", "auto").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d in %(funcName)s()] %(message)s"
+LOG_COLORS  = {
+    'DEBUG':    'green',
+    'INFO':     'cyan',
+    'WARNING':  'yellow',
+    'ERROR':    'red',
+    'CRITICAL': 'bold_red',
+}
+
+DROPPED = metrics.counter("escooter_log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+_pipeline = None
+
+
+
+class json_formatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line. The fields of an incident, passed
+    as extra={"incident": {...}}, are nested under "incident".
+
+    #### Example:
+    ```python
+    logger.warning("single scooter unlock failed - weather", extra={"incident": {"user-id": 1, "scooter-id": 7}})
+    -> {"time": "2025-05-04T20:00:00.123+00:00", "level": "WARNING", "logger": "service.single_ride_service",
+        "location": "single_ride_service.py:212 in unlock_scooter()", "message": "single scooter unlock failed - weather",
+        "incident": {"user-id": 1, "scooter-id": 7}}
+    ```
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time":     datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level":    record.levelname,
+            "logger":   record.name,
+            "location": f"{record.filename}:{record.lineno} in {record.funcName}()",
+            "message":  record.getMessage(),
+        }
+        incident = getattr(record, "incident", None)
+        if incident:
+            line["incident"] = incident
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+
+class _incident_lines:
+    """
+    Internal mixin rendering the fields of an incident as indented lines below the
+    message, the layout the incident logs had when every line was its own record.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        incident = getattr(record, "incident", None)
+        if incident:
+            text += "".join(_indented(key, value, 1) for key, value in incident.items())
+        return text
+
+
+
+class text_formatter(_incident_lines, logging.Formatter):
+    pass
+
+
+
+class colour_formatter(_incident_lines, ColoredFormatter):
+    pass
+
+
+
+class _queue_handler(QueueHandler):
+    """
+    Internal queue handler which leaves all formatting to the writer thread. The
+    standard QueueHandler formats the message on the calling thread, so that records
+    can be pickled, which is not needed for a queue within the process.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+
+def console_handler(stream=None, log_format: str=LOG_FORMAT) -> logging.Handler:
+    """
+    Returns the handler writing the log to the console, with coloured text when the
+    stream is a terminal and JSON lines otherwise, unless LOG_FORMAT says otherwise.
+    Args:
+        stream: The stream to write to, sys.stdout by default.
+        log_format (str): The output format [auto|json|text].
+    """
+    stream = stream if stream is not None else sys.stdout
+    handler = logging.StreamHandler(stream)
+    tty = hasattr(stream, "isatty") and stream.isatty()
+
+    if log_format == "json" or (log_format == "auto" and not tty):
+        handler.setFormatter(json_formatter())
+    elif tty:
+        handler.setFormatter(colour_formatter(f"%(log_color)s{TEXT_FORMAT}", datefmt="%H:%M:%S", log_colors=LOG_COLORS))
+    else:
+        handler.setFormatter(text_formatter(TEXT_FORMAT, datefmt="%H:%M:%S"))
+    return handler
+
+
+
+def setup(level: int) -> logging.Logger:
+    """
+    Set up the logging pipeline of the process. Loggers only put records on a
+    bounded queue (dropping them, counted in escooter_log_records_dropped_total, if
+    the queue is full), and a background thread formats and writes them, so request
+    threads never wait for the console. The queue is drained on exit.
+    Calling setup again only changes the level.
+    Args:
+        level (int): The level of the root logger.
+    Returns:
+        logging.Logger: The root logger.
+
+    #### Example:
+    ```python
+    from tools import log_pipeline
+
+    logger = log_pipeline.setup(logging.INFO)
+    logger.warning("unlock failed", extra={"incident": {"user-id": 1, "scooter-id": 7}})
+    ```
+    """
+    global _pipeline
+
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    if _pipeline is not None:
+        return logger
+
+    records = queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE))
+    _pipeline = QueueListener(records, console_handler(), respect_handler_level=True)
+    _pipeline.start()
+    atexit.register(_pipeline.stop)
+    logger.addHandler(_queue_handler(records))
+    return logger
+
+
+
+def _indented(key: str, value, depth: int) -> str:
+    tabs = "\t" * depth
+    if isinstance(value, dict):
+        return f"\n{tabs}{key}:" + "".join(_indented(k, v, depth + 1) for k, v in value.items())
+    return f"\n{tabs}{key}: \t{value}"
@@ -0,0 +1,465 @@
+import os
+import math
+import time
+import glob
+import json
+import atexit
+import bisect
+import logging
+import threading
+
+
+# Latency buckets in seconds, from a cached query (~1 ms) to an MQTT timeout (15-30 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# With several worker processes, every process writes its metrics to METRICS_DIR every
+# METRICS_SYNC_INTERVAL seconds, and a scrape of any worker renders them all (see share).
+METRICS_DIR           = os.getenv("METRICS_DIR", "/tmp/escooter-metrics")
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", 1.0))
+
+_SUFFIX_ORDER = {"": 0, "_bucket": 0, "_sum": 1, "_count": 2}
+
+
+
+class _registry:
+    """
+    Internal list of the metrics rendered by render().
+    """
+
+    def __init__(self) -> None:
+        self._metrics = []
+        self._lock = threading.Lock()
+
+
+    def register(self, metric: "_metric") -> None:
+        with self._lock:
+            if any(registered.name == metric.name for registered in self._metrics):
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+
+    def collect(self) -> dict:
+        """
+        The current samples of every metric, as {name: [type, help, samples]} where
+        every sample is [suffix, label names, label values, value].
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: [metric.type, metric.help, metric.collect()] for metric in metrics}
+
+
+
+REGISTRY = _registry()
+
+
+
+class _metric:
+    """
+    Internal base class of the metrics. A metric has one child per combination of
+    label values, created on first use by labels(). Callers on hot paths should keep
+    the child, so that an update is a single lock-protected addition.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple=(), callback: callable=None) -> None:
+        self.name = name
+        self.help = help
+        self._label_names = tuple(labels)
+        self._callback = callback
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+
+    def labels(self, *values):
+        """
+        Returns the child of the metric for the given label values.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self._label_names):
+                raise ValueError(f"{self.name} expects labels {self._label_names}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+
+    def collect(self) -> list[list]:
+        if self._callback is not None:
+            values = self._callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [["", self._label_names, [str(value) for value in key], value] for key, value in values.items()]
+        return [
+            sample
+            for key, child in list(self._children.items())
+            for sample in child.collect(self._label_names, key)
+        ]
+
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+
+class _value:
+    """
+    Internal child of counters and gauges.
+    """
+
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount: float=1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+
+    def dec(self, amount: float=1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+
+    def collect(self, label_names: tuple, key: tuple) -> list[list]:
+        return [["", label_names, key, self._value]]
+
+
+
+class counter(_metric):
+    """
+    A value which only goes up, e.g. the number of MQTT timeouts.
+    With a callback, the value is read from it when rendering instead, which suits
+    counters already kept elsewhere (e.g. route_limiter.rejected).
+
+    Args:
+        name (str): Name of the metric, e.g. "escooter_mqtt_timeouts_total".
+        help (str): Description of the metric.
+        labels (tuple): Names of the labels.
+        callback (callable): Returns the value, or a dict of label values to value.
+
+    #### Example:
+    ```python
+    from tools import metrics
+
+    TIMEOUTS = metrics.counter("escooter_mqtt_timeouts_total", "Commands without response.", ("command",))
+    TIMEOUTS.labels("unlock").inc()
+    ```
+    """
+
+    type = "counter"
+
+    def _new_child(self) -> _value:
+        return _value()
+
+
+    def inc(self, amount: float=1.0) -> None:
+        self.labels().inc(amount)
+
+
+
+class gauge(counter):
+    """
+    A value which goes up and down, e.g. the number of requests in flight.
+    Takes the same arguments as counter.
+    """
+
+    type = "gauge"
+
+    def dec(self, amount: float=1.0) -> None:
+        self.labels().dec(amount)
+
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+
+class _buckets:
+    """
+    Internal child of histograms, counting observations per bucket.
+    """
+
+    __slots__ = ("_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, bounds: tuple) -> None:
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+
+    def time(self) -> "_timer":
+        """
+        Returns a context manager observing the seconds spent in its block.
+        """
+        return _timer(self)
+
+
+    def collect(self, label_names: tuple, key: tuple) -> list[list]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + (math.inf,), counts):
+            cumulative += count
+            samples.append(["_bucket", label_names + ("le",), key + (_number(bound),), cumulative])
+        samples.append(["_sum", label_names, key, total])
+        samples.append(["_count", label_names, key, cumulative])
+        return samples
+
+
+
+class _timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child: _buckets) -> None:
+        self._child = child
+
+
+    def __enter__(self) -> "_timer":
+        self._started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self._child.observe(time.perf_counter() - self._started)
+
+
+
+class histogram(_metric):
+    """
+    Distribution of observed values, usually durations in seconds, counted in
+    fixed buckets. An observation costs a binary search over the buckets and one
+    lock-protected increment, which is cheap enough for every query and command.
+
+    Args:
+        name (str): Name of the metric, e.g. "escooter_db_query_seconds".
+        help (str): Description of the metric.
+        labels (tuple): Names of the labels.
+        buckets (tuple): Upper bounds of the buckets, in increasing order.
+
+    #### Example:
+    ```python
+    from tools import metrics
+
+    QUERY_SECONDS = metrics.histogram("escooter_db_query_seconds", "Query time.", ("method",))
+
+    get_user = QUERY_SECONDS.labels("get_user")
+    with get_user.time():
+        ...
+    get_user.observe(0.004)
+    ```
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple=(), buckets: tuple=DEFAULT_BUCKETS) -> None:
+        self._bounds = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, help, labels)
+
+
+    def _new_child(self) -> _buckets:
+        return _buckets(self._bounds)
+
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+    def time(self) -> _timer:
+        return self.labels().time()
+
+
+
+_shared = None
+
+
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format. Once share() was
+    called, the metrics of every worker process are rendered, otherwise those of this
+    process only.
+    Returns:
+        str: The metrics, served with the content type CONTENT_TYPE.
+    """
+    if _shared is None:
+        return _format(_merge([(os.getpid(), True, REGISTRY.collect())]))
+    _write_snapshot()
+    return _format(_merge(_read_snapshots()))
+
+
+
+def share(directory: str=METRICS_DIR, interval: float=METRICS_SYNC_INTERVAL) -> None:
+    """
+    Share the metrics of this process with the other worker processes, so that a
+    scrape of any worker returns the metrics of all of them, like the multiprocess
+    mode of the Prometheus client library. Every process writes a snapshot of its
+    metrics to `directory` every `interval` seconds and on exit, and render() merges
+    the snapshots:
+
+    * counters and histograms are summed over every process which wrote a snapshot,
+      including exited ones, so they never go down when a worker is replaced, and
+    * gauges are reported per process with a "worker" label (the process ID), for the
+      processes which wrote a snapshot within the last three intervals.
+
+    The directory should be emptied before the workers start (see reset_shared).
+    Args:
+        directory (str): Directory shared by the worker processes.
+        interval (float): Seconds between snapshots.
+
+    #### Example:
+    ```python
+    metrics.reset_shared()  # in the launching process
+    metrics.share()         # in every worker process
+    ```
+    """
+    global _shared
+    if _shared is not None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _shared = (directory, max(0.1, interval))
+    _write_snapshot()
+    threading.Thread(target=_sync, name="metrics-sync", daemon=True).start()
+    atexit.register(_write_snapshot)
+
+
+
+def reset_shared(directory: str=METRICS_DIR) -> None:
+    """
+    Remove the snapshots of previous runs from the shared metrics directory, so
+    counters start from zero with a new set of workers.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+
+def _sync() -> None:
+    """
+    Internal loop writing the snapshot of this process every interval.
+    """
+    while True:
+        time.sleep(_shared[1])
+        try:
+            _write_snapshot()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error writing metrics snapshot: {e}")
+
+
+
+def _write_snapshot() -> None:
+    """
+    Internal function writing the metrics of this process to the shared directory.
+    The file is replaced atomically, so readers never see a partial snapshot.
+    """
+    path = os.path.join(_shared[0], f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(REGISTRY.collect(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+
+def _read_snapshots() -> list[tuple]:
+    """
+    Internal function reading the snapshots of every process.
+    Returns:
+        list: (pid, alive, families) for every snapshot, alive if written within three intervals.
+    """
+    snapshots = []
+    now = time.time()
+    for path in glob.glob(os.path.join(_shared[0], "*.json")):
+        try:
+            alive = now - os.path.getmtime(path) < 3 * _shared[1]
+            with open(path) as f:
+                snapshots.append((int(os.path.basename(path)[:-len(".json")]), alive, json.load(f)))
+        except (OSError, ValueError):
+            # Replaced or removed while reading, it is read again with the next scrape
+            continue
+    return snapshots
+
+
+
+def _merge(snapshots: list[tuple]) -> dict:
+    """
+    Internal function merging the metrics of one or more processes, see share().
+    Returns:
+        dict: {name: [type, help, {(label names, label values): {(suffix, le): value}}]}
+    """
+    merged = {}
+    several = len(snapshots) > 1 or _shared is not None
+    for pid, alive, families in snapshots:
+        for name, (kind, help, samples) in families.items():
+            family = merged.setdefault(name, [kind, help, {}])
+            for suffix, names, values, value in samples:
+                names, values = tuple(names), tuple(values)
+                if kind == "gauge" and several:
+                    if not alive:
+                        continue
+                    names, values = names + ("worker",), values + (str(pid),)
+                le = None
+                if suffix == "_bucket":
+                    names, values, le = names[:-1], values[:-1], values[-1]
+                child = family[2].setdefault((names, values), {})
+                child[(suffix, le)] = child.get((suffix, le), 0) + value
+    return merged
+
+
+
+def _format(merged: dict) -> str:
+    """
+    Internal function rendering merged metrics in the text exposition format.
+    """
+    lines = []
+    for name, (kind, help, children) in merged.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (names, values), samples in children.items():
+            order = sorted(samples, key=lambda sample: (_SUFFIX_ORDER[sample[0]], float(sample[1] or 0)))
+            for suffix, le in order:
+                labels = _labels(names + ("le",), values + (le,)) if le is not None else _labels(names, values)
+                lines.append(f"{name}{suffix}{labels} {_number(samples[(suffix, le)])}")
+    return "\n".join(lines) + "\n"
+
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,104 @@
+import os
+import fcntl
+import logging
+from threading import Thread, Event
+
+
+WORKER_LOCK_PATH  = os.getenv("WORKER_LOCK_PATH", "/tmp/escooter-backend-primary.lock")
+WORKER_LOCK_RETRY = float(os.getenv("WORKER_LOCK_RETRY", 10.0))
+
+
+
+class primary_worker:
+    """
+    Elects one worker process of the back-end to run the jobs which must run once,
+    not once per process (e.g. archiving rentals, which runs partition DDL).
+    The worker which takes an exclusive lock on WORKER_LOCK_PATH is the primary and
+    calls on_elected. The operating system releases the lock when the process exits,
+    and the other workers try to take it every WORKER_LOCK_RETRY seconds, so another
+    worker takes over if the primary dies.
+
+    The lock is an advisory file lock (flock), so the workers must share the lock
+    file, i.e. run on the same host.
+
+    Args:
+        on_elected (callable): Called without arguments once this process is elected.
+        path (str): The lock file.
+        retry (float): Seconds between attempts to take the lock.
+
+    #### Example:
+    ```python
+    from tools.primary_worker import primary_worker
+
+    primary = primary_worker(archive_service().start)
+    primary.start()
+    ...
+    primary.stop()
+    ```
+    """
+
+    def __init__(self, on_elected: callable, path: str=WORKER_LOCK_PATH, retry: float=WORKER_LOCK_RETRY) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._on_elected = on_elected
+        self._path = path
+        self._retry = max(0.1, retry)
+        self._file = None
+        self._stopped = Event()
+        self._thread = None
+
+
+    @property
+    def elected(self) -> bool:
+        return self._file is not None
+
+
+    def start(self) -> None:
+        """
+        Try to become the primary, and keep trying in the background if another worker is.
+        """
+        if self._try_lock():
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name="primary-worker", daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Stop trying to become the primary, and release the lock if this worker holds it.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._retry + 1)
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def _try_lock(self) -> bool:
+        """
+        Internal function taking the lock without waiting, and calling on_elected if it did.
+        """
+        lock_file = open(self._path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        self._logger.info(f"Worker {os.getpid()} is the primary worker")
+        self._on_elected()
+        return True
+
+
+    def _run(self) -> None:
+        """
+        Internal loop retrying to take the lock.
+        """
+        while not self._stopped.wait(self._retry):
+            try:
+                if self._try_lock():
+                    return
+            except Exception as e:
+                self._logger.error(f"Error electing the primary worker: {e}")
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+
+
+class overloaded(Exception):
+    """
+    Raised when a route_limiter has no free slot, to be answered with 503 Service Unavailable.
+
+    Args:
+        name (str): Name of the limiter which rejected the request.
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, name: str, retry_after: int) -> None:
+        super().__init__(f"{name}: too many concurrent requests")
+        self.name = name
+        self.retry_after = retry_after
+
+
+
+class route_limiter:
+    """
+    Bounds the number of requests a group of routes handles at once.
+    A request takes a slot for as long as it is handled. If no slot frees up within
+    wait seconds, the request is rejected with overloaded instead of being queued,
+    so a burst of slow requests (e.g. unlocks waiting for scooters) fails fast
+    instead of piling up, and cannot take the slots of the other routes.
+
+    The limit should match what a request holds while it is handled: routes running
+    on a thread pool are limited to its threads, while coroutines which only await
+    I/O (e.g. unlocks waiting up to 30 seconds for a scooter) hold no thread, so their
+    limit only bounds memory and may be thousands.
+
+    Args:
+        name (str): Name of the limiter, used in logs and metrics.
+        limit (int): Maximum number of requests handled at once.
+        wait (float): Seconds a request may wait for a free slot.
+        retry_after (int): Seconds clients are told to wait before retrying.
+
+    #### Example:
+    ```python
+    from tools.route_limiter import route_limiter
+
+    reads = route_limiter("reads", limit=16, wait=0.1, retry_after=1)
+
+    async with reads:
+        ...  # raises overloaded if the 16 slots stay taken for 0.1 seconds
+    ```
+    """
+
+    def __init__(self, name: str, limit: int, wait: float=0.0, retry_after: int=1) -> None:
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self.limit = max(1, limit)
+        self.wait = max(0.0, wait)
+        self.retry_after = max(1, int(retry_after))
+        self.in_flight = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(self.limit)
+
+
+
+    async def __aenter__(self) -> "route_limiter":
+        if self._semaphore.locked():
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                self._logger.warning(f"{self.name}: all {self.limit} slots busy, rejecting request")
+                raise overloaded(self.name, self.retry_after) from None
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        return self
+
+
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
@@ -26,4 +26,6 @@ def singleton(cls):
             instances[cls] = cls(*args, **kwargs)
         return instances[cls]
 
+    # The class itself, e.g. for tests which need instances of their own
+    get_instance.__wrapped__ = cls
     return get_instance
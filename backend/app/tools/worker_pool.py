@@ -0,0 +1,126 @@
+import sys
+import queue
+import logging
+import itertools
+from collections import deque
+from threading import Thread, Lock
+
+from tools import metrics
+
+
+PRIORITY_HIGH    = 0
+PRIORITY_DEFAULT = 1
+
+REJECTED = metrics.counter("escooter_worker_pool_rejected_total", "Jobs rejected because the queue of a worker pool was full.", ("pool",))
+DEFERRED = metrics.counter("escooter_worker_pool_deferred_total", "Jobs kept in the overflow list because the queue of a worker pool was full.", ("pool",))
+
+
+
+class worker_pool:
+    """
+    Bounded pool of worker threads executing prioritised jobs.
+    Jobs are executed in order of priority, and in order of submission within the
+    same priority, so urgent work (e.g. distress aborts) overtakes a backlog of
+    ordinary jobs. submit() never blocks, as jobs are often submitted from a network
+    thread (e.g. the MQTT loop) which must keep running.
+
+    Urgent jobs (PRIORITY_HIGH) are never rejected. When `capacity` jobs are waiting,
+    ordinary jobs are rejected, unless submitted with defer=True: those are kept in an
+    overflow list, which the workers move back to the queue as it empties. Rejected
+    and deferred jobs are counted in escooter_worker_pool_rejected_total and
+    escooter_worker_pool_deferred_total.
+
+    #### Example:
+    ```python
+    from tools.worker_pool import worker_pool, PRIORITY_HIGH
+
+    pool = worker_pool(name="mqtt-worker", workers=4, capacity=1000)
+    pool.submit(print, "handled first", priority=PRIORITY_HIGH)
+    pool.submit(print, "handled after urgent jobs, even if the pool is overloaded", defer=True)
+    if not pool.submit(print, "handled after urgent jobs"):
+        print("pool is overloaded")
+    pool.stop()
+    ```
+    """
+
+    def __init__(self, name: str, workers: int, capacity: int) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._name = name
+        self._capacity = max(1, capacity)
+        self._queue = queue.PriorityQueue()
+        self._overflow = deque()
+        self._overflow_lock = Lock()
+        self._counter = itertools.count()
+        self._threads = [
+            Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+
+    def submit(self, job: callable, *args, priority: int=PRIORITY_DEFAULT, defer: bool=False) -> bool:
+        """
+        Submit a job to the pool, without waiting.
+        Args:
+            job (callable): The function to execute.
+            *args: Arguments passed to the function.
+            priority (int): Lower values are executed first. PRIORITY_HIGH jobs are never rejected.
+            defer (bool): Keep the job in the overflow list instead of rejecting it if the queue is full.
+        Returns:
+            bool: True if the job was queued or deferred, False if it was rejected because the queue is full.
+        """
+        item = (priority, next(self._counter), job, args)
+        if priority <= PRIORITY_HIGH or self._queue.qsize() < self._capacity:
+            self._queue.put_nowait(item)
+            return True
+        if not defer:
+            REJECTED.labels(self._name).inc()
+            self._logger.debug(f"{self._name}: queue is full ({self._queue.qsize()} jobs), rejecting {getattr(job, '__name__', job)}")
+            return False
+
+        DEFERRED.labels(self._name).inc()
+        with self._overflow_lock:
+            self._overflow.append(item)
+        # The workers may have emptied the queue meanwhile, and would not drain the overflow
+        self._drain()
+        return True
+
+
+    def _drain(self) -> None:
+        """
+        Internal function moving deferred jobs back to the queue while it has room.
+        """
+        with self._overflow_lock:
+            while self._overflow and self._queue.qsize() < self._capacity:
+                self._queue.put_nowait(self._overflow.popleft())
+
+
+    def backlog(self) -> int:
+        """
+        Returns the number of jobs waiting to be executed, deferred ones included.
+        """
+        return self._queue.qsize() + len(self._overflow)
+
+
+    def stop(self) -> None:
+        """
+        Stop the workers once the jobs already submitted are done.
+        """
+        for _ in self._threads:
+            self._queue.put((sys.maxsize, next(self._counter), None, ()))
+
+
+    def _run(self) -> None:
+        while True:
+            _, _, job, args = self._queue.get()
+            if self._overflow:
+                self._drain()
+            try:
+                if job is None:
+                    return
+                job(*args)
+            except Exception as e:
+                self._logger.exception(f"{self._name}: job {getattr(job, '__name__', job)} failed: {e}")
+            finally:
+                self._queue.task_done()
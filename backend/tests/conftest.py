@@ -0,0 +1,8 @@
+import os
+import sys
+
+
+# The back-end runs from backend/app (see the Dockerfile), so its packages are imported
+# as top-level packages, e.g. "from tools.codec import encode".
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
@@ -0,0 +1,78 @@
+import pytest
+
+from tools import circuit_breaker as breaker_module
+from tools.circuit_breaker import circuit_breaker, CLOSED, OPEN, HALF_OPEN
+
+
+class clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def now(monkeypatch):
+    fake = clock()
+    monkeypatch.setattr(breaker_module.time, "monotonic", fake)
+    return fake
+
+
+def test_opens_after_failures_in_a_row(now):
+    breaker = circuit_breaker("test", failures=3, reset_after=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(0.1, ok=False)
+    assert breaker.state == CLOSED
+
+    breaker.record(0.1, ok=False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert not breaker.allow()
+    assert breaker.rejected == 2
+
+
+def test_success_resets_the_failure_count(now):
+    breaker = circuit_breaker("test", failures=2, reset_after=30)
+    breaker.record(0.1, ok=False)
+    breaker.record(0.1, ok=True)
+    breaker.record(0.1, ok=False)
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_count_as_failures(now):
+    breaker = circuit_breaker("test", failures=1, reset_after=30, slow_after=2.0)
+    breaker.record(1.9, ok=True)
+    assert breaker.state == CLOSED
+    breaker.record(2.1, ok=True)
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_trial_through(now):
+    breaker = circuit_breaker("test", failures=1, reset_after=30)
+    breaker.record(0.1, ok=False)
+    now.now += 29
+    assert breaker.state == OPEN and not breaker.allow()
+
+    now.now += 1
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record(0.1, ok=True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_again(now):
+    breaker = circuit_breaker("test", failures=3, reset_after=30)
+    for _ in range(3):
+        breaker.record(0.1, ok=False)
+    now.now += 30
+    assert breaker.allow()
+
+    breaker.record(0.1, ok=False)
+    assert breaker.state == OPEN
+    now.now += 30
+    assert breaker.allow()
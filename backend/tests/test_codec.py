@@ -0,0 +1,120 @@
+import os
+import uuid
+import importlib.util
+
+import pytest
+
+
+# The codec is shared by the back-end and the scooter software. Both copies are loaded
+# by path and tested alike, so neither can drift from the wire format.
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+COPIES = {
+    "backend":  os.path.join(ROOT, "backend", "app", "tools", "codec.py"),
+    "e-scooter": os.path.join(ROOT, "e-scooter", "tools", "codec.py"),
+}
+
+
+def _load(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(f"codec_{name.replace('-', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=sorted(COPIES), scope="module")
+def codec(request):
+    return _load(request.param, COPIES[request.param])
+
+
+COMMAND = {
+    "id": 1000,
+    "request_id": uuid.UUID(int=0x9F1C).hex,
+    "uuid": 7,
+    "command": "unlock",
+    "coride": False,
+    "num_coriders": 0,
+    "coriders": [],
+    "timestamp": 1743420329.5,
+}
+
+RESPONSE = {
+    "id": 1000,
+    "request_id": uuid.UUID(int=0x9F1C).hex,
+    "uuid": 7,
+    "battery": 87,
+    "status": 0,
+    "abort": False,
+    "timestamp": 1743420330.25,
+}
+
+
+def test_copies_are_identical():
+    with open(COPIES["backend"], "rb") as backend, open(COPIES["e-scooter"], "rb") as scooter:
+        assert backend.read() == scooter.read()
+
+
+@pytest.mark.parametrize("message", [
+    COMMAND,
+    dict(COMMAND, command="lock", request_id=None),
+    dict(COMMAND, coride=True, num_coriders=2, coriders=[8, 9]),
+    dict(COMMAND, reply_to="escooter/command/response/worker-2"),
+])
+def test_command_roundtrip(codec, message):
+    payload = codec.encode(message)
+    assert payload[0] == codec.MAGIC
+
+    decoded, received = codec.decode(payload)
+    assert received == codec.CODEC_BINARY
+    assert decoded == message
+
+
+@pytest.mark.parametrize("message", [
+    RESPONSE,
+    dict(RESPONSE, abort=True, request_id=None),
+    dict(RESPONSE, location={"latitude": 63.419471, "longitude": 10.401742}),
+])
+def test_response_roundtrip(codec, message):
+    decoded, received = codec.decode(codec.encode(message))
+    assert received == codec.CODEC_BINARY
+    assert decoded == message
+
+
+def test_string_ids_are_decoded_as_integers(codec):
+    decoded, _ = codec.decode(codec.encode(dict(COMMAND, id="1000", uuid="7")))
+    assert decoded["id"] == 1000
+    assert decoded["uuid"] == 7
+
+
+@pytest.mark.parametrize("message", [
+    dict(COMMAND, extra="field"),
+    dict(COMMAND, uuid="scooter-7"),
+    dict(COMMAND, uuid=0xFFFFFFFF + 1),
+    dict(RESPONSE, request_id="not-a-request-id"),
+])
+def test_unrepresentable_messages_fall_back_to_json(codec, message):
+    payload = codec.encode(message)
+    assert payload[:1] == b"{"
+    assert codec.decode(payload) == (message, codec.CODEC_JSON)
+
+
+def test_json_codec(codec):
+    payload = codec.encode(COMMAND, codec.CODEC_JSON)
+    assert codec.decode(payload) == (COMMAND, codec.CODEC_JSON)
+
+
+@pytest.mark.parametrize("payload", [
+    b"not json",
+    bytes([0xB5, 1, 1, 0]),
+    bytes([0xB5, 2, 1, 0]) + bytes(18),
+    bytes([0xB5, 1, 9, 0]) + bytes(18),
+])
+def test_invalid_payloads(codec, payload):
+    with pytest.raises(codec.codec_error):
+        codec.decode(payload)
+
+
+def test_negotiate(codec):
+    assert codec.negotiate(codec.CODEC_BINARY, {}, codec.CODEC_BINARY) == codec.CODEC_BINARY
+    assert codec.negotiate(codec.CODEC_BINARY, {"codec": codec.VERSION}, codec.CODEC_JSON) == codec.CODEC_BINARY
+    assert codec.negotiate(codec.CODEC_BINARY, {}, codec.CODEC_JSON) == codec.CODEC_JSON
+    assert codec.negotiate(codec.CODEC_JSON, {"codec": codec.VERSION}, codec.CODEC_BINARY) == codec.CODEC_JSON
@@ -0,0 +1,87 @@
+import math
+import random
+
+import pytest
+
+from tools.grid_index import grid_index, METERS_PER_DEGREE
+
+
+def _brute_force(points: dict, lat: float, lon: float, k: int, radius: float, accept=None) -> list:
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    found = []
+    for key, (p_lat, p_lon) in points.items():
+        dy = (p_lat - lat) * METERS_PER_DEGREE
+        dx = (p_lon - lon) * METERS_PER_DEGREE * cos_lat
+        distance = math.sqrt(dx * dx + dy * dy)
+        if distance <= radius and (accept is None or accept(key)):
+            found.append((distance, key))
+    return sorted(found)[:k]
+
+
+@pytest.fixture
+def fleet():
+    rng = random.Random(42)
+    return {key: (63.43 + rng.uniform(-0.02, 0.02), 10.40 + rng.uniform(-0.04, 0.04)) for key in range(500)}
+
+
+def test_example():
+    index = grid_index(cell_size=0.002)
+    index.update(1, 63.41947, 10.40174)
+    index.update(2, 63.42947, 10.39174)
+    assert [key for _, key in index.nearest(63.4195, 10.4017, k=1, radius=500)] == [1]
+    assert index.nearest(63.4195, 10.4017, k=1, radius=500)[0][0] == pytest.approx(3.9, abs=0.1)
+
+
+@pytest.mark.parametrize("k, radius", [(1, 100), (5, 500), (20, 1000), (50, 300), (500, 5000)])
+def test_nearest_matches_brute_force(fleet, k, radius):
+    index = grid_index(cell_size=0.002)
+    for key, (lat, lon) in fleet.items():
+        index.update(key, lat, lon)
+
+    rng = random.Random(k)
+    for _ in range(50):
+        lat, lon = 63.43 + rng.uniform(-0.025, 0.025), 10.40 + rng.uniform(-0.05, 0.05)
+        expected = _brute_force(fleet, lat, lon, k, radius)
+        result = index.nearest(lat, lon, k, radius)
+        assert [key for _, key in result] == [key for _, key in expected]
+        assert [distance for distance, _ in result] == pytest.approx([distance for distance, _ in expected])
+
+
+def test_accept_filters_candidates(fleet):
+    index = grid_index(cell_size=0.002)
+    for key, (lat, lon) in fleet.items():
+        index.update(key, lat, lon)
+
+    even = lambda key: key % 2 == 0
+    result = index.nearest(63.43, 10.40, k=10, radius=2000, accept=even)
+    expected = _brute_force(fleet, 63.43, 10.40, 10, 2000, accept=even)
+    assert [key for _, key in result] == [key for _, key in expected]
+    assert all(key % 2 == 0 for _, key in result)
+
+
+def test_update_moves_points_across_cells():
+    index = grid_index(cell_size=0.002)
+    index.update(1, 63.41947, 10.40174)
+    index.update(1, 63.45, 10.45)
+
+    assert len(index) == 1
+    assert index.nearest(63.41947, 10.40174, k=1, radius=500) == []
+    assert [key for _, key in index.nearest(63.45, 10.45, k=1, radius=500)] == [1]
+
+
+def test_remove():
+    index = grid_index(cell_size=0.002)
+    index.update(1, 63.41947, 10.40174)
+    index.update(2, 63.41950, 10.40180)
+    index.remove(1)
+    index.remove(3)
+
+    assert len(index) == 1
+    assert [key for _, key in index.nearest(63.41947, 10.40174, k=5, radius=500)] == [2]
+
+
+@pytest.mark.parametrize("k, radius", [(0, 500), (5, -1)])
+def test_empty_queries(k, radius):
+    index = grid_index(cell_size=0.002)
+    index.update(1, 63.41947, 10.40174)
+    assert index.nearest(63.41947, 10.40174, k, radius) == []
@@ -0,0 +1,255 @@
+import copy
+import time
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+mysql_connector = pytest.importorskip("mysql.connector")
+
+from api import database
+from api.ledger import ledger
+
+
+class fake_store:
+    """
+    In-memory stand-in for the tables complete_rentals writes, shared by every fake connection.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.tables = {"rentals": {}, "funds": {}, "scooters": {}, "transactions": {}}
+        self.commits = 0
+        self.broken = set()
+        self.delay = 0.0
+
+    def add_rental(self, rental_id: int, user_id: int, scooter_id: int, funds: float=100.0, active: bool=True) -> None:
+        self.tables["rentals"][rental_id] = {"user_id": user_id, "scooter_id": scooter_id, "is_active": int(active)}
+        self.tables["funds"].setdefault(user_id, funds)
+
+    def charges(self, rental_id: int) -> list:
+        return [entry for entry in self.tables["transactions"].values() if entry[1] == rental_id]
+
+    def funds(self, user_id: int) -> float:
+        return self.tables["funds"][user_id]
+
+
+class fake_connection:
+    def __init__(self, store: fake_store) -> None:
+        self.store = store
+        self.autocommit = True
+        self._begin = None
+        self.savepoint = None
+
+    def start_transaction(self) -> None:
+        time.sleep(self.store.delay)
+        self._begin = copy.deepcopy(self.store.tables)
+
+    def cursor(self, buffered: bool=False) -> "fake_cursor":
+        return fake_cursor(self)
+
+    def commit(self) -> None:
+        self._begin = None
+        self.store.commits += 1
+
+    def rollback(self) -> None:
+        if self._begin is not None:
+            self.store.tables = self._begin
+            self._begin = None
+
+    def ping(self, **kwargs) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class fake_cursor:
+    def __init__(self, conn: fake_connection) -> None:
+        self._conn = conn
+        self._row = None
+        self.rowcount = 0
+
+    def execute(self, query: str, params: tuple=()) -> None:
+        store = self._conn.store
+        tables = store.tables
+        self.rowcount = 0
+        if query == "SAVEPOINT complete_rental":
+            self._conn.savepoint = copy.deepcopy(tables)
+        elif query == "ROLLBACK TO SAVEPOINT complete_rental":
+            store.tables = self._conn.savepoint
+        elif query == database.LEDGER_INSERT:
+            user_id, rental_id, amount, kind, key = params
+            if key in tables["transactions"]:
+                raise mysql_connector.IntegrityError(msg=f"Duplicate entry '{key}'", errno=database.ER_DUP_ENTRY)
+            tables["transactions"][key] = (user_id, rental_id, amount, kind)
+        elif query.startswith("UPDATE rentals SET is_active = 0"):
+            price, rental_id = params
+            if rental_id in store.broken:
+                raise mysql_connector.OperationalError(msg="Lost connection to server during query")
+            rental = tables["rentals"].get(rental_id)
+            if rental is not None and rental["is_active"]:
+                rental.update(is_active=0, total_price=price)
+                self.rowcount = 1
+        elif query.startswith("UPDATE users SET funds = funds - %s"):
+            price, user_id = params
+            tables["funds"][user_id] -= price
+        elif query.startswith("SELECT scooter_id FROM rentals"):
+            self._row = (tables["rentals"][params[0]]["scooter_id"],)
+        elif query.startswith("UPDATE scooters SET latitude"):
+            lat, lon, status, scooter_id = params
+            tables["scooters"][scooter_id] = (lat, lon, status)
+        else:
+            raise mysql_connector.ProgrammingError(msg=f"unexpected query: {query}")
+
+    def fetchone(self) -> tuple:
+        return self._row
+
+    def close(self) -> None:
+        pass
+
+
+STORE = fake_store()
+
+
+@pytest.fixture(scope="module")
+def db():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(mysql_connector, "connect", lambda **credentials: fake_connection(STORE))
+        yield database.db(database.credentials_from_env())
+
+
+@pytest.fixture
+def store(db):
+    STORE.reset()
+    return STORE
+
+
+def _rental(rental_id: int, user_id: int, price: float=25.0) -> tuple:
+    return (rental_id, user_id, price, 63.41947, 10.40174, 0)
+
+
+def test_complete_rentals_charges_once(db, store):
+    store.add_rental(5, user_id=1, scooter_id=7)
+
+    assert db.complete_rentals([_rental(5, 1)]) == [True]
+    assert db.complete_rentals([_rental(5, 1)]) == [True]
+
+    assert len(store.charges(5)) == 1
+    assert store.funds(1) == 75.0
+    assert store.tables["scooters"][7] == (63.41947, 10.40174, 0)
+
+
+def test_complete_rentals_skips_inactive_rentals(db, store):
+    store.add_rental(5, user_id=1, scooter_id=7)
+    store.add_rental(6, user_id=2, scooter_id=8, active=False)
+
+    assert db.complete_rentals([_rental(6, 2), _rental(9, 3), _rental(5, 1)]) == [False, False, True]
+
+    assert store.charges(6) == [] and store.charges(9) == []
+    assert store.funds(2) == 100.0
+    assert store.funds(1) == 75.0
+    assert store.commits == 1
+
+
+def test_complete_rentals_writes_nothing_if_the_batch_fails(db, store):
+    store.add_rental(5, user_id=1, scooter_id=7)
+    store.add_rental(6, user_id=2, scooter_id=8)
+    store.broken.add(6)
+
+    assert db.complete_rentals([_rental(5, 1), _rental(6, 2)]) is None
+
+    assert store.charges(5) == []
+    assert store.funds(1) == 100.0
+    assert store.tables["rentals"][5]["is_active"] == 1
+
+
+def test_ledger_retries_are_idempotent(db, store):
+    store.add_rental(5, user_id=1, scooter_id=7)
+    committer = ledger(db)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: committer.complete_rental(*_rental(5, 1)), range(20)))
+
+    assert results == [True] * 20
+    assert len(store.charges(5)) == 1
+    assert store.funds(1) == 75.0
+
+
+def test_ledger_splits_batch_results_by_group(db, store):
+    for rental_id in range(1, 6):
+        store.add_rental(rental_id, user_id=rental_id, scooter_id=rental_id)
+    store.tables["rentals"][4]["is_active"] = 0
+    batch = [
+        ([_rental(1, 1)], Future()),
+        ([_rental(2, 2), _rental(3, 3), _rental(4, 4)], Future()),
+        ([_rental(5, 5)], Future()),
+    ]
+
+    ledger(db)._commit(batch)
+
+    assert [future.result() for _, future in batch] == [[True], [True, True, False], [True]]
+    assert store.commits == 1
+
+
+def test_ledger_retries_groups_one_by_one_after_a_failed_batch(db, store):
+    for rental_id in range(1, 5):
+        store.add_rental(rental_id, user_id=rental_id, scooter_id=rental_id)
+    store.broken.add(3)
+    batch = [
+        ([_rental(1, 1)], Future()),
+        ([_rental(2, 2), _rental(3, 3)], Future()),
+        ([_rental(4, 4)], Future()),
+    ]
+
+    ledger(db)._commit(batch)
+
+    assert [future.result() for _, future in batch] == [[True], [False, False], [True]]
+    # The group is written in one transaction, so its other rental is not charged either
+    assert store.charges(2) == [] and store.funds(2) == 100.0
+    assert len(store.charges(1)) == 1 and len(store.charges(4)) == 1
+
+
+def test_cancelled_futures_do_not_stop_the_committer(db, store):
+    store.add_rental(5, user_id=1, scooter_id=7)
+    store.add_rental(6, user_id=2, scooter_id=8)
+    cancelled = Future()
+    cancelled.cancel()
+
+    ledger(db)._commit([([_rental(5, 1)], cancelled)])
+
+    assert len(store.charges(5)) == 1
+    assert ledger(db).complete_rental(*_rental(6, 2))
+
+
+def test_committer_survives_a_failing_commit(db, store, monkeypatch):
+    store.add_rental(5, user_id=1, scooter_id=7)
+    committer = ledger(db)
+    commit = committer._commit
+
+    def failing_once(batch):
+        monkeypatch.setattr(committer, "_commit", commit)
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(committer, "_commit", failing_once)
+    assert committer.complete_rental(*_rental(5, 1)) is False
+    assert committer.complete_rental(*_rental(5, 1)) is True
+    assert len(store.charges(5)) == 1
+
+
+def test_timed_out_completion_still_commits(db, store, monkeypatch):
+    from api import ledger as ledger_module
+    store.add_rental(5, user_id=1, scooter_id=7)
+    store.add_rental(6, user_id=2, scooter_id=8)
+    store.delay = 0.3
+    monkeypatch.setattr(ledger_module, "LEDGER_TIMEOUT", 0.05)
+    committer = ledger(db)
+
+    assert asyncio.run(committer.complete_rental_async(*_rental(5, 1))) is False
+    store.delay = 0.0
+    monkeypatch.setattr(ledger_module, "LEDGER_TIMEOUT", 5)
+    # The committer outlived the timeout, and the rental was charged all the same
+    assert committer.complete_rental(*_rental(6, 2))
+    assert len(store.charges(5)) == 1
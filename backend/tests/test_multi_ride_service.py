@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+for module in ("numpy", "mysql.connector", "paho.mqtt", "requests", "httpx"):
+    pytest.importorskip(module)
+
+from api import database, mqtt
+from logic import transaction
+from service.multi_ride_service import multi_ride_service
+
+
+LEADER  = 1
+SESSION = 3
+
+
+class stub_coride:
+    """
+    Stand-in for the database, scooter state, MQTT client and ledger, holding one co-ride
+    of the leader with one rental per scooter.
+    """
+
+    def __init__(self, riders: list[tuple[int, int]]) -> None:
+        start = datetime.now() - timedelta(minutes=10)
+        self.rentals = [[40 + i, user_id, scooter_id, 1, start, None, 0.0] for i, (user_id, scooter_id) in enumerate(riders)]
+        self.session = (SESSION, LEADER, start, None, 1, 10.40174, 63.41947)
+        self.failing = set()
+        self.charged = {}
+        self.ended = []
+
+    # db
+    def get_all_scooters(self) -> list:
+        return []
+
+    def add_scooter_observer(self, callback: callable) -> None:
+        pass
+
+    async def get_active_coride(self, leader_id: int) -> tuple:
+        if self.ended:
+            return None
+        return self.session, [tuple(rental) for rental in self.rentals if rental[3]], len(self.rentals)
+
+    async def get_user(self, user_id: int) -> tuple:
+        return user_id, f"user-{user_id}", 1000.0
+
+    async def coride_ended(self, session_id: int) -> bool:
+        self.ended.append(session_id)
+        return True
+
+    # scooter_state
+    def get(self, scooter_id: int, row: tuple=None) -> tuple:
+        return scooter_id, 63.41947, 10.40174, 0
+
+    # mqtt
+    async def scooter_lock_multi_async(self, scooters: list) -> list:
+        return [(False, 7, None) if scooter["uuid"] in self.failing else (True, "lock successful", 0) for scooter in scooters]
+
+    # ledger
+    async def complete_group_async(self, rentals: list) -> list:
+        for rental_id, user_id, price, *_ in rentals:
+            rental = next(rental for rental in self.rentals if rental[0] == rental_id)
+            rental[3] = 0
+            self.charged[rental_id] = price
+        return [True] * len(rentals)
+
+    # rental_events
+    def publish(self, rental_id: int, ok: bool, status: str, final: bool=False, forward: bool=True) -> None:
+        pass
+
+
+@pytest.fixture
+def coride(monkeypatch):
+    fake = stub_coride([(1, 5), (2, 6), (3, 7)])
+    monkeypatch.setattr(database, "db", lambda *args, **kwargs: fake)
+    monkeypatch.setattr(mqtt, "mqtt_client", lambda: fake)
+    monkeypatch.setattr(transaction, "db", fake)
+    monkeypatch.setattr(transaction, "DISABLE_TRANSACTIONS", False)
+
+    service = multi_ride_service()
+    for name in ("_async_db", "_scooters", "_mqtt", "_ledger", "_events"):
+        monkeypatch.setattr(service, name, fake)
+    return service, fake
+
+
+def test_retried_lock_keeps_the_group_discount(coride):
+    service, fake = coride
+    fake.failing = {6}
+
+    ok, message, result = asyncio.run(service.lock_scooters(LEADER))
+    assert not ok and message == "2 of 3 scooters locked"
+    assert result["active"] == [6]
+    assert fake.ended == []
+
+    fake.failing = set()
+    ok, _, retried = asyncio.run(service.lock_scooters(LEADER))
+    assert ok
+    assert [rental["scooter_id"] for rental in retried["rentals"]] == [6]
+    # Priced with two coriders as the first lock was, not as a single ride
+    assert retried["price"] == pytest.approx(result["price"], abs=0.5)
+    assert fake.charged[41] == retried["price"]
+    assert fake.ended == [SESSION]
+
+
+def test_coride_without_active_rentals_is_ended(coride):
+    service, fake = coride
+    for rental in fake.rentals:
+        rental[3] = 0
+
+    ok, message, result = asyncio.run(service.lock_scooters(LEADER))
+    assert (ok, message, result) == (False, "database: rental not found", None)
+    assert fake.ended == [SESSION]
+    assert fake.charged == {}
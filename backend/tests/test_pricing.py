@@ -0,0 +1,112 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from logic import pricing
+from logic.pricing import tariff, price_rides, price_ride
+
+
+UNLOCK     = pricing.TRANSACTION_COST_UNLOCK
+PER_MINUTE = pricing.TRANSACTION_COST_PER_MINUTE
+DISCOUNT   = pricing.TRANSACTION_CORIDE_DISCOUNT_PER_EXTRA_PERSON
+
+DURATIONS = [0.0, 0.25, 1.0, 1 / 3, 7.5, 12.34, 59.99, 61.0, 240.0, 1440.0]
+CORIDERS  = [0, 1, 2, 3, 5]
+END = 1743420329.0
+
+
+# The scalar formulas of logic/transaction.py before the pricing module, which the
+# default tariff must keep charging.
+def old_single_price(minutes: float) -> float:
+    return round(UNLOCK + (minutes * PER_MINUTE), 1)
+
+
+def old_coride_price(minutes: float, num_coriders: int) -> float:
+    return UNLOCK + (minutes * PER_MINUTE) - (num_coriders * DISCOUNT)
+
+
+@pytest.mark.parametrize("minutes", DURATIONS)
+def test_price_ride_matches_old_single_price(minutes):
+    assert price_ride(minutes, end=END) == pytest.approx(old_single_price(minutes))
+
+
+@pytest.mark.parametrize("coriders", CORIDERS)
+@pytest.mark.parametrize("minutes", DURATIONS)
+def test_price_ride_matches_old_coride_price(minutes, coriders):
+    # The old formula could charge a negative price for short co-rides; prices are now
+    # never negative, and rounded like single rides.
+    expected = round(max(old_coride_price(minutes, coriders), 0.0), 1)
+    assert price_ride(minutes, coriders=coriders, end=END) == pytest.approx(expected)
+
+
+def test_price_rides_matches_old_formulas_in_one_call():
+    minutes  = np.repeat(DURATIONS, len(CORIDERS))
+    coriders = np.tile(CORIDERS, len(DURATIONS))
+    end   = END + np.arange(minutes.size) * 3600.0
+    start = end - minutes * 60.0
+
+    expected = [round(max(old_coride_price(m, int(c)), 0.0), 1) for m, c in zip(minutes, coriders)]
+    assert price_rides(start, end, coriders).tolist() == pytest.approx(expected)
+
+
+def test_price_rides_accepts_datetime64():
+    start = np.array(["2025-04-01T07:50", "2025-04-01T12:00"], dtype="datetime64")
+    end   = np.array(["2025-04-01T08:10", "2025-04-01T12:05"], dtype="datetime64")
+    rates = tariff(unlock=10, per_minute=10, coride_discount=10, utc_offset=0)
+    assert price_rides(start, end, np.array([0, 2]), rates=rates).tolist() == [210.0, 40.0]
+
+
+def test_rides_ending_before_they_start_cost_the_unlock():
+    assert price_rides([END], [END - 600.0]).tolist() == [round(float(UNLOCK), 1)]
+
+
+def test_peak_hours_only_apply_to_the_minutes_within_them():
+    # 1.5 from 08:00 to 09:00 UTC: a ride from 07:50 to 08:10 has 10 normal and 10 peak minutes
+    rates = tariff(unlock=10, per_minute=10, hourly=[1.0] * 8 + [1.5] + [1.0] * 15, utc_offset=0)
+    start = np.array(["2025-04-01T07:50"], dtype="datetime64")
+    end   = np.array(["2025-04-01T08:10"], dtype="datetime64")
+    assert price_rides(start, end, rates=rates).tolist() == [10 + 10 * (10 + 15)]
+
+
+def test_zone_multipliers():
+    rates = tariff(unlock=10, per_minute=10, zones=[1.0, 1.2], utc_offset=0)
+    assert price_rides([END - 600.0] * 2, [END] * 2, zones=[0, 1], rates=rates).tolist() == [110.0, 132.0]
+
+
+def test_invalid_tariffs():
+    with pytest.raises(ValueError):
+        tariff(hourly=[1.0] * 23)
+    with pytest.raises(ValueError):
+        tariff(zones=[])
+
+
+@pytest.fixture
+def transaction(monkeypatch):
+    pytest.importorskip("mysql.connector")
+    from logic import transaction
+    # Funds are checked against the user passed in, so no database is needed
+    monkeypatch.setattr(transaction, "db", object())
+    monkeypatch.setattr(transaction, "DISABLE_TRANSACTIONS", False)
+    return transaction
+
+
+@pytest.mark.parametrize("funds", [0.0, 10.0, 50.0, 85.0, 85.1, 1000.0])
+@pytest.mark.parametrize("minutes", [0.0, 1.0, 7.5, 30.0])
+def test_pay_for_single_ride_matches_old_transaction(transaction, minutes, funds):
+    price = old_single_price(minutes)
+    assert transaction.pay_for_single_ride({"funds": funds}, minutes) == (
+        (True, "transaction successful", price) if funds >= price else (False, "insufficient funds", price)
+    )
+
+
+@pytest.mark.parametrize("funds", [0.0, 10.0, 50.0, 85.0, 1000.0])
+@pytest.mark.parametrize("coriders", [1, 2, 3])
+@pytest.mark.parametrize("minutes", [0.0, 1.0, 7.5, 30.0])
+def test_pay_for_coride_ride_matches_old_transaction(transaction, minutes, coriders, funds):
+    users = [{"name": "alice", "funds": 1000.0}, {"name": "bob", "funds": funds}]
+    price = round(max(old_coride_price(minutes, coriders), 0.0), 1)
+
+    ok, message, charged = transaction.pay_for_coride_ride(users, minutes, coriders)
+    assert charged == pytest.approx(price)
+    assert ok == (funds >= price)
+    assert message == ("transaction successful" if ok else "insufficient funds - user: bob")
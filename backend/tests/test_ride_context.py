@@ -0,0 +1,193 @@
+import random
+import asyncio
+import logging
+import contextvars
+from threading import Lock
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+for module in ("numpy", "mysql.connector", "paho.mqtt", "requests", "httpx"):
+    pytest.importorskip(module)
+
+from api import database, mqtt
+from logic import transaction, weather
+from service.single_ride_service import single_ride_service
+
+
+USERS          = 400
+THREADS        = 4
+SCOOTER_OFFSET = 1000
+RENTAL_OFFSET  = 5000
+
+# The (user_id, scooter_id) of the ride the current task is running. Every stub checks
+# that the IDs it is called with belong to the ride which called it.
+RIDE = contextvars.ContextVar("ride")
+
+
+def scooter_of(user_id: int) -> int:
+    return SCOOTER_OFFSET + user_id
+
+
+def latitude_of(scooter_id: int) -> float:
+    return 63.0 + scooter_id * 1e-5
+
+
+def scooter_at(latitude: float) -> int:
+    return round((latitude - 63.0) / 1e-5)
+
+
+def funds_of(user_id: int) -> float:
+    return 50.0 if user_id % 5 == 0 else 1000.0
+
+
+class stubs:
+    """
+    Stand-ins for the database, scooter state, MQTT client, ledger and weather lookup.
+    Each one awaits a random delay, so that concurrent rides interleave at every step.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.rentals = {}
+        self.mismatches = []
+        self.completed = []
+
+    def check(self, where: str, user_id: int=None, scooter_id: int=None) -> None:
+        expected_user, expected_scooter = RIDE.get()
+        if (user_id is not None and user_id != expected_user) or (scooter_id is not None and scooter_id != expected_scooter):
+            with self.lock:
+                self.mismatches.append((where, (expected_user, expected_scooter), (user_id, scooter_id)))
+
+    async def pause(self) -> None:
+        await asyncio.sleep(random.random() * 0.002)
+
+    # db
+    def get_all_scooters(self) -> list:
+        return []
+
+    def add_scooter_observer(self, callback: callable) -> None:
+        pass
+
+    async def rental_precheck(self, scooter_id: int, user_id: int) -> tuple:
+        await self.pause()
+        self.check("rental_precheck", user_id, scooter_id)
+        with self.lock:
+            rental = self.rentals.get(user_id)
+        return (scooter_id, latitude_of(scooter_id), 10.4, 0), (user_id, f"user-{user_id}", funds_of(user_id)), rental, False
+
+    async def rental_started(self, user_id: int, scooter_id: int) -> bool:
+        await self.pause()
+        self.check("rental_started", user_id, scooter_id)
+        with self.lock:
+            self.rentals[user_id] = (RENTAL_OFFSET + user_id, user_id, scooter_id, 1, datetime.now() - timedelta(minutes=5), None, 0.0)
+        return True
+
+    # scooter_state
+    def get(self, scooter_id: int, row: tuple=None) -> tuple:
+        self.check("scooter_state.get", scooter_id=scooter_id)
+        return row
+
+    # mqtt
+    async def scooter_unlock_single_async(self, scooter: dict) -> tuple:
+        await self.pause()
+        self.check("scooter_unlock_single_async", scooter_id=scooter["uuid"])
+        if scooter["uuid"] % 3 == 0:
+            return False, 7, None
+        return True, "unlock successful", None
+
+    async def scooter_lock_single_async(self, scooter: dict) -> tuple:
+        await self.pause()
+        self.check("scooter_lock_single_async", scooter_id=scooter["uuid"])
+        return True, "lock successful", 0
+
+    # ledger
+    async def complete_rental_async(self, rental_id: int, user_id: int, price: float, lat: float, lon: float, status: int) -> bool:
+        await self.pause()
+        self.check("complete_rental_async", user_id, scooter_at(lat))
+        self.check("complete_rental_async", rental_id - RENTAL_OFFSET)
+        with self.lock:
+            self.completed.append(user_id)
+        return True
+
+    # rental_events
+    def publish(self, rental_id: int, ok: bool, status: str, final: bool=False, forward: bool=True) -> None:
+        self.check("publish", rental_id - RENTAL_OFFSET)
+
+    # weather
+    async def is_weather_ok_async(self, lat: float, lon: float) -> tuple:
+        await self.pause()
+        scooter_id = scooter_at(lat)
+        self.check("is_weather_ok_async", scooter_id=scooter_id)
+        if scooter_id % 7 == 0:
+            return False, "bad weather", "bad-weather"
+        return True, "acceptable conditions", ""
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    fake = stubs()
+    monkeypatch.setattr(database, "db", lambda *args, **kwargs: fake)
+    monkeypatch.setattr(mqtt, "mqtt_client", lambda: fake)
+    monkeypatch.setattr(transaction, "db", fake)
+    monkeypatch.setattr(transaction, "DISABLE_TRANSACTIONS", False)
+    monkeypatch.setattr(weather, "is_weather_ok_async", fake.is_weather_ok_async)
+
+    service = single_ride_service()
+    for name in ("_async_db", "_scooters", "_mqtt", "_ledger", "_events"):
+        monkeypatch.setattr(service, name, fake)
+    return service, fake
+
+
+def expected_failure(user_id: int) -> bool:
+    scooter_id = scooter_of(user_id)
+    return scooter_id % 7 == 0 or funds_of(user_id) < 100.0 or scooter_id % 3 == 0
+
+
+async def ride(service, user_id: int) -> tuple:
+    scooter_id = scooter_of(user_id)
+    RIDE.set((user_id, scooter_id))
+    unlocked = await service.unlock_scooter(scooter_id, user_id)
+    if not unlocked[0]:
+        return user_id, unlocked, None
+    return user_id, unlocked, await service.lock_scooter(scooter_id, user_id)
+
+
+def run_rides(service, user_ids: list) -> list:
+    async def main():
+        # Each ride is a task with its own copy of the context, hence its own RIDE
+        return await asyncio.gather(*(ride(service, user_id) for user_id in user_ids))
+    return asyncio.run(main())
+
+
+def test_concurrent_rides_keep_their_own_context(fakes, caplog):
+    service, fake = fakes
+    user_ids = list(range(1, USERS + 1))
+    random.Random(7).shuffle(user_ids)
+
+    with caplog.at_level(logging.WARNING, logger="service.single_ride_service"):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            chunks = [user_ids[i::THREADS] for i in range(THREADS)]
+            results = [result for chunk in executor.map(lambda chunk: run_rides(service, chunk), chunks) for result in chunk]
+
+    assert fake.mismatches == []
+
+    failed = set()
+    for user_id, unlocked, locked in results:
+        assert unlocked[0] != expected_failure(user_id)
+        if not unlocked[0]:
+            failed.add(user_id)
+            continue
+        assert locked[0], locked
+        rental = locked[2]
+        assert (rental["rental_id"], rental["user_id"], rental["scooter_id"]) == (RENTAL_OFFSET + user_id, user_id, scooter_of(user_id))
+    assert sorted(fake.completed) == sorted(set(range(1, USERS + 1)) - failed)
+
+    # One incident per failed unlock, carrying the user and scooter of that unlock
+    incidents = [record.incident for record in caplog.records if hasattr(record, "incident")]
+    assert sorted(incident["user-id"] for incident in incidents) == sorted(failed)
+    for incident in incidents:
+        assert incident["scooter-id"] == scooter_of(incident["user-id"])
+        if "location" in incident:
+            assert scooter_at(incident["location"]["latitude"]) == incident["scooter-id"]
@@ -0,0 +1,101 @@
+from threading import Event, Thread
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+from api import scooter_state as scooter_state_module
+from api.scooter_state import scooter_state
+
+
+class stub_db:
+    """
+    Stand-in for the scooters table. update_scooters can be held in flight, to let a
+    database write land while a flush is writing.
+    """
+
+    def __init__(self, rows: list) -> None:
+        self.table = {row[0]: row for row in rows}
+        self.observers = []
+        self.hold = False
+        self.fail = False
+        self.writing = Event()
+        self.release = Event()
+
+    def get_all_scooters(self) -> list:
+        return list(self.table.values())
+
+    def add_scooter_observer(self, callback: callable) -> None:
+        self.observers.append(callback)
+
+    def update_scooters(self, rows: list) -> bool:
+        if self.hold:
+            self.writing.set()
+            assert self.release.wait(timeout=5)
+        if self.fail:
+            return False
+        for row in rows:
+            self.table[row[0]] = row
+        return True
+
+    def write_scooter(self, scooter_id: int, lat: float, lon: float, status: int) -> None:
+        """
+        A scooter write of the db class, e.g. by complete_rentals, notifying its observers.
+        """
+        self.table[scooter_id] = (scooter_id, lat, lon, status)
+        for callback in self.observers:
+            callback(scooter_id, lat, lon, status)
+
+
+@pytest.fixture
+def state(monkeypatch):
+    # Flushed by the tests only, not by the background thread
+    monkeypatch.setattr(scooter_state_module, "SCOOTER_STATE_FLUSH_INTERVAL", 3600)
+    db = stub_db([(1, 63.41947, 10.40174, 0), (2, 63.42947, 10.39174, 0)])
+    scooters = scooter_state.__wrapped__(db)
+    yield scooters, db
+    db.release.set()
+    scooters._stopped.set()
+
+
+def test_db_write_during_a_flush_survives(state):
+    scooters, db = state
+    scooters.report(1, status=1, battery=50.0)
+    db.hold = True
+
+    flusher = Thread(target=scooters.flush)
+    flusher.start()
+    assert db.writing.wait(timeout=5)
+    # The rental is completed while the batch holding the older row is in flight
+    db.write_scooter(1, 63.5, 10.5, 0)
+    db.release.set()
+    flusher.join(timeout=5)
+
+    # The batch committed last and overwrote the write...
+    assert db.table[1] == (1, 63.41947, 10.40174, 1)
+    # ...so the scooter is dirty again, and the next flush restores it
+    db.hold = False
+    assert scooters.flush()
+    assert db.table[1] == (1, 63.5, 10.5, 0)
+    assert scooters.get(1) == (1, 63.5, 10.5, 0)
+
+
+def test_db_write_outside_a_flush_is_not_flushed_again(state):
+    scooters, db = state
+    scooters.report(2, status=1)
+    db.write_scooter(2, 63.5, 10.5, 0)
+    db.update_scooters = lambda rows: pytest.fail(f"flushed {rows}")
+    assert scooters.flush()
+    assert scooters.get(2) == (2, 63.5, 10.5, 0)
+
+
+def test_failed_flush_is_retried(state):
+    scooters, db = state
+    scooters.report(1, status=1)
+    db.fail = True
+    assert not scooters.flush()
+    assert db.table[1][3] == 0
+
+    db.fail = False
+    assert scooters.flush()
+    assert db.table[1] == (1, 63.41947, 10.40174, 1)
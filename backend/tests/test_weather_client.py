@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+import importlib.util
+
+import pytest
+
+for module in ("requests", "httpx"):
+    pytest.importorskip(module)
+
+from logic import weather_client as client_module
+from logic.weather_client import weather_client
+from tools.circuit_breaker import circuit_breaker, CLOSED, OPEN, HALF_OPEN
+
+
+# The stub MET server of the benchmarks, serving forecasts on a local port
+STUB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "benchmarks", "stub_met_server.py")
+spec = importlib.util.spec_from_file_location("stub_met_server", STUB_PATH)
+stub_met_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(stub_met_server)
+
+LAT, LON = 63.41947, 10.40174
+
+
+@pytest.fixture
+def server():
+    stub = stub_met_server.StubMetServer(port=0).start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    # weather_client is a singleton: point it at this test's server, with a fresh breaker
+    instance = weather_client()
+    monkeypatch.setattr(instance, "_url", server.url)
+    monkeypatch.setattr(instance, "breaker", circuit_breaker("weather", failures=2, reset_after=0.3))
+    monkeypatch.setattr(client_module, "WEATHER_READ_TIMEOUT", 0.2)
+    monkeypatch.setattr(instance, "_async_client", None)
+    yield instance
+    instance._session.close()
+
+
+async def fetch_async(client: weather_client, last_modified: str=None) -> tuple:
+    try:
+        return await client.get_async(LAT, LON, last_modified)
+    finally:
+        if client._async_client is not None:
+            await client._async_client.aclose()
+            client._async_client = None
+
+
+def test_get(client, server):
+    status_code, data, headers = client.get(LAT, LON)
+    assert status_code == 200
+    assert data["properties"]["timeseries"][0]["data"]["instant"]["details"]["air_temperature"] == 12.0
+    assert headers["Last-Modified"] == server.last_modified
+    assert client.breaker.state == CLOSED
+
+
+def test_get_not_modified(client, server):
+    status_code, data, _ = client.get(LAT, LON, last_modified=server.last_modified)
+    assert (status_code, data) == (304, None)
+
+
+def test_get_async(client, server):
+    status_code, data, _ = asyncio.run(fetch_async(client))
+    assert status_code == 200 and data is not None
+    status_code, data, _ = asyncio.run(fetch_async(client, server.last_modified))
+    assert (status_code, data) == (304, None)
+
+
+def test_timeouts_count_as_failures(client, server):
+    server.latency = 0.5
+    assert client.get(LAT, LON) is None
+    assert asyncio.run(fetch_async(client)) is None
+    assert client.breaker.state == OPEN
+
+
+def test_breaker_opens_then_closes_after_a_good_trial(client, server):
+    server.error_rate = 1.0
+    assert client.get(LAT, LON)[0] == 503
+    assert client.get(LAT, LON)[0] == 503
+    assert client.breaker.state == OPEN
+
+    requests = server.requests
+    assert client.get(LAT, LON) is None
+    assert server.requests == requests
+    assert client.breaker.rejected == 1
+
+    time.sleep(0.35)
+    assert client.breaker.state == HALF_OPEN
+    server.error_rate = 0.0
+    assert client.get(LAT, LON)[0] == 200
+    assert client.breaker.state == CLOSED
+
+
+def test_cancelled_trial_ends_half_open(client, server):
+    server.error_rate = 1.0
+    client.get(LAT, LON)
+    client.get(LAT, LON)
+    time.sleep(0.35)
+    assert client.breaker.state == HALF_OPEN
+
+    server.error_rate = 0.0
+    server.latency = 0.15
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(fetch_async(client))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    # The trial ended as a failure, instead of leaving the breaker half-open with no trial left
+    assert client.breaker.state == OPEN
+    time.sleep(0.35)
+    assert client.get(LAT, LON)[0] == 200
+    assert client.breaker.state == CLOSED
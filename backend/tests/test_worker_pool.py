@@ -0,0 +1,58 @@
+from threading import Event, Lock
+
+from tools.worker_pool import worker_pool, PRIORITY_HIGH
+
+
+class blocked_pool:
+    """
+    A pool of one worker, held busy until release() so that its queue fills up.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.pool = worker_pool(name="test-pool", workers=1, capacity=capacity)
+        self.ran = []
+        self._lock = Lock()
+        self._started = Event()
+        self._release = Event()
+        self.pool.submit(self._block)
+        assert self._started.wait(timeout=5)
+
+    def _block(self) -> None:
+        self._started.set()
+        self._release.wait(timeout=5)
+
+    def job(self, name: str) -> None:
+        with self._lock:
+            self.ran.append(name)
+
+    def release(self) -> None:
+        self._release.set()
+        done = Event()
+        self.pool.submit(done.set, defer=True)
+        assert done.wait(timeout=5)
+        self.pool.stop()
+
+
+def test_distress_abort_runs_when_the_pool_is_full():
+    blocked = blocked_pool(capacity=2)
+    assert blocked.pool.submit(blocked.job, "ordinary-1")
+    assert blocked.pool.submit(blocked.job, "ordinary-2")
+    assert not blocked.pool.submit(blocked.job, "rejected")
+
+    for i in range(10):
+        assert blocked.pool.submit(blocked.job, f"distress-{i}", priority=PRIORITY_HIGH)
+
+    blocked.release()
+    assert blocked.ran == [f"distress-{i}" for i in range(10)] + ["ordinary-1", "ordinary-2"]
+
+
+def test_deferred_jobs_run_once_the_queue_empties():
+    blocked = blocked_pool(capacity=2)
+    for i in range(10):
+        assert blocked.pool.submit(blocked.job, f"abort-{i}", defer=True)
+    assert blocked.pool.backlog() == 10
+    assert blocked.pool.submit(blocked.job, "distress", priority=PRIORITY_HIGH)
+
+    blocked.release()
+    assert blocked.ran[0] == "distress"
+    assert blocked.ran[1:] == [f"abort-{i}" for i in range(10)]
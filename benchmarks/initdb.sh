@@ -0,0 +1,9 @@
+#!/bin/bash
+# Applies the schema export and all migrations, in order, to the benchmark database.
+# Mounted into /docker-entrypoint-initdb.d of the MariaDB container.
+set -e
+for file in /sql/database-export.sql /sql/migrations/*.sql; do
+    [ -f "$file" ] || continue
+    echo "Applying $file"
+    mariadb -uroot -p"$MARIADB_ROOT_PASSWORD" "$MARIADB_DATABASE" < "$file"
+done
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the MQTT payload codecs (backend/app/tools/codec.py).
+
+For every message exchanged between the back-end and a scooter (unlock/lock
+commands, co-ride commands, responses and aborts), prints the payload size in
+bytes and the mean encode and decode time per message for the JSON and the
+binary codec. Runs without a broker or database:
+
+    python benchmarks/mqtt_codec.py --iterations 100000
+"""
+import sys
+import time
+import uuid
+import argparse
+from pathlib import Path
+
+
+ROOT_DIR    = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend" / "app"
+
+sys.path.insert(0, str(BACKEND_DIR))
+from tools import codec
+
+
+parser = argparse.ArgumentParser(description="Benchmark the size and speed of the MQTT payload codecs.")
+parser.add_argument("--iterations", type=int, default=50000, help="Encode/decode iterations per message (default: 50000)")
+
+
+MESSAGES = {
+    "command": {
+        "id": 1000, "request_id": uuid.uuid4().hex, "uuid": 1042, "command": "unlock",
+        "coride": False, "num_coriders": 0, "coriders": [], "timestamp": time.time()
+    },
+    "coride_command": {
+        "id": 1000, "request_id": uuid.uuid4().hex, "uuid": 1042, "command": "lock",
+        "coride": True, "num_coriders": 4, "coriders": [1043, 1044, 1045, 1046], "timestamp": time.time()
+    },
+    "response": {
+        "id": 1000, "request_id": uuid.uuid4().hex, "uuid": 1042, "battery": 87, "status": 0,
+        "abort": False, "timestamp": time.time(), "location": {"latitude": 63.41947, "longitude": 10.40174}
+    },
+    "abort": {
+        "id": 1000, "uuid": 1042, "battery": 40, "status": 4,
+        "abort": True, "timestamp": time.time(), "location": {"latitude": 63.41947, "longitude": 10.40174}
+    },
+}
+
+
+
+def measure(message: dict, used: int, iterations: int) -> tuple[int, float, float]:
+    """
+    Returns the payload size in bytes and the mean encode and decode time in microseconds.
+    """
+    payload = codec.encode(message, used)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(message, used)
+    encode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(payload)
+    decode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    return len(payload), encode_us, decode_us
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    print(f"{'message':<16} {'codec':<7} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for name, message in MESSAGES.items():
+        sizes = {}
+        for label, used in codec.CODECS.items():
+            size, encode_us, decode_us = measure(message, used, args.iterations)
+            sizes[label] = size
+            print(f"{name:<16} {label:<7} {size:>6} {encode_us:>10.2f} {decode_us:>10.2f}")
+        print(f"{'':<16} {'ratio':<7} {sizes['binary'] / sizes['json']:>6.2f}")
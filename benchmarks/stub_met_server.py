@@ -0,0 +1,142 @@
+"""
+Stub of the MET locationforecast API for local benchmarks and tests.
+
+Answers every GET with a minimal compact forecast in the same JSON format as
+api.met.no, including Expires and Last-Modified headers, replies
+304 Not Modified to conditional requests and gzips the body when asked to.
+A share of the requests can be failed, to exercise the back-end's circuit
+breaker. Point the back-end at it with:
+
+    WEATHER_API_URL="http://127.0.0.1:8900/weatherapi/locationforecast/2.0/compact"
+
+Usage:
+    python benchmarks/stub_met_server.py --port 8900 --temperature 12 --latency 80
+    python benchmarks/stub_met_server.py --latency 5000        # slower than the read timeout
+    python benchmarks/stub_met_server.py --error-rate 1        # upstream down
+"""
+import gzip
+import json
+import random
+import time
+import argparse
+import threading
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubMetHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the stub forecast. Settings are read from the server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        headers = {
+            "Expires": formatdate(time.time() + server.ttl, usegmt=True),
+            "Last-Modified": server.last_modified,
+        }
+
+        if self.headers.get("If-Modified-Since") == server.last_modified:
+            self.send_response(304)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps(server.forecast()).encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubMetServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for the stub forecast.
+    Args:
+        port (int): Port to listen on.
+        temperature (float): Air temperature reported in every forecast.
+        latency (float): Seconds to wait before answering, emulating the real API.
+        ttl (float): Seconds until the forecast expires.
+        error_rate (float): Share of requests answered with 503 Service Unavailable.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=8900, temperature=12.0, latency=0.0, ttl=3600.0, error_rate=0.0):
+        super().__init__(("127.0.0.1", port), StubMetHandler)
+        self.temperature = temperature
+        self.latency = latency
+        self.ttl = ttl
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/weatherapi/locationforecast/2.0/compact"
+
+    def forecast(self):
+        return {
+            "type": "Feature",
+            "properties": {
+                "timeseries": [{
+                    "time": time.strftime("%Y-%m-%dT%H:00:00Z", time.gmtime()),
+                    "data": {
+                        "instant": {
+                            "details": {
+                                "air_temperature": self.temperature,
+                                "relative_humidity": 72.4
+                            }
+                        }
+                    }
+                }]
+            }
+        }
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, name="stub-met", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub of the MET locationforecast API.")
+    parser.add_argument("--port",        type=int,   default=8900, help="Port to listen on (default: 8900)")
+    parser.add_argument("--temperature", type=float, default=12.0, help="Reported air temperature (default: 12.0)")
+    parser.add_argument("--latency",     type=float, default=0.0,  help="Response latency in ms (default: 0)")
+    parser.add_argument("--ttl",         type=float, default=3600, help="Seconds until forecasts expire (default: 3600)")
+    parser.add_argument("--error-rate",  type=float, default=0.0,  help="Share of requests failed with 503 (default: 0)")
+    args = parser.parse_args()
+
+    server = StubMetServer(args.port, args.temperature, args.latency / 1000.0, args.ttl, args.error_rate)
+    print(f"Serving stub MET API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
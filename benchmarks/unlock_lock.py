@@ -0,0 +1,448 @@
+"""
+End-to-end benchmark of the unlock/lock hot path.
+
+Drives concurrent unlock -> ride -> lock cycles through the HTTP API
+(/api/v1/scooter/{uuid}/single-unlock and /single-lock), which exercises
+single_ride_service, MySQL, MQTT, the scooter's reply and the rental rows.
+Every stage is additionally measured in isolation:
+
+    * db_precheck:    database.db.rental_precheck against the benchmark database
+    * mqtt_roundtrip: command -> virtual scooter -> response over the broker
+    * weather_fetch:  one request to the (stub) MET API
+    * http_unlock, http_lock, http_cycle: the full HTTP path
+
+Latency percentiles (p50/p95/p99) and throughput of every stage are printed
+and written as JSON to benchmarks/results/, so that runs can be compared
+between commits with --compare.
+
+Every lock response is checked to belong to the user and scooter of the
+request, so cross-request leakage shows up as "leaks" in the results.
+
+Local stand-ins:
+    docker compose -f benchmarks/docker-compose.bench.yaml up -d   # MariaDB + Mosquitto
+
+    python benchmarks/unlock_lock.py --start-met --start-fleet --start-backend \\
+        --concurrency 50 --cycles 10
+
+Requires the back-end requirements (backend/requirements.txt) to be installed.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import subprocess
+import statistics
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import mysql.connector
+import paho.mqtt.client as mqtt
+
+from stub_met_server import StubMetServer
+
+
+ROOT_DIR    = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend" / "app"
+SCOOTER_DIR = ROOT_DIR / "e-scooter"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+BENCH_SERVER_ID = 2000
+
+
+parser = argparse.ArgumentParser(description="Benchmark the unlock/lock flow end to end.")
+parser.add_argument("--url",           type=str,   default="http://127.0.0.1:8080", help="Back-end base URL")
+parser.add_argument("--concurrency",   type=int,   default=20,    help="Number of concurrent riders (default: 20)")
+parser.add_argument("--cycles",        type=int,   default=5,     help="Unlock/lock cycles per rider (default: 5)")
+parser.add_argument("--ride",          type=float, default=0.5,   help="Seconds between unlock and lock (default: 0.5)")
+parser.add_argument("--first-id",      type=int,   default=1000,  help="First user/scooter ID used by the benchmark (default: 1000)")
+parser.add_argument("--stage-samples", type=int,   default=200,   help="Samples per isolated stage (default: 200)")
+parser.add_argument("--db-host",       type=str,   default="127.0.0.1")
+parser.add_argument("--db-user",       type=str,   default="bench")
+parser.add_argument("--db-password",   type=str,   default="bench")
+parser.add_argument("--db-name",       type=str,   default="ttm4115-team-16-test-db")
+parser.add_argument("--mqtt-host",     type=str,   default="127.0.0.1")
+parser.add_argument("--mqtt-port",     type=int,   default=1883)
+parser.add_argument("--met-url",       type=str,   default=None,  help="MET API URL, defaults to the stub server")
+parser.add_argument("--met-latency",   type=float, default=80,    help="Latency of the stub MET server in ms (default: 80)")
+parser.add_argument("--start-met",     action="store_true", help="Start the stub MET server in-process")
+parser.add_argument("--start-fleet",   action="store_true", help="Start the fleet simulator for the benchmark scooters")
+parser.add_argument("--start-backend", action="store_true", help="Start the back-end against the local stand-ins")
+parser.add_argument("--workers",       type=int,   default=1,     help="Worker processes of the started back-end (default: 1)")
+parser.add_argument("--output",        type=str,   default=None,  help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+parser.add_argument("--compare",       type=str,   default=None,  help="Earlier result file to compare against")
+
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    Nearest-rank percentile of a list of samples.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+
+class Stage:
+    """
+    Collects latency samples and errors of one benchmark stage.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.samples = []
+        self.errors = 0
+        self.leaks = 0
+        self.started = None
+        self.ended = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool=True) -> None:
+        with self._lock:
+            now = time.perf_counter()
+            self.started = self.started or now - seconds
+            self.ended = now
+            if ok:
+                self.samples.append(seconds)
+            else:
+                self.errors += 1
+
+    def summary(self) -> dict:
+        wall = (self.ended - self.started) if self.samples else 0
+        ms = [sample * 1000.0 for sample in self.samples]
+        return {
+            "count": len(ms),
+            "errors": self.errors,
+            "leaks": self.leaks,
+            "p50_ms": percentile(ms, 50),
+            "p95_ms": percentile(ms, 95),
+            "p99_ms": percentile(ms, 99),
+            "mean_ms": statistics.fmean(ms) if ms else None,
+            "throughput_per_s": len(ms) / wall if wall > 0 else None,
+        }
+
+
+
+def db_config(args) -> dict:
+    return {
+        "host": args.db_host,
+        "user": args.db_user,
+        "password": args.db_password,
+        "database": args.db_name,
+        "port": 3306,
+    }
+
+
+
+def seed(args) -> None:
+    """
+    Create (or reset) the users and scooters used by the benchmark.
+    Funds are deposited through the transactions ledger, which the back-end rebuilds the
+    balances from on start-up.
+    """
+    ids = list(range(args.first_id, args.first_id + args.concurrency))
+    run = uuid.uuid4().hex[:12]
+    conn = mysql.connector.connect(**db_config(args))
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO users (id, name, funds) VALUES (%s, %s, 0) ON DUPLICATE KEY UPDATE name = VALUES(name)",
+        [(i, f"bench-user-{i}") for i in ids]
+    )
+    cursor.executemany(
+        "INSERT INTO transactions (user_id, rental_id, amount, kind, idempotency_key) VALUES (%s, NULL, 1000000, 'deposit', %s)",
+        [(i, f"bench-{run}-{i}") for i in ids]
+    )
+    cursor.execute(
+        "UPDATE users SET funds = funds + 1000000 WHERE id BETWEEN %s AND %s",
+        (ids[0], ids[-1])
+    )
+    cursor.executemany(
+        "INSERT INTO scooters (uuid, latitude, longtitude, status) VALUES (%s, %s, %s, 0) "
+        "ON DUPLICATE KEY UPDATE status = 0",
+        [(i, 63.4197 + random.uniform(-0.02, 0.02), 10.4018 + random.uniform(-0.02, 0.02)) for i in ids]
+    )
+    cursor.execute(
+        "UPDATE rentals SET is_active = 0 WHERE user_id BETWEEN %s AND %s OR scooter_id BETWEEN %s AND %s",
+        (ids[0], ids[-1], ids[0], ids[-1])
+    )
+    cursor.close()
+    conn.close()
+
+
+
+def start_fleet(args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable, "simulate.py",
+            f"--count={args.concurrency}", f"--first-id={args.first_id}",
+            f"--host={args.mqtt_host}", f"--port={args.mqtt_port}",
+            "--latency=20", "--jitter=5", "--battery", "50", "100",
+        ],
+        cwd=SCOOTER_DIR
+    )
+
+
+
+def start_backend(args, met_url: str) -> subprocess.Popen:
+    port = httpx.URL(args.url).port or 8080
+    env = {
+        **os.environ,
+        "DEPLOYMENT_MODE": "TEST",
+        "HTTP_PORT_TEST": str(port),
+        "MQTT_HOST_TEST": args.mqtt_host,
+        "MQTT_PORT_TEST": str(args.mqtt_port),
+        "MQTT_TOPIC_INPUT_TEST": "escooter/response/#",
+        "MQTT_TOPIC_OUTPUT_TEST": "escooter/command",
+        "DB_HOST": args.db_host,
+        "DB_USER": args.db_user,
+        "DB_PASSWORD": args.db_password,
+        "DB_NAME": args.db_name,
+        "WEATHER_API_URL": met_url,
+        "WEATHER_API_USER_AGENT": "e-scooter-benchmark",
+    }
+    return subprocess.Popen(
+        [sys.executable, "__main__.py", "--host=127.0.0.1", f"--workers={args.workers}"], cwd=BACKEND_DIR, env=env
+    )
+
+
+
+async def wait_for_backend(url: str, timeout: float=60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{url}/api/v1/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Back-end at {url} did not become ready within {timeout} seconds")
+
+
+
+def bench_db(args, stage: Stage) -> None:
+    """
+    Measure the unlock precheck query in isolation, with the back-end's own db class.
+    """
+    sys.path.insert(0, str(BACKEND_DIR))
+    from api import database
+
+    client = database.db(db_config(args))
+    ids = list(range(args.first_id, args.first_id + args.concurrency))
+
+    def query(_):
+        scooter_id = random.choice(ids)
+        started = time.perf_counter()
+        try:
+            client.rental_precheck(scooter_id, scooter_id)
+            stage.record(time.perf_counter() - started)
+        except Exception:
+            stage.record(time.perf_counter() - started, ok=False)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(query, range(args.stage_samples)))
+
+
+
+def bench_mqtt(args, stage: Stage) -> None:
+    """
+    Measure the command/response round-trip to the virtual scooters over the broker.
+    """
+    sys.path.insert(0, str(BACKEND_DIR))
+    from tools import codec
+
+    pending = {}
+    lock = threading.Lock()
+
+    def on_message(client, userdata, msg):
+        try:
+            message, _ = codec.decode(msg.payload)
+        except codec.codec_error:
+            return
+        with lock:
+            entry = pending.pop(message.get("request_id"), None)
+        if entry is not None:
+            entry[1] = time.perf_counter()
+            entry[2].set()
+
+    client = mqtt.Client(client_id=f"bench-{uuid.uuid4().hex[:8]}")
+    client.on_message = on_message
+    client.connect(args.mqtt_host, args.mqtt_port)
+    client.subscribe("escooter/response/#")
+    client.loop_start()
+
+    def roundtrip(index):
+        scooter_id = args.first_id + index % args.concurrency
+        for command in ("unlock", "lock"):
+            request_id = uuid.uuid4().hex
+            entry = [time.perf_counter(), None, threading.Event()]
+            with lock:
+                pending[request_id] = entry
+            client.publish(f"escooter/command/{scooter_id}", json.dumps({
+                "id": BENCH_SERVER_ID, "request_id": request_id, "uuid": scooter_id, "command": command,
+                "coride": False, "num_coriders": 0, "coriders": [], "timestamp": time.time()
+            }))
+            if entry[2].wait(timeout=10):
+                stage.record(entry[1] - entry[0])
+            else:
+                stage.record(10, ok=False)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(roundtrip, range(args.stage_samples // 2)))
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+
+async def bench_weather(args, met_url: str, stage: Stage) -> None:
+    """
+    Measure one uncached request to the (stub) MET API.
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient() as client:
+        async def fetch():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(
+                        f"{met_url}?lat={random.uniform(58, 70):.2f}&lon={random.uniform(5, 30):.2f}",
+                        headers={"User-Agent": "e-scooter-benchmark"}
+                    )
+                    stage.record(time.perf_counter() - started, response.status_code == 200)
+                except httpx.HTTPError:
+                    stage.record(time.perf_counter() - started, ok=False)
+        await asyncio.gather(*(fetch() for _ in range(args.stage_samples)))
+
+
+
+async def bench_http(args, stages: dict) -> None:
+    """
+    Drive unlock -> ride -> lock cycles through the HTTP API, one rider per scooter.
+    """
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"{args.url}/api/v1", timeout=60, limits=limits) as client:
+
+        async def rider(index):
+            user_id = scooter_id = args.first_id + index
+            for _ in range(args.cycles):
+                started = time.perf_counter()
+                response = await client.post(f"/scooter/{scooter_id}/single-unlock", params={"user_id": user_id})
+                unlocked = time.perf_counter()
+                stages["http_unlock"].record(unlocked - started, response.status_code == 200)
+                if response.status_code != 200:
+                    continue
+
+                await asyncio.sleep(args.ride)
+
+                lock_started = time.perf_counter()
+                response = await client.post(f"/scooter/{scooter_id}/single-lock", params={"user_id": user_id})
+                ended = time.perf_counter()
+                ok = response.status_code == 200
+                stages["http_lock"].record(ended - lock_started, ok)
+                stages["http_cycle"].record((unlocked - started) + (ended - lock_started), ok)
+
+                rental = response.json().get("message") if ok else None
+                if ok and (str(rental.get("user_id")) != str(user_id) or str(rental.get("scooter_id")) != str(scooter_id)):
+                    stages["http_lock"].leaks += 1
+
+        await asyncio.gather(*(rider(index) for index in range(args.concurrency)))
+
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+
+def report(results: dict, baseline: dict=None) -> None:
+    print(f"\n{'stage':<16}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for name, summary in results["stages"].items():
+        row = f"{name:<16}{summary['count']:>8}{summary['errors']:>8}"
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+            value = summary[key]
+            row += f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+        print(row)
+        if baseline and name in baseline.get("stages", {}):
+            before = baseline["stages"][name].get("p95_ms")
+            if before and summary["p95_ms"]:
+                print(f"{'':<16}p95 vs {baseline['commit']}: {100.0 * (summary['p95_ms'] - before) / before:+.1f}%")
+        if summary["leaks"]:
+            print(f"{'':<16}WARNING: {summary['leaks']} responses belonged to another request")
+
+
+
+async def main(args) -> dict:
+    met_server = None
+    processes = []
+    met_url = args.met_url
+    if args.start_met or met_url is None:
+        met_server = StubMetServer(port=0, latency=args.met_latency / 1000.0).start()
+        met_url = met_server.url
+
+    stages = {name: Stage(name) for name in (
+        "db_precheck", "mqtt_roundtrip", "weather_fetch", "http_unlock", "http_lock", "http_cycle"
+    )}
+
+    try:
+        seed(args)
+        if args.start_fleet:
+            processes.append(start_fleet(args))
+        if args.start_backend:
+            processes.append(start_backend(args, met_url))
+        await wait_for_backend(args.url)
+
+        await asyncio.to_thread(bench_db, args, stages["db_precheck"])
+        await asyncio.to_thread(bench_mqtt, args, stages["mqtt_roundtrip"])
+        await bench_weather(args, met_url, stages["weather_fetch"])
+        await bench_http(args, stages)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if met_server is not None:
+            met_server.shutdown()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "concurrency": args.concurrency,
+            "cycles": args.cycles,
+            "ride_s": args.ride,
+            "stage_samples": args.stage_samples,
+            "met_latency_ms": args.met_latency if met_server is not None else None,
+        },
+        "stages": {name: stage.summary() for name, stage in stages.items()},
+    }
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{results['commit']}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    report(results, baseline)
+    print(f"\nResults written to {output}")
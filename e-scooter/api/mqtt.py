@@ -1,23 +1,31 @@
+import os
 import sys
 import time
-import json
 import logging
 import paho.mqtt.client as mqtt
 
+from tools import codec
 from tools.observer import State
 from tools.singleton import singleton
 
 
+# Preferred payload encoding, [binary|json]. Binary is only used once the server advertises it.
+MQTT_CODEC = codec.CODECS[os.getenv("MQTT_CODEC", "binary").lower()]
+
+
 @singleton
 class MQTTClient:
     """
     MQTTClient class to handle MQTT communication.
     It connects to the MQTT broker and subscribes to topics.
     It also handles incoming messages and sends responses.
+    Payloads are encoded with tools.codec: JSON until the server shows that it
+    decodes the binary codec, binary from then on (unless MQTT_CODEC=json).
     """
     def __init__(self, host=None, port=None):
         self._logger = logging.getLogger(__name__)
         self._state = State()
+        self._codec = codec.CODEC_JSON
         if (host!=None and port!=None):
             self.client = mqtt.Client()
             self._start(host, port)
@@ -47,22 +55,29 @@ class MQTTClient:
         """
         Callback function to handle incoming messages.
         """
-        payload_str = msg.payload.decode()
-        payload = json.loads(payload_str)
+        try:
+            payload, received = codec.decode(msg.payload)
+        except codec.codec_error as e:
+            self._logger.error(f"Could not decode message: {e}")
+            return
+        self._codec = codec.negotiate(MQTT_CODEC, payload, received)
 
         self._server_id = payload["id"]
+        self._request_id = payload.get("request_id")
         self._scooter_id = payload["uuid"]
         self._command = payload["command"]
         self._coride = payload["coride"]
+        # Answer the server process which sent the command, if it named one
+        reply_topic = payload.get("reply_to") or f"escooter/response/{self._scooter_id}"
 
 
         if self._command == "unlock":
             response = self._build_response()
-            self.publish(f"escooter/response/{self._scooter_id}", response)
+            self.publish(reply_topic, response)
             self._state.set("unlock")
         elif self._command == "lock":
             response = self._build_response()
-            self.publish(f"escooter/response/{self._scooter_id}", response)
+            self.publish(reply_topic, response)
             self._state.set("lock")
         else:
             self._logger.error("Unknown command received:", self._command)
@@ -71,6 +86,7 @@ class MQTTClient:
     def _build_response(self):
         response = {
             "id": self._server_id,
+            "request_id": self._request_id,
             "uuid": self._scooter_id,
             "battery": 100,
             "status": 0,
@@ -84,7 +100,7 @@ class MQTTClient:
         return response
         
     def publish(self, topic, message):
-        self.client.publish(topic, json.dumps(message)) 
+        self.client.publish(topic, codec.encode(message, self._codec))
 
     def subscribe(self, topic):
         self.client.subscribe(topic)
@@ -2,6 +2,7 @@ import logging
 
 from tools.observer import State
 from tools.singleton import singleton
+from controller.TemperatureSampler import TemperatureSampler, TEMPERATURE_INVALID
 
 
 
@@ -78,6 +79,7 @@ class MainController:
         self._first_unlock = True
         self.logger = logging.getLogger(__name__)
         self.active_crash = False
+        self.temperature_sampler = None
         self._state = State()
 
     def set_mqtt_client(self, mqtt_client):
@@ -92,6 +94,9 @@ class MainController:
     def setSense(self, controller_sense_hat):
         self.controller_sense_hat = controller_sense_hat
         self.controller_sense_hat.set_pixels(dott_red)
+        self.temperature_sampler = TemperatureSampler(self.controller_sense_hat.check_temperature, self.on_temperature_crossing)
+        if not self.locked:
+            self.temperature_sampler.start()
 
 
     def notify(self):
@@ -100,8 +105,6 @@ class MainController:
             self.unlock()
         elif event == "lock":
             self.lock()
-        elif event == "awaiting-weather-report":
-            self.request_temperature()
 
 
     def unlock(self):
@@ -116,6 +119,8 @@ class MainController:
             initializer.init_driver()
             self._first_unlock = False
         self.driver.start()
+        if self.temperature_sampler is not None:
+            self.temperature_sampler.start()
 
     def lock(self):
         """
@@ -123,19 +128,20 @@ class MainController:
         """
         self.controller_sense_hat.lock_escooter(dott_red)
         self.locked = True
+        if self.temperature_sampler is not None:
+            self.temperature_sampler.stop()
         self.driver.stop()
 
     def is_locked(self):
         return self.locked
 
-    def request_temperature(self):
+    def on_temperature_crossing(self, crossing):
         """
-        Request a temperature analysis from the sense-hat controller and analyse it.
+        Called by the temperature sampler when the smoothed temperature crosses the
+        threshold. Only a drop below it is sent to the weather-lock state machine.
         """
-        temperature = self.controller_sense_hat.check_temperature()
-        message = "temperature_valid" if temperature >= 2 else "temperature_invalid"
-        self.logger.debug(f"Temperature: {temperature}°C - {message}")
-        self.driver.send(message, "weather_lock")
+        if crossing == TEMPERATURE_INVALID and not self.locked:
+            self.driver.send(crossing, "weather_lock")
 
     def sendTemperature(self):
         self.driver.send("lock", "weather_lock")
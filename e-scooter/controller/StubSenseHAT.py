@@ -0,0 +1,45 @@
+import random
+import logging
+
+
+class StubSenseHAT:
+    """
+    Stand-in for the SenseHAT controller, used when no Sense HAT is attached
+    (e.g. when simulating a fleet of scooters).
+    It offers the same interface as SenseHAT, but the LED matrix calls do nothing and
+    the temperature is a random walk around a configurable base temperature.
+    """
+
+    def __init__(self, temperature: float=10.0, drift: float=0.2):
+        self._logger = logging.getLogger(__name__)
+        self._temperature = temperature
+        self._drift = drift
+        self.controller = None
+
+    def set_controller(self, controller):
+        self.controller = controller
+
+    def check_temperature(self):
+        self._temperature += random.uniform(-self._drift, self._drift)
+        return self._temperature
+
+    def set_temperature(self, temperature):
+        self._temperature = temperature
+
+    def sos(self):
+        pass
+
+    def stop_sos(self):
+        pass
+
+    def unlock_escooter(self):
+        pass
+
+    def lock_escooter(self, pixels=None):
+        pass
+
+    def set_pixels(self, pixels):
+        pass
+
+    def clear(self):
+        pass
@@ -0,0 +1,120 @@
+import os
+import logging
+import statistics
+from collections import deque
+from threading import Thread, Event, current_thread
+
+
+TEMPERATURE_SAMPLE_INTERVAL = float(os.getenv("TEMPERATURE_SAMPLE_INTERVAL", 3.0))
+TEMPERATURE_WINDOW          = int(os.getenv("TEMPERATURE_WINDOW", 5))
+TEMPERATURE_THRESHOLD       = float(os.getenv("TEMPERATURE_THRESHOLD", 2.0))
+TEMPERATURE_HYSTERESIS      = float(os.getenv("TEMPERATURE_HYSTERESIS", 1.0))
+
+TEMPERATURE_VALID   = "temperature_valid"
+TEMPERATURE_INVALID = "temperature_invalid"
+
+
+class TemperatureFilter:
+    """
+    Turns raw temperature readings into threshold crossings.
+    The last `window` readings are kept in a ring buffer and smoothed by their median,
+    so a single noisy reading cannot move the result. The temperature becomes invalid
+    when the median drops below `threshold`, and valid again only once it has risen to
+    `threshold + hysteresis`, so a temperature hovering around the threshold does not
+    flip back and forth. No decision is made before half the window is filled.
+    """
+
+    def __init__(self, window=TEMPERATURE_WINDOW, threshold=TEMPERATURE_THRESHOLD, hysteresis=TEMPERATURE_HYSTERESIS):
+        self._readings = deque(maxlen=max(1, window))
+        self._threshold = threshold
+        self._hysteresis = max(0.0, hysteresis)
+        self.valid = True
+
+    def add(self, reading):
+        """
+        Add a reading. Returns TEMPERATURE_INVALID or TEMPERATURE_VALID on a crossing,
+        None otherwise.
+        """
+        self._readings.append(reading)
+        if len(self._readings) < self._readings.maxlen // 2 + 1:
+            return None
+
+        smoothed = statistics.median(self._readings)
+        if self.valid and smoothed < self._threshold:
+            self.valid = False
+            return TEMPERATURE_INVALID
+        if not self.valid and smoothed >= self._threshold + self._hysteresis:
+            self.valid = True
+            return TEMPERATURE_VALID
+        return None
+
+    def smoothed(self):
+        """
+        The current smoothed temperature, or None if there are no readings.
+        """
+        return statistics.median(self._readings) if self._readings else None
+
+    def reset(self):
+        """
+        Forget the readings, e.g. at the start of a new session.
+        """
+        self._readings.clear()
+        self.valid = True
+
+
+class TemperatureSampler:
+    """
+    Samples the temperature sensor on a background thread every
+    TEMPERATURE_SAMPLE_INTERVAL seconds, and calls back only when the filtered
+    temperature crosses the threshold (see TemperatureFilter). Replaces polling
+    through the weather_lock state machine, which woke the driver and every state
+    observer for each reading.
+    """
+
+    def __init__(self, read_temperature, on_crossing, interval=TEMPERATURE_SAMPLE_INTERVAL, temperature_filter=None):
+        """
+        Args:
+            read_temperature: Returns the current temperature in °C, e.g. SenseHAT.check_temperature.
+            on_crossing: Called with TEMPERATURE_INVALID or TEMPERATURE_VALID on a crossing.
+            interval: Seconds between readings.
+            temperature_filter: The TemperatureFilter to use, a default one if None.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._read_temperature = read_temperature
+        self._on_crossing = on_crossing
+        self._interval = max(0.1, interval)
+        self._filter = temperature_filter if temperature_filter is not None else TemperatureFilter()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start sampling with an empty buffer. Does nothing if already sampling.
+        """
+        if self._thread is not None:
+            return
+        self._filter.reset()
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name="temperature-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            if self._thread is not current_thread():
+                self._thread.join(timeout=self._interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                crossing = self._filter.add(self._read_temperature())
+                if crossing is not None:
+                    self._logger.debug(f"Temperature: {self._filter.smoothed():.1f}°C - {crossing}")
+                    self._on_crossing(crossing)
+            except Exception as e:
+                self._logger.error(f"Error sampling temperature: {e}")
+            self._stopped.wait(self._interval)
@@ -0,0 +1,82 @@
+import time
+import logging
+import argparse
+from colorlog import ColoredFormatter
+
+from simulator.Fleet import Fleet
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description="Simulate a fleet of e-scooters without Sense HAT hardware.")
+parser.add_argument("--count",       type=int,   default=100,              help="Number of virtual scooters (default: 100)")
+parser.add_argument("--first-id",    type=int,   default=1,                help="Scooter ID of the first virtual scooter (default: 1)")
+parser.add_argument("--host",        type=str,   default="127.0.0.1",      help="MQTT broker host (default: 127.0.0.1)")
+parser.add_argument("--port",        type=int,   default=1883,             help="MQTT broker port (default: 1883)")
+parser.add_argument("--connections", type=int,   default=4,                help="Number of shared MQTT connections (default: 4)")
+parser.add_argument("--latency",     type=float, default=50,               help="Mean response latency in ms (default: 50)")
+parser.add_argument("--jitter",      type=float, default=20,               help="Standard deviation of the response latency in ms (default: 20)")
+parser.add_argument("--battery",     type=float, nargs=2, default=[20, 100], help="Range of initial battery levels (default: 20 100)")
+parser.add_argument("--low-battery", type=float, default=0.0,              help="Share of scooters starting with low battery (default: 0.0)")
+parser.add_argument("--abort-rate",  type=float, default=0.0,              help="Probability of an abort per minute of riding (default: 0.0)")
+parser.add_argument("--distress",    type=float, default=0.1,              help="Share of aborts that are distress aborts (default: 0.1)")
+parser.add_argument("--temperature", type=float, default=10.0,             help="Base temperature of the stub Sense HAT (default: 10.0)")
+parser.add_argument("--codec",       type=str,   default="binary",         choices=["binary", "json"], help="Preferred payload encoding (default: binary)")
+parser.add_argument("--report",      type=float, default=10.0,             help="Seconds between statistics reports (default: 10)")
+args = parser.parse_args()
+
+if args.count <= 0 or args.first_id <= 0:
+    print("Error: --count and --first-id must be positive integers.")
+    exit(1)
+
+formatter = ColoredFormatter(
+    "%(log_color)s[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d in %(funcName)s()] %(message)s",
+    datefmt="%H:%M:%S",
+    log_colors={
+        'DEBUG':    'green',
+        'INFO':     'cyan',
+        'WARNING':  'yellow',
+        'ERROR':    'red',
+        'CRITICAL': 'bold_red',
+    }
+)
+
+
+def setup_logging():
+    """
+    Set up logging with colored output.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger = logging.getLogger()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    return logger
+
+
+if __name__ == "__main__":
+    logger = setup_logging()
+
+    fleet = Fleet(
+        host=args.host,
+        port=args.port,
+        count=args.count,
+        first_id=args.first_id,
+        connections=args.connections,
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        battery=tuple(args.battery),
+        low_battery_rate=args.low_battery,
+        abort_rate=args.abort_rate,
+        distress_share=args.distress,
+        temperature=args.temperature,
+        preferred_codec=args.codec
+    )
+    fleet.start()
+
+    try:
+        while True:
+            time.sleep(args.report)
+            logger.info(f"Fleet: {fleet.stats()}")
+    except KeyboardInterrupt:
+        fleet.stop()
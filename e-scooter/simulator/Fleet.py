@@ -0,0 +1,141 @@
+import random
+import logging
+import paho.mqtt.client as mqtt
+
+from tools import codec
+from tools.scheduler import Scheduler
+from controller.StubSenseHAT import StubSenseHAT
+from simulator.VirtualScooter import VirtualScooter
+
+
+SUBSCRIBE_BATCH = 500
+
+
+class Fleet:
+    """
+    Hosts a fleet of virtual scooters in one process.
+    The scooters are spread over a small number of shared MQTT connections, each
+    subscribed to the command topics of its share of the fleet. Commands are answered
+    after a configurable latency, and unlocked scooters are ticked once per tick
+    interval to drain their battery and randomly abort their session.
+    All simulation work runs on a single scheduler thread, so the scooters' state
+    needs no locking.
+    Every scooter negotiates its payload codec with the server on its own, preferring
+    the given codec ("binary" or "json").
+    """
+
+    def __init__(
+            self,
+            host,
+            port,
+            count,
+            first_id=1,
+            connections=4,
+            latency=0.05,
+            jitter=0.02,
+            battery=(20, 100),
+            low_battery_rate=0.0,
+            abort_rate=0.0,
+            distress_share=0.1,
+            temperature=10.0,
+            location=(63.4197, 10.4018),
+            spread=0.02,
+            tick=1.0,
+            preferred_codec="binary"
+    ):
+        self._logger = logging.getLogger(__name__)
+        self._host = host
+        self._port = port
+        self._latency = latency
+        self._jitter = jitter
+        self._abort_rate = abort_rate
+        self._distress_share = distress_share
+        self._tick_interval = tick
+        self._codec = codec.CODECS[preferred_codec]
+        self._scheduler = Scheduler(name="fleet-scheduler")
+        self._clients = []
+        self._stats = {"commands": 0, "responses": 0, "aborts": 0}
+
+        self.scooters = {}
+        for scooter_id in range(first_id, first_id + count):
+            charge = random.uniform(1, 15) if random.random() < low_battery_rate else random.uniform(*battery)
+            position = (
+                round(location[0] + random.uniform(-spread, spread), 5),
+                round(location[1] + random.uniform(-spread, spread), 5)
+            )
+            sense_hat = StubSenseHAT(temperature=temperature)
+            self.scooters[scooter_id] = VirtualScooter(scooter_id, charge, position, sense_hat)
+
+        self._connections = max(1, min(connections, count))
+
+    def start(self):
+        """
+        Connect to the broker and start answering commands.
+        """
+        ids = sorted(self.scooters)
+        for index in range(self._connections):
+            client = mqtt.Client(client_id=f"fleet-simulator-{ids[0]}-{index}")
+            client.on_message = self._on_message
+            client.connect(self._host, self._port)
+            client.loop_start()
+
+            shard = ids[index::self._connections]
+            for start in range(0, len(shard), SUBSCRIBE_BATCH):
+                batch = shard[start:start + SUBSCRIBE_BATCH]
+                client.subscribe([(f"escooter/command/{scooter_id}", 0) for scooter_id in batch])
+            self._clients.append(client)
+
+        self._logger.info(f"Simulating {len(self.scooters)} scooters over {self._connections} MQTT connections")
+        self._scheduler.call_later(self._tick_interval, self._tick)
+
+    def stop(self):
+        self._scheduler.stop()
+        for client in self._clients:
+            client.loop_stop()
+            client.disconnect()
+
+    def stats(self):
+        unlocked = sum(1 for scooter in self.scooters.values() if not scooter.locked)
+        return {**self._stats, "unlocked": unlocked}
+
+    def _client_for(self, scooter_id):
+        ids_offset = scooter_id - min(self.scooters)
+        return self._clients[ids_offset % self._connections]
+
+    def _on_message(self, client, userdata, msg):
+        """
+        Runs on the paho network thread: decode and schedule the response.
+        """
+        try:
+            payload, received = codec.decode(msg.payload)
+            scooter = self.scooters[int(msg.topic.rsplit("/", 1)[1])]
+        except (ValueError, KeyError) as e:
+            self._logger.error(f"Ignoring message on {msg.topic}: {e}")
+            return
+
+        delay = max(0.0, random.gauss(self._latency, self._jitter))
+        self._scheduler.call_later(delay, self._respond, client, scooter, payload, received)
+
+    def _respond(self, client, scooter, payload, received):
+        self._stats["commands"] += 1
+        scooter.codec = codec.negotiate(self._codec, payload, received)
+        response = scooter.handle_command(payload)
+        if response is None:
+            self._logger.error(f"Unknown command received: {payload.get('command')}")
+            return
+        reply_topic = payload.get("reply_to") or f"escooter/response/{scooter.scooter_id}"
+        client.publish(reply_topic, codec.encode(response, scooter.codec))
+        self._stats["responses"] += 1
+
+    def _tick(self):
+        abort_probability = self._abort_rate * self._tick_interval / 60.0
+        for scooter in self.scooters.values():
+            if scooter.locked or scooter.server_id is None:
+                continue
+            cause = scooter.tick(self._tick_interval, abort_probability, self._distress_share)
+            if cause is not None:
+                self._client_for(scooter.scooter_id).publish(
+                    f"escooter/response/{scooter.scooter_id}", codec.encode(scooter.build_abort(cause), scooter.codec)
+                )
+                self._stats["aborts"] += 1
+        self._scheduler.call_later(self._tick_interval, self._tick)
@@ -0,0 +1,99 @@
+import time
+import random
+
+from tools import codec
+from controller.StubSenseHAT import StubSenseHAT
+from controller.TemperatureSampler import TemperatureFilter, TEMPERATURE_INVALID
+
+
+STATUS_OK          = 0
+STATUS_BATTERY_LOW = 1
+STATUS_BAD_WEATHER = 2
+STATUS_DISTRESS    = 4
+STATUS_UNLOCKED    = 11
+
+BATTERY_THRESHOLD     = 15
+
+
+class VirtualScooter:
+    """
+    A simulated scooter. Unlike the MainController/State/MQTTClient singletons of the
+    real scooter software, all of its state lives on the instance, so any number of
+    virtual scooters can be hosted in one process. It answers unlock/lock commands
+    like the real scooter and may abort a session due to weather or a crash.
+    Temperature readings go through the same TemperatureFilter as on the real scooter,
+    fed once per tick instead of by a sampler thread of its own.
+    """
+
+    def __init__(self, scooter_id, battery, location, sense_hat=None):
+        self.scooter_id = scooter_id
+        self.battery = battery
+        self.location = location
+        self.sense_hat = sense_hat if sense_hat is not None else StubSenseHAT()
+        self.locked = True
+        self.server_id = None
+        self.codec = codec.CODEC_JSON
+        self.temperature = TemperatureFilter()
+
+    def status(self):
+        if self.battery <= BATTERY_THRESHOLD:
+            return STATUS_BATTERY_LOW
+        return STATUS_OK
+
+    def handle_command(self, payload):
+        """
+        Apply an unlock/lock command and build the response to it.
+        Returns None if the command is unknown.
+        """
+        self.server_id = payload["id"]
+        command = payload["command"]
+
+        if command == "unlock":
+            if self.status() == STATUS_OK and self.locked:
+                self.locked = False
+                self.temperature.reset()
+        elif command == "lock":
+            self.locked = True
+        else:
+            return None
+
+        return self.build_response(request_id=payload.get("request_id"))
+
+    def tick(self, seconds, abort_probability, distress_share):
+        """
+        Advance the simulation of an unlocked scooter by the given number of seconds.
+        Returns the abort cause ("weather" or "distress") if the session is aborted, None otherwise.
+        """
+        if self.locked:
+            return None
+
+        self.battery = max(0, self.battery - seconds / 60.0)
+
+        if self.temperature.add(self.sense_hat.check_temperature()) == TEMPERATURE_INVALID:
+            cause = "weather"
+        elif random.random() < abort_probability:
+            cause = "distress" if random.random() < distress_share else "weather"
+        else:
+            return None
+
+        self.locked = True
+        return cause
+
+    def build_response(self, request_id=None, status=None, abort=False):
+        return {
+            "id": self.server_id,
+            "request_id": request_id,
+            "uuid": self.scooter_id,
+            "battery": int(self.battery),
+            "status": self.status() if status is None else status,
+            "abort": abort,
+            "timestamp": time.time(),
+            "location": {
+                "latitude":  self.location[0],
+                "longitude": self.location[1]
+            }
+        }
+
+    def build_abort(self, cause):
+        status = STATUS_DISTRESS if cause == "distress" else STATUS_BAD_WEATHER
+        return self.build_response(status=status, abort=True)
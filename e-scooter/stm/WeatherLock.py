@@ -4,28 +4,15 @@ from api.mqtt import MQTTClient
 from tools.observer import State
 
 # States
+# The temperature is sampled outside of the state machine (see controller/TemperatureSampler.py),
+# which only sends temperature_invalid when the smoothed temperature drops below the threshold.
 t0 = {
     'source': 'initial',
-    'target': 'idle',
-    'effect': 'start_timer("t", 3_000)'
+    'target': 'idle'
 }
 
 t1 = {
     'source':  'idle',
-    'target':  'awaiting-weather-report',
-    'effect':  'request_temperature()',
-    'trigger': 't'
-}
-
-t2 = {
-    'source':  'awaiting-weather-report',
-    'target':  'idle',
-    'effect':  'start_timer("t", 3_000)',
-    'trigger': 'temperature_valid'
-}
-
-t3 = {
-    'source':  'awaiting-weather-report',
     'target':  'locked',
     'effect':  'lock_scooter()',
     'trigger': 'temperature_invalid'
@@ -36,7 +23,7 @@ def getWeatherTransitions():
     """
     Returns the state machine transitions for the weather lock.
     """
-    return [t0, t1, t2, t3]
+    return [t0, t1]
 
 class WeatherLock:
     """
@@ -50,12 +37,6 @@ class WeatherLock:
         self._mqtt_client = MQTTClient()
         self._state = State()
 
-    def request_temperature(self):
-        """
-        Request a temperature analysis from the main-controller.
-        """
-        self._state.set("awaiting-weather-report")
-    
     def lock_scooter(self):
         """
         Lock the scooter and abort the session.
@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+# The scooter software runs from the e-scooter directory, so its packages are imported
+# as top-level packages, e.g. "from controller.TemperatureSampler import TemperatureFilter".
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
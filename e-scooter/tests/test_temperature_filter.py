@@ -0,0 +1,80 @@
+from threading import Event
+
+from controller.TemperatureSampler import TemperatureFilter, TemperatureSampler, TEMPERATURE_INVALID, TEMPERATURE_VALID
+
+
+def feed(temperature_filter, readings):
+    return [temperature_filter.add(reading) for reading in readings]
+
+
+def test_no_decision_before_half_the_window_is_filled():
+    temperature_filter = TemperatureFilter(window=5, threshold=2.0, hysteresis=1.0)
+    assert feed(temperature_filter, [-10.0, -10.0]) == [None, None]
+    assert temperature_filter.valid
+    assert temperature_filter.add(-10.0) == TEMPERATURE_INVALID
+
+
+def test_a_single_outlier_does_not_lock():
+    temperature_filter = TemperatureFilter(window=5, threshold=2.0, hysteresis=1.0)
+    assert feed(temperature_filter, [10.0, 10.0, 10.0, -40.0, 10.0, 10.0, -40.0, 10.0]) == [None] * 8
+    assert temperature_filter.valid
+
+
+def test_a_single_outlier_does_not_unlock():
+    temperature_filter = TemperatureFilter(window=5, threshold=2.0, hysteresis=1.0)
+    feed(temperature_filter, [-5.0, -5.0, -5.0])
+    assert feed(temperature_filter, [30.0, -5.0, -5.0, 30.0, -5.0]) == [None] * 5
+    assert not temperature_filter.valid
+
+
+def test_hysteresis_rearms():
+    temperature_filter = TemperatureFilter(window=1, threshold=2.0, hysteresis=1.0)
+    readings  = [5.0, 1.9, 1.0, 2.5, 2.9, 3.0, 2.5, 2.0, 1.9, 3.5]
+    crossings = [None, TEMPERATURE_INVALID, None, None, None, TEMPERATURE_VALID, None, None, TEMPERATURE_INVALID, TEMPERATURE_VALID]
+    assert feed(temperature_filter, readings) == crossings
+
+
+def test_hovering_around_the_threshold_crosses_once():
+    temperature_filter = TemperatureFilter(window=3, threshold=2.0, hysteresis=1.0)
+    results = feed(temperature_filter, [1.5, 2.5, 1.5, 2.5, 1.5, 2.5, 1.5, 2.5, 1.5])
+    assert results.count(TEMPERATURE_INVALID) == 1
+    assert TEMPERATURE_VALID not in results
+
+
+def test_reset_clears_the_state():
+    temperature_filter = TemperatureFilter(window=5, threshold=2.0, hysteresis=1.0)
+    feed(temperature_filter, [-5.0, -5.0, -5.0])
+    assert not temperature_filter.valid
+
+    temperature_filter.reset()
+    assert temperature_filter.valid
+    assert temperature_filter.smoothed() is None
+    # The old readings are gone: a fresh half window is needed before a decision
+    assert feed(temperature_filter, [-5.0, -5.0]) == [None, None]
+    assert temperature_filter.add(-5.0) == TEMPERATURE_INVALID
+
+
+def test_smoothed_is_the_median():
+    temperature_filter = TemperatureFilter(window=5)
+    feed(temperature_filter, [3.0, 100.0, 1.0, 2.0, -50.0, 4.0])
+    assert temperature_filter.smoothed() == 2.0
+
+
+def test_sampler_calls_back_on_crossings():
+    readings = iter([-5.0] * 3 + [10.0] * 100)
+    crossings = []
+    done = Event()
+
+    def on_crossing(crossing):
+        crossings.append(crossing)
+        if len(crossings) == 2:
+            done.set()
+
+    sampler = TemperatureSampler(lambda: next(readings), on_crossing, interval=0.1,
+                                 temperature_filter=TemperatureFilter(window=3, threshold=2.0, hysteresis=1.0))
+    sampler.start()
+    try:
+        assert done.wait(timeout=5)
+    finally:
+        sampler.stop()
+    assert crossings == [TEMPERATURE_INVALID, TEMPERATURE_VALID]
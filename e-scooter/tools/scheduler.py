@@ -0,0 +1,50 @@
+import time
+import heapq
+import logging
+import itertools
+from threading import Thread, Condition
+
+
+class Scheduler:
+    """
+    Runs delayed jobs on a single background thread.
+    Used instead of one threading.Timer per job, which does not scale to
+    thousands of simulated scooters.
+    """
+
+    def __init__(self, name="scheduler"):
+        self._logger = logging.getLogger(__name__)
+        self._jobs = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._running = True
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, job, *args):
+        """
+        Run job(*args) after delay seconds.
+        """
+        with self._condition:
+            heapq.heappush(self._jobs, (time.monotonic() + delay, next(self._counter), job, args))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._jobs or self._jobs[0][0] > time.monotonic()):
+                    timeout = self._jobs[0][0] - time.monotonic() if self._jobs else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                _, _, job, args = heapq.heappop(self._jobs)
+            try:
+                job(*args)
+            except Exception as e:
+                self._logger.exception(f"Scheduled job failed: {e}")
@@ -65,29 +65,30 @@ const ActiveRental = () => {
     if (!active) {
       setActive(true);
 
-      const intervalId = setInterval(() => {
-        fetch(`${apiUrl}rental/ok/${id}`)
-          .then((response) => response.json())
-          .then((res) => {
-            const redirect = res.message[1];
-            console.log("message: ", res.message);
-
-            if (res.message[0] === false) {
-              console.log("redirect: ", redirect);
-              console.log("rentalId: ", id);
-              console.log("userId: ", userId);
-
-              clearInterval(intervalId); // Stop the interval before redirecting
-              navigate(`/abort/${redirect}/${id}/${userId}`);
-            } else {
-              console.log("not redirect");
-            }
-          })
-          .catch((error) => console.error("Error:", error));
-      }, 3000);
-
-      // Clear the interval when the component unmounts
-      return () => clearInterval(intervalId);
+      // Status changes (e.g. aborts) are pushed by the server as they happen
+      const events = new EventSource(`${apiUrl}rental/stream/${id}`);
+      events.addEventListener("status", (event) => {
+        const res = JSON.parse((event as MessageEvent).data);
+        const redirect = res.message[1];
+        console.log("message: ", res.message);
+
+        if (res.message[0] === false) {
+          console.log("redirect: ", redirect);
+          console.log("rentalId: ", id);
+          console.log("userId: ", userId);
+
+          events.close(); // Stop listening before redirecting
+          navigate(`/abort/${redirect}/${id}/${userId}`);
+        } else if (redirect === "completed") {
+          events.close(); // The rental was locked, no further events will follow
+        } else {
+          console.log("not redirect");
+        }
+      });
+      events.onerror = (error) => console.error("Error:", error);
+
+      // Close the stream when the component unmounts
+      return () => events.close();
     }
   };
 
@@ -74,6 +74,11 @@ const ErrorPage = () => {
       message: "There was an error with the transaction. Please try again.",
       image: error,
     },
+    "server-busy": {
+      title: "Server Busy",
+      message: "The service is busy right now. Please try again in a moment.",
+      image: error,
+    },
   };
 
   // Function to set the error details based on the error type
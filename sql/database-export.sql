@@ -112,7 +112,7 @@ CREATE TABLE `users` (
 INSERT INTO `users` (`id`, `name`, `funds`) VALUES
 (1, 'John Appleseed', 450.0),
 (2, 'Kari Nordmann', 600.0),
-(3, 'Albert Einstein', 75.5),
+(3, 'Albert Einstein', 75.5);
 
 
 --
@@ -197,15 +197,15 @@ ALTER TABLE `users`
 -- Begrensninger for tabell `corider`
 --
 ALTER TABLE `corider`
-  ADD CONSTRAINT `fk_scooter_id` FOREIGN KEY (`scooter_id`) REFERENCES `scooter` (`id`),
+  ADD CONSTRAINT `fk_scooter_id` FOREIGN KEY (`scooter_id`) REFERENCES `scooters` (`uuid`),
   ADD CONSTRAINT `fk_session_id` FOREIGN KEY (`session_id`) REFERENCES `multisession` (`id`),
-  ADD CONSTRAINT `fk_user_id` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`);
+  ADD CONSTRAINT `fk_user_id` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`);
 
 --
 -- Begrensninger for tabell `multisession`
 --
 ALTER TABLE `multisession`
-  ADD CONSTRAINT `fk_multisession_user_id` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`);
+  ADD CONSTRAINT `fk_multisession_user_id` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`);
 
 --
 -- Begrensninger for tabell `rentals`
@@ -0,0 +1,24 @@
+--
+-- Migration 001: Composite indexes for active-rental lookups
+--
+-- The back-end looks up active rentals by (user_id, is_active) and
+-- (scooter_id, is_active) on every unlock, lock and abort. The single-column
+-- keys on `rentals` force MySQL to read every historic rental of the user or
+-- scooter and filter on is_active. The composite keys below make those lookups
+-- an index range scan, and the EXISTS-checks in database.db are answered from
+-- the index alone (InnoDB appends the primary key `id` to every secondary key).
+--
+-- The composite keys start with user_id/scooter_id, so they also serve the
+-- foreign keys, and the old single-column keys can be dropped.
+--
+-- Like every migration, this one can be applied again to a database which
+-- already has it.
+--
+
+ALTER TABLE `rentals`
+  ADD KEY IF NOT EXISTS `idx_rentals_user_active` (`user_id`, `is_active`),
+  ADD KEY IF NOT EXISTS `idx_rentals_scooter_active` (`scooter_id`, `is_active`);
+
+ALTER TABLE `rentals`
+  DROP KEY IF EXISTS `user_id`,
+  DROP KEY IF EXISTS `scooter_id`;
@@ -0,0 +1,55 @@
+--
+-- Migration 002: Archive table for completed rentals
+--
+-- Completed rentals used to be deleted on every start-up of the back-end with
+-- `DELETE FROM rentals WHERE is_active = 0`, which locked the whole table and
+-- threw away the billing history. Instead, the back-end's archive_service now
+-- moves completed rentals into `rentals_archive` in small batches.
+--
+-- The archive is partitioned by month of `end_time`, so old months can be
+-- dropped or exported per partition. MySQL requires the partitioning column in
+-- every unique key, hence the primary key (id, end_time). Partitioned tables
+-- cannot have foreign keys. The back-end splits new monthly partitions off `pmax`
+-- ahead of time (see db.ensure_archive_partitions).
+--
+
+CREATE TABLE IF NOT EXISTS `rentals_archive` (
+  `id` int(11) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `scooter_id` int(11) NOT NULL,
+  `is_active` tinyint(1) NOT NULL,
+  `start_time` timestamp NULL DEFAULT NULL,
+  `end_time` timestamp NOT NULL DEFAULT '1970-01-01 00:00:01',
+  `total_price` float NOT NULL,
+  PRIMARY KEY (`id`, `end_time`),
+  KEY `idx_rentals_archive_id` (`id`),
+  KEY `idx_rentals_archive_user` (`user_id`, `end_time`),
+  KEY `idx_rentals_archive_scooter` (`scooter_id`, `end_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 COLLATE=latin1_swedish_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(`end_time`)) (
+  PARTITION p202501 VALUES LESS THAN (UNIX_TIMESTAMP('2025-02-01 00:00:00')),
+  PARTITION p202502 VALUES LESS THAN (UNIX_TIMESTAMP('2025-03-01 00:00:00')),
+  PARTITION p202503 VALUES LESS THAN (UNIX_TIMESTAMP('2025-04-01 00:00:00')),
+  PARTITION p202504 VALUES LESS THAN (UNIX_TIMESTAMP('2025-05-01 00:00:00')),
+  PARTITION p202505 VALUES LESS THAN (UNIX_TIMESTAMP('2025-06-01 00:00:00')),
+  PARTITION p202506 VALUES LESS THAN (UNIX_TIMESTAMP('2025-07-01 00:00:00')),
+  PARTITION p202507 VALUES LESS THAN (UNIX_TIMESTAMP('2025-08-01 00:00:00')),
+  PARTITION p202508 VALUES LESS THAN (UNIX_TIMESTAMP('2025-09-01 00:00:00')),
+  PARTITION p202509 VALUES LESS THAN (UNIX_TIMESTAMP('2025-10-01 00:00:00')),
+  PARTITION p202510 VALUES LESS THAN (UNIX_TIMESTAMP('2025-11-01 00:00:00')),
+  PARTITION p202511 VALUES LESS THAN (UNIX_TIMESTAMP('2025-12-01 00:00:00')),
+  PARTITION p202512 VALUES LESS THAN (UNIX_TIMESTAMP('2026-01-01 00:00:00')),
+  PARTITION p202601 VALUES LESS THAN (UNIX_TIMESTAMP('2026-02-01 00:00:00')),
+  PARTITION p202602 VALUES LESS THAN (UNIX_TIMESTAMP('2026-03-01 00:00:00')),
+  PARTITION p202603 VALUES LESS THAN (UNIX_TIMESTAMP('2026-04-01 00:00:00')),
+  PARTITION p202604 VALUES LESS THAN (UNIX_TIMESTAMP('2026-05-01 00:00:00')),
+  PARTITION p202605 VALUES LESS THAN (UNIX_TIMESTAMP('2026-06-01 00:00:00')),
+  PARTITION p202606 VALUES LESS THAN (UNIX_TIMESTAMP('2026-07-01 00:00:00')),
+  PARTITION p202607 VALUES LESS THAN (UNIX_TIMESTAMP('2026-08-01 00:00:00')),
+  PARTITION p202608 VALUES LESS THAN (UNIX_TIMESTAMP('2026-09-01 00:00:00')),
+  PARTITION p202609 VALUES LESS THAN (UNIX_TIMESTAMP('2026-10-01 00:00:00')),
+  PARTITION p202610 VALUES LESS THAN (UNIX_TIMESTAMP('2026-11-01 00:00:00')),
+  PARTITION p202611 VALUES LESS THAN (UNIX_TIMESTAMP('2026-12-01 00:00:00')),
+  PARTITION p202612 VALUES LESS THAN (UNIX_TIMESTAMP('2027-01-01 00:00:00')),
+  PARTITION pmax VALUES LESS THAN MAXVALUE
+);
@@ -0,0 +1,39 @@
+--
+-- Migration 003: Append-only ledger of balance changes
+--
+-- Charges used to be applied as `UPDATE users SET funds = funds - x`,
+-- separately from completing the rental. A retried request therefore charged
+-- twice, and a crash between the two statements left them inconsistent.
+--
+-- Every change to a user's balance is now appended to `transactions` in the
+-- same database transaction as the change itself. `users`.`funds` is kept as a
+-- cache of the sum of the user's entries, and the back-end can rebuild it from
+-- the ledger (db.rebuild_balances). The unique idempotency key makes a charge
+-- apply at most once. Rental charges use the key "rental-<rental id>".
+--
+-- `rental_id` has no foreign key, because completed rentals are moved to
+-- `rentals_archive`.
+--
+
+CREATE TABLE IF NOT EXISTS `transactions` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `user_id` int(11) NOT NULL,
+  `rental_id` int(11) DEFAULT NULL,
+  `amount` decimal(12,2) NOT NULL,
+  `kind` enum('opening','deposit','charge') NOT NULL,
+  `idempotency_key` varchar(64) NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_transactions_idempotency_key` (`idempotency_key`),
+  KEY `idx_transactions_user` (`user_id`, `id`),
+  KEY `idx_transactions_rental` (`rental_id`),
+  CONSTRAINT `fk_transactions_user_id` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 COLLATE=latin1_swedish_ci;
+
+--
+-- Opening balances, so that rebuilding the balances from the ledger keeps the
+-- funds every user has today.
+--
+
+INSERT IGNORE INTO `transactions` (`user_id`, `rental_id`, `amount`, `kind`, `idempotency_key`)
+SELECT `id`, NULL, `funds`, 'opening', CONCAT('opening-', `id`) FROM `users`;
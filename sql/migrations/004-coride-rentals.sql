@@ -0,0 +1,19 @@
+--
+-- Migration 004: Link co-riders to their rentals
+--
+-- A co-ride is a group of scooters unlocked together by one leader. Every
+-- scooter of the group gets an ordinary row in `rentals`, so status, locking
+-- and charging work the same as for single rides. The group is recorded as one
+-- `multisession` row (the leader's session) with one `corider` row per scooter,
+-- which now references the rental it belongs to.
+--
+-- `rental_id` has no foreign key, because completed rentals are moved to
+-- `rentals_archive`.
+--
+
+ALTER TABLE `corider`
+  ADD COLUMN IF NOT EXISTS `rental_id` int(11) DEFAULT NULL AFTER `session_id`,
+  ADD KEY IF NOT EXISTS `idx_corider_rental` (`rental_id`);
+
+ALTER TABLE `multisession`
+  ADD KEY IF NOT EXISTS `idx_multisession_user_active` (`user_id`, `isActive`);